@@ -1,95 +1,141 @@
+import hashlib
+import logging
 import os
-from openai import OpenAI
-from astro_utils import get_zodiac_sign, get_house_number
+import threading
+import time
+from interpretation_cache import get_cache, fingerprint
+from metrics import timed, record_usage, STAGE_DURATION, STAGE_ERRORS
+from prompt_builder import SYSTEM_PROMPT, build_prompt
+from llm_scheduler import get_scheduler, call_with_retry, PRIORITY_INTERACTIVE, UNAVAILABLE_TEXT
 
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+logger = logging.getLogger(__name__)
 if not OPENAI_API_KEY:
-    raise ValueError("❌ OPENAI_API_KEY не найден в переменных окружения")
-
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-SYSTEM_PROMPT = """
-Ты — продвинутый практический астролог нового поколения. Твоя задача — интерпретировать взаимодействие Нептуна и Сатурна на основе натальных данных пользователя.
-Используй чёткую структуру, минимум «воды», максимум пользы и практичности.
-Формат ответа:
-🧭 <b>Что делать?</b>\n
-🛠️ <b>Как делать?</b>\n
-🎯 <b>Ради чего?</b>\n
-📌 <b>Что нужно, чтобы получить возможность желаемого?</b>\n
-🛡️ <b>Как нейтрализовать риски?</b>\n
-✅ <b>Практические шаги:</b>\n
-
-Внимание:
-- Используй дома и знаки Марса для ответа на вопрос "Как делать?".
-- Используй дома и знаки Юпитера и управителя 9 дома для ответа на вопрос "Ради чего?".
-- Пример: "Сатурн в 8 доме" → дай конкретную рекомендацию (например, «написать антикризисный план»).
-- Пример: "Нептун в 9 доме" → «обратиться к молитве, духовному наставнику».
-- Если дом = 0, напиши, что данных недостаточно.
-- Не выдумывай другие дома, знаки или аспекты. Используй только те значения, которые я тебе передаю.
-
-Используй инструкцию с рекомендациями по домам для Нептуна и Сатурна для ответа на вопрос "Что делать?":
-Нептун:
-в 1 - плавание, активности на природе,
-во 2 - еда (рыба) + вино,
-в 3 - писать (стихи, тесты, посты, книги),
-в 4 - поставить иконы дома, уход за предками, помощь своему Роду,
-в 5 - погрузиться в свое хобби, кулинария, творчество,
-в 6 - уход за собой (пиявки, иголоукалывание),
-в 7 - помощь другу неудачнику, забота о партнере,
-в 8 - энергетические практики (активация чакр),
-в 9 - молитва, церковь,
-в 10 - час явного безделия у всех на виду, лениться,
-в 11 - волонтерство, благотворительность, поддержать единомышленников,
-в 12 - сходить на концерт, единение с природой.
-Сатурн:
-в 1 - физкультура, активный спорт регулярно,
-во 2 - коллекционировать, покупки с запасом,
-в 3 - вести блог, дневники,
-в 4 - деятельность связанная с долгом Родине и Роду (взять на себя ответственность или помочь),
-в 5 - организация праздика, мероприятия, руководить проектом,
-в 6 - диета, аскеза, очистка,
-в 7 - друзьям и партнерам дать слово, подписать с ними договор, выполнить данное вами обещание,
-в 8 - поборот страх, разобраться с долгами, закрыть любые висячие вопросы с другими людьми и их ресурсами,
-в 9 - сходить в церковь, храм, посетить эксклюзивное мероприятие, высшее общество,
-в 10 - взять подчиненного, над кем-то взять ответственность,
-в 11 - вступить в клуб, партию, группу, посетить мероприятие,
-в 12 - нарисовать, визуализировать, проявить эмоцию, страх и найти решение.
-
-Шаблон можно дополнять, но не меняй структуру блоков.
-Старайся дать 4 конкретных пунктов в "Практические шаги".
-Используй HTML для оформления: жирный шрифт — через <b>, курсив — через <i>, абзацы — через \\n.
-"""
+    logger.warning("OPENAI_API_KEY не задан — запросы к ИИ будут отвечать UNAVAILABLE_TEXT")
+
+# Клиенты OpenAI создаются при первом запросе к ИИ или при прогреве (warmup.py):
+# импорт openai — больше половины холодного старта, а /start и расчёт карты без него обходятся.
+_default_clients = None
+_default_lock = threading.Lock()
+
+MODEL = "gpt-4o"
+MAX_COMPLETION_TOKENS = 1000
+
+# Смена промпта или модели делает старые ответы в кэше недоступными
+PROMPT_VERSION = hashlib.sha256(f"{MODEL}\n{SYSTEM_PROMPT}".encode("utf-8")).hexdigest()[:16]
+
+def get_clients():
+    """(OpenAI, AsyncOpenAI) процесса; первый вызов импортирует openai."""
+    global _default_clients
+    if _default_clients is None:
+        with _default_lock:
+            if _default_clients is None:
+                if not OPENAI_API_KEY:
+                    raise ValueError("❌ OPENAI_API_KEY не найден в переменных окружения")
+                from openai import OpenAI, AsyncOpenAI
+                _default_clients = (OpenAI(api_key=OPENAI_API_KEY), AsyncOpenAI(api_key=OPENAI_API_KEY))
+    return _default_clients
+
+def set_clients(client, async_client=None):
+    """Подменить клиентов OpenAI (бенчмарки, нагрузочные тесты)."""
+    global _default_clients
+    with _default_lock:
+        _default_clients = (client, async_client)
+
+def log_usage(prompt, usage):
+    # Оценка по частям рядом с фактом из usage: видно, во что обходится каждый запрос и сработал ли кэш
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    logger.info("Токены запроса: оценка %d (%s), фактически %s, из кэша %s, ответ %s",
+                prompt.tokens, ", ".join(f"{k} {v}" for k, v in prompt.sections.items()),
+                getattr(usage, "prompt_tokens", "?"), getattr(details, "cached_tokens", 0) if details else 0,
+                getattr(usage, "completion_tokens", "?"))
+
+def estimate_tokens(prompt):
+    # Резерв бюджета: оценка промпта плюс предел ответа; точное — из usage
+    return prompt.tokens + MAX_COMPLETION_TOKENS
 
 def generate_transit_message(neptune, saturn, mars, jupiter, aspects):
-    def format_planet(planet):
-        if not isinstance(planet, dict):
-            return "н/д"
-        deg = planet.get("degree")
-        if deg is None:
-            return "н/д"
-        sign = get_zodiac_sign(deg)
-        house = planet.get("house", 0)
-        return f"{deg:.2f}° {sign}, дом {house}"
-
-    user_context = f"""
-Нептун: {format_planet(neptune)}
-Сатурн: {format_planet(saturn)}
-Марс: {format_planet(mars)}
-Юпитер: {format_planet(jupiter)}
-Основные аспекты: {', '.join(aspects[:10]) if aspects else "—"}
-"""
+    cache = get_cache()
+    prompt = build_prompt(neptune, saturn, mars, jupiter, aspects)
+    cache_key = fingerprint(neptune, saturn, mars, jupiter, prompt.aspect_names, salt=PROMPT_VERSION)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        chat_completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_context}
-            ],
-            max_completion_tokens=1000
-        )
-        return chat_completion.choices[0].message.content.strip()
+        with timed("openai"):
+            chat_completion = call_with_retry(
+                get_clients()[0].chat.completions.create,
+                model=MODEL,
+                messages=prompt.messages,
+                max_completion_tokens=MAX_COMPLETION_TOKENS
+            )
+        record_usage(getattr(chat_completion, "usage", None))
+        log_usage(prompt, getattr(chat_completion, "usage", None))
+        message = chat_completion.choices[0].message.content.strip()
+        if message:
+            cache.put(cache_key, message)
+        return message
 
     except Exception as e:
-        return f"🚫 Ошибка при обращении к ИИ: {str(e)}"
+        # Текст исключения — в лог, пользователю — понятное сообщение
+        logger.error("Ошибка при обращении к ИИ: %s", e)
+        return UNAVAILABLE_TEXT
+
+async def stream_transit_message(neptune, saturn, mars, jupiter, aspects, user_id=None, priority=PRIORITY_INTERACTIVE):
+    """То же, что generate_transit_message, но отдаёт текст кусками по мере генерации.
+
+    Запросы идут через llm_scheduler: повторное нажатие того же пользователя — DuplicateRequest,
+    OpenAI недоступен после всех попыток — LLMUnavailable.
+    """
+    cache = get_cache()
+    prompt = build_prompt(neptune, saturn, mars, jupiter, aspects)
+    cache_key = fingerprint(neptune, saturn, mars, jupiter, prompt.aspect_names, salt=PROMPT_VERSION)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield cached
+        return
+
+    async def produce(on_usage):
+        # Одно обращение к OpenAI; планировщик вызывает его заново на каждую попытку
+        started = time.perf_counter()
+        parts = []
+        try:
+            stream = await get_clients()[1].chat.completions.create(
+                model=MODEL,
+                messages=prompt.messages,
+                max_completion_tokens=MAX_COMPLETION_TOKENS,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                # Последний кусок приходит без choices, зато с usage
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    record_usage(usage)
+                    log_usage(prompt, usage)
+                    on_usage(usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not parts:
+                        STAGE_DURATION.observe(time.perf_counter() - started, stage="openai_first_token")
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            STAGE_ERRORS.inc(stage="openai_stream", error=type(e).__name__)
+            raise
+        STAGE_DURATION.observe(time.perf_counter() - started, stage="openai_stream")
+
+        message = "".join(parts).strip()
+        if message:
+            cache.put(cache_key, message)
+
+    async for delta in get_scheduler().stream(
+        cache_key, produce, user_id=user_id, priority=priority, estimated_tokens=estimate_tokens(prompt)
+    ):
+        yield delta
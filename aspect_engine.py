@@ -0,0 +1,132 @@
+import numpy as np
+
+from astro_utils import ASPECTS, ORBIS, PLANETS, PLANET_NAMES
+
+# Единый движок аспектов: матрица угловых расстояний между планетами считается NumPy,
+# орбисы и их сокращение при аспекте через границу знака применяются масками.
+# Наружу — структурированные записи, отсортированные по точности; строки — только в format_aspect.
+
+ASPECT_ANGLES = np.array(sorted(ASPECTS), dtype=np.float64)
+ASPECT_LABELS = [ASPECTS[angle] for angle in sorted(ASPECTS)]
+DEFAULT_ORB = 5
+# Кандидат в аспект рассматривается, только если отклонение меньше этого порога
+CANDIDATE_ORB = 10
+
+PLANET_ORBS = np.array([ORBIS.get(PLANET_NAMES[p], DEFAULT_ORB) for p in PLANETS], dtype=np.float64)
+
+ASPECT_DTYPE = np.dtype([
+    ("chart", np.int64),      # номер карты в пакете (0 для одиночной карты)
+    ("p1", np.uint8),         # индекс первой планеты
+    ("p2", np.uint8),         # индекс второй планеты (транзитной — для кросс-аспектов)
+    ("aspect", np.uint8),     # индекс в ASPECT_ANGLES / ASPECT_LABELS
+    ("separation", np.float64),
+    ("orb", np.float64),
+    ("allowed", np.float64),  # допустимый орбис с учётом сокращения
+    ("exactness", np.float64),  # 1 — точный аспект, 0 — на границе орбиса
+])
+
+
+def _aspect_grid(first, second, first_orbs, second_orbs):
+    """(N, P) × (N, Q) долгот → маска аспектов (N, P, Q, A) и сопутствующие величины."""
+    a = first[:, :, None]
+    b = second[:, None, :]
+    separation = np.abs(a - b)
+    separation = np.where(separation > 180, 360 - separation, separation)
+
+    max_orb = np.maximum(first_orbs[:, None], second_orbs[None, :])[None, :, :, None]
+    through_sign = (np.floor_divide(a, 30) != np.floor_divide(b, 30))[..., None]
+    angles = ASPECT_ANGLES[None, None, None, :]
+    allowed = np.where(
+        through_sign,
+        np.where(angles == 0, max_orb / 2, max_orb * 0.7),
+        max_orb,
+    )
+    allowed = np.broadcast_to(allowed, separation.shape + (len(ASPECT_ANGLES),))
+
+    orb = np.abs(separation[..., None] - angles)
+    mask = (orb < CANDIDATE_ORB) & (orb <= allowed)
+    return mask, separation, orb, allowed
+
+
+def _records(mask, separation, orb, allowed):
+    chart, p1, p2, aspect = np.nonzero(mask)
+    records = np.empty(len(chart), dtype=ASPECT_DTYPE)
+    records["chart"] = chart
+    records["p1"] = p1
+    records["p2"] = p2
+    records["aspect"] = aspect
+    records["separation"] = separation[chart, p1, p2]
+    records["orb"] = orb[chart, p1, p2, aspect]
+    records["allowed"] = allowed[chart, p1, p2, aspect]
+    records["exactness"] = 1 - records["orb"] / records["allowed"]
+    # Внутри карты — от самого точного аспекта; при равенстве сохраняется порядок пар
+    return records[np.lexsort((records["orb"], records["chart"]))]
+
+
+def find_aspects(longitudes, orbs=PLANET_ORBS):
+    """Аспекты внутри каждой карты: (P,) или (N, P) долгот → записи ASPECT_DTYPE."""
+    longitudes = np.atleast_2d(np.asarray(longitudes, dtype=np.float64))
+    orbs = np.asarray(orbs, dtype=np.float64)
+    mask, separation, orb, allowed = _aspect_grid(longitudes, longitudes, orbs, orbs)
+    size = longitudes.shape[1]
+    mask &= np.triu(np.ones((size, size), dtype=bool), k=1)[None, :, :, None]
+    return _records(mask, separation, orb, allowed)
+
+
+def find_cross_aspects(natal, transit, natal_orbs=PLANET_ORBS, transit_orbs=PLANET_ORBS):
+    """Кросс-аспекты натал → транзит для многих карт сразу.
+
+    natal — (N, P) долгот; transit — (Q,) общий для всех карт или (N, Q) свой для каждой.
+    """
+    natal = np.atleast_2d(np.asarray(natal, dtype=np.float64))
+    transit = np.asarray(transit, dtype=np.float64)
+    if transit.ndim == 1:
+        transit = np.broadcast_to(transit, (natal.shape[0], transit.shape[0]))
+    mask, separation, orb, allowed = _aspect_grid(
+        natal, transit, np.asarray(natal_orbs, dtype=np.float64), np.asarray(transit_orbs, dtype=np.float64)
+    )
+    return _records(mask, separation, orb, allowed)
+
+
+def aspect_values(longitudes, p1, p2, aspect, orbs=PLANET_ORBS):
+    """Записи ASPECT_DTYPE для уже известных троек (p1, p2, aspect) одной карты.
+
+    Формулы те же, что в _aspect_grid, поэтому числа совпадают бит в бит с find_aspects.
+    """
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    orbs = np.asarray(orbs, dtype=np.float64)
+    p1, p2, aspect = np.asarray(p1), np.asarray(p2), np.asarray(aspect)
+    a, b = longitudes[p1], longitudes[p2]
+    separation = np.abs(a - b)
+    separation = np.where(separation > 180, 360 - separation, separation)
+
+    max_orb = np.maximum(orbs[p1], orbs[p2])
+    through_sign = np.floor_divide(a, 30) != np.floor_divide(b, 30)
+    angles = ASPECT_ANGLES[aspect]
+    allowed = np.where(through_sign, np.where(angles == 0, max_orb / 2, max_orb * 0.7), max_orb)
+
+    records = np.zeros(len(p1), dtype=ASPECT_DTYPE)
+    records["p1"] = p1
+    records["p2"] = p2
+    records["aspect"] = aspect
+    records["separation"] = separation
+    records["orb"] = np.abs(separation - angles)
+    records["allowed"] = allowed
+    records["exactness"] = 1 - records["orb"] / records["allowed"]
+    return records
+
+
+def format_aspect(record, names, second_names=None):
+    second_names = second_names or names
+    return (
+        f"{names[record['p1']]} {ASPECT_LABELS[record['aspect']]} {second_names[record['p2']]} "
+        f"({record['separation']:.2f}°, орб {record['orb']:.2f}° из допустимых {record['allowed']:.1f}°)"
+    )
+
+
+def calculate_aspects(planets: dict, houses: dict) -> list:
+    """Аспекты карты в виде строк, от самого точного к самому широкому."""
+    names = list(planets.keys())
+    orbs = [ORBIS.get(name, DEFAULT_ORB) for name in names]
+    records = find_aspects(list(planets.values()), orbs)
+    return [format_aspect(record, names) for record in records]
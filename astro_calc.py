@@ -1,77 +1,71 @@
 import swisseph as swe
 import pytz
-from geopy.geocoders import Nominatim
 from datetime import datetime
-import json
-import os
+from geocoder import geocode
+from chart_store import save_chart
+from metrics import timed
+from tz_resolver import timezone_at
 from astro_utils import (
     calculate_planet_positions,
     calculate_houses,
-    calculate_aspects,
     get_zodiac_sign,
     get_house_number
 )
+from aspect_engine import find_aspects
+from natal_chart import NatalChart, PLANET_ORDER
 
 # Настройка эфемерид
 swe.set_ephe_path('.')
 
 def get_coordinates(city):
-    geolocator = Nominatim(user_agent="astro_bot")
-    location = geolocator.geocode(city)
-    if location:
-        return location.latitude, location.longitude
-    else:
-        raise ValueError("Город не найден.")
+    # Кэш + офлайн-справочник, Nominatim только при промахе (см. geocoder.py)
+    with timed("geocode"):
+        return geocode(city)
 
-def convert_to_utc(date_str, time_str, city):
-    local = pytz.timezone("Europe/Moscow")  # В будущем: определять по городу
+def convert_to_utc(date_str, time_str, city, lat=None, lon=None):
+    # Пояс — по координатам города (см. tz_resolver.py), смещение на дату рождения — из pytz
+    local = timezone_at(lat, lon)
     naive_dt = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
     local_dt = local.localize(naive_dt)
     utc_dt = local_dt.astimezone(pytz.utc)
     return utc_dt
 
 def save_user_data(user_data, user_id):
-    os.makedirs("data", exist_ok=True)  # 🆕 создаём папку, если её нет
-    filename = f"data/astro_user_{user_id}.json"
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(user_data, f, indent=4, ensure_ascii=False)
+    # Карты лежат в SQLite (см. chart_store.py), ключ — telegram_id
+    with timed("storage_write"):
+        save_chart(user_data)
 
-def process_user_data(telegram_id, username, date_str, time_str, city):
-    try:
-        lat, lon = get_coordinates(city)
-        utc_dt = convert_to_utc(date_str, time_str, city)
-        jd = swe.julday(utc_dt.year, utc_dt.month, utc_dt.day, utc_dt.hour + utc_dt.minute / 60)
+# Чистый расчёт карты без сети и диска — его можно отдавать в пул процессов (см. executor.py)
+def build_chart(telegram_id, username, date_str, time_str, city, lat, lon):
+    with timed("timezone"):
+        utc_dt = convert_to_utc(date_str, time_str, city, lat, lon)
+    jd = swe.julday(utc_dt.year, utc_dt.month, utc_dt.day, utc_dt.hour + utc_dt.minute / 60)
 
+    with timed("ephemeris"):
         planets = calculate_planet_positions(jd)
+    with timed("houses"):
         houses = calculate_houses(jd, lat, lon)
-        aspects = calculate_aspects(planets, houses)
-
-        for name, degree in planets.items():
-            house = get_house_number(degree, houses["Houses"])
-            planets[name] = {
-                "degree": degree,
-                "house": house
-            }
+    longitudes = [planets[name] for name in PLANET_ORDER]
+    with timed("aspects"):
+        aspects = find_aspects(longitudes)
 
-        user_data = {
-            "telegram_id": telegram_id,
-            "username": username,
-            "birth_date": date_str,
-            "birth_time": time_str,
-            "city": city,
-            "latitude": lat,
-            "longitude": lon,
-            "utc_time": utc_dt.isoformat(),
-            "planets": planets,
-            "houses": houses,
-            "aspects": aspects
-        }
+    return NatalChart.build(
+        telegram_id, username, date_str, time_str, city, lat, lon, utc_dt,
+        longitudes=longitudes,
+        houses=[get_house_number(degree, houses["Houses"]) for degree in longitudes],
+        cusps=houses["Houses"] + [houses["Asc"], houses["MC"]],
+        aspects=aspects,
+    )
 
+def process_user_data(telegram_id, username, date_str, time_str, city):
+    try:
+        lat, lon = get_coordinates(city)
+        user_data = build_chart(telegram_id, username, date_str, time_str, city, lat, lon)
         save_user_data(user_data, telegram_id)
 
         print("✅ Данные пользователя сохранены успешно!")
 
-        return f"data/astro_user_{telegram_id}.json"
+        return telegram_id
 
     except Exception as e:
         print(f"🚫 Ошибка: {e}")
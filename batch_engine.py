@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import swisseph as swe
+
+from astro_utils import PLANETS
+from ephemeris_table import get_ephemeris_table
+
+# Пакетный расчёт карт для всей базы: те же вызовы swisseph, что и в astro_utils,
+# но результат — массивы NumPy, а распределение по домам векторизовано.
+
+swe.set_ephe_path('.')
+
+BatchCharts = namedtuple("BatchCharts", ["longitudes", "cusps", "asc", "mc", "houses"])
+
+CHUNK_SIZE = 2048
+
+
+def body_longitudes(planet, jds):
+    """Долготы одной планеты на (N,) юлианских дней: из таблицы, где она есть, иначе swisseph."""
+    jds = np.asarray(jds, dtype=np.float64)
+    longitudes = np.empty(len(jds), dtype=np.float64)
+    covered = np.zeros(len(jds), dtype=bool)
+    table = get_ephemeris_table()
+    if table is not None and planet in table.planet_index:
+        covered = (jds >= table.jd_start) & (jds < table.jd_end)
+        longitudes[covered] = table.longitudes(planet, jds[covered])
+    for i in np.flatnonzero(~covered).tolist():
+        pos, _ = swe.calc_ut(float(jds[i]), planet)
+        longitudes[i] = pos[0]
+    return longitudes
+
+
+def planet_longitudes(jds):
+    """(N,) юлианских дней → (N, 10) долгот в порядке PLANETS."""
+    jds = np.asarray(jds, dtype=np.float64)
+    longitudes = np.empty((len(jds), len(PLANETS)), dtype=np.float64)
+    for j, planet in enumerate(PLANETS):
+        longitudes[:, j] = body_longitudes(planet, jds)
+    return longitudes
+
+
+def house_cusps(jds, lats, lons):
+    """→ куспиды (N, 12), Asc (N,), MC (N,) по системе Плацидуса."""
+    n = len(jds)
+    cusps = np.empty((n, 12), dtype=np.float64)
+    asc = np.empty(n, dtype=np.float64)
+    mc = np.empty(n, dtype=np.float64)
+    for i, (jd, lat, lon) in enumerate(zip(np.asarray(jds, dtype=np.float64).tolist(),
+                                          np.asarray(lats, dtype=np.float64).tolist(),
+                                          np.asarray(lons, dtype=np.float64).tolist())):
+        houses, ascmc = swe.houses(jd, lat, lon, b'P')
+        cusps[i] = houses
+        asc[i] = ascmc[0]
+        mc[i] = ascmc[1]
+    return cusps, asc, mc
+
+
+def house_numbers(longitudes, cusps):
+    """Векторный аналог get_house_number: (N, P) долгот × (N, 12) куспидов → (N, P) домов 1..12 (0 — не найден).
+
+    Повторяет сравнения скалярной версии один в один, включая переход через 0° Овна,
+    поэтому результат совпадает с ней бит в бит.
+    """
+    degree = np.asarray(longitudes, dtype=np.float64)[:, :, None]
+    start = np.asarray(cusps, dtype=np.float64)[:, None, :]
+    end = np.roll(start, -1, axis=2)
+    inside = np.where(
+        start < end,
+        (start <= degree) & (degree < end),
+        (degree >= start) | (degree < end),
+    )
+    houses = inside.argmax(axis=2).astype(np.uint8) + 1
+    houses[~inside.any(axis=2)] = 0
+    return houses
+
+
+def _compute_chunk(jds, lats, lons):
+    longitudes = planet_longitudes(jds)
+    cusps, asc, mc = house_cusps(jds, lats, lons)
+    return BatchCharts(longitudes, cusps, asc, mc, house_numbers(longitudes, cusps))
+
+
+def compute_charts(jds, lats, lons, workers=None, chunk_size=CHUNK_SIZE):
+    """Карты для массивов (jd, lat, lon). Большие пакеты делятся на части по пулу процессов."""
+    jds = np.asarray(jds, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if not (jds.shape == lats.shape == lons.shape) or jds.ndim != 1:
+        raise ValueError("jds, lats и lons должны быть одномерными массивами одной длины")
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jds) <= chunk_size:
+        return _compute_chunk(jds, lats, lons)
+
+    bounds = range(0, len(jds), chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(
+            _compute_chunk,
+            [jds[i:i + chunk_size] for i in bounds],
+            [lats[i:i + chunk_size] for i in bounds],
+            [lons[i:i + chunk_size] for i in bounds],
+        ))
+    return BatchCharts(*(np.concatenate(column) for column in zip(*parts)))
+
+
+# Проверка совпадения со скалярными функциями и замер скорости
+if __name__ == "__main__":
+    from astro_utils import calculate_planet_positions, calculate_houses, get_house_number
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = np.random.default_rng(0)
+    jds = swe.julday(1950, 1, 1, 0) + rng.uniform(0, 365.25 * 60, n)
+    lats = rng.uniform(-60, 66, n)
+    lons = rng.uniform(-180, 180, n)
+
+    started = time.perf_counter()
+    charts = compute_charts(jds, lats, lons)
+    batch_time = time.perf_counter() - started
+
+    sample = min(n, 1000)
+    started = time.perf_counter()
+    for i in range(sample):
+        planets = calculate_planet_positions(jds[i])
+        houses = calculate_houses(jds[i], lats[i], lons[i])
+        assert list(planets.values()) == charts.longitudes[i].tolist()
+        assert houses["Houses"] == charts.cusps[i].tolist()
+        assert houses["Asc"] == charts.asc[i] and houses["MC"] == charts.mc[i]
+        assert [get_house_number(d, houses["Houses"]) for d in planets.values()] == charts.houses[i].tolist()
+    scalar_time = (time.perf_counter() - started) / sample * n
+
+    print(f"✅ {sample} карт совпали со скалярным расчётом")
+    print(f"Пакетно: {n} карт за {batch_time:.2f} с, скалярно (оценка): {scalar_time:.2f} с")
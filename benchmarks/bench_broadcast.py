@@ -0,0 +1,100 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+import swisseph as swe
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from broadcast import Broadcast, CheckpointStore, TransitComposer, build_bot  # noqa: E402
+from chart_store import ChartStore  # noqa: E402
+from ephemeris_table import EphemerisTable, TABLE_PATH, set_ephemeris_table  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from natal_chart import CHART_DTYPE, NatalChart, fill_aspects  # noqa: E402
+
+# Рассылка против локальной заглушки Bot API: пропускная способность, 429 и повторы после падения.
+#   python benchmarks/bench_broadcast.py --users 20000 --rate 1000 --flood-every 500 --crash-after 5000
+# --rate 25 показывает реальный режим (лимит Telegram), большие значения — предел самой рассылки.
+
+
+def fill_store(path, users, seed=0):
+    rng = np.random.default_rng(seed)
+    records = np.zeros(users, dtype=CHART_DTYPE)
+    records["telegram_id"] = np.arange(1, users + 1)
+    records["longitudes"] = rng.uniform(0, 360, (users, records["longitudes"].shape[1]))
+    records["houses"] = rng.integers(1, 13, (users, records["houses"].shape[1]))
+    records["cusps"] = rng.uniform(0, 360, (users, records["cusps"].shape[1]))
+    fill_aspects(records)
+    store = ChartStore(path)
+    store.put_many([NatalChart(record) for record in records])
+    return store
+
+
+async def run(args, workdir):
+    os.environ["TELEGRAM_BOT_TOKEN"] = "bench"
+    api = await FakeBotAPI(latency=args.latency, flood_every=args.flood_every, retry_after=1).start()
+    os.environ["TELEGRAM_API_URL"] = api.url
+
+    store = fill_store(os.path.join(workdir, "charts.sqlite3"), args.users)
+    checkpoints = CheckpointStore(os.path.join(workdir, "broadcasts.sqlite3"))
+    compose = TransitComposer(datetime(2026, 2, 1), days=args.days)
+
+    def new_broadcast(bot):
+        return Broadcast(bot, store, "bench", compose, checkpoints=checkpoints,
+                         rate=args.rate, concurrency=args.concurrency)
+
+    started = time.perf_counter()
+    try:
+        if args.crash_after:
+            async with build_bot(args.concurrency) as bot:
+                broadcast = new_broadcast(bot)
+                task = asyncio.create_task(broadcast.run())
+                while broadcast.counts["sent"] < args.crash_after and not task.done():
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                print(f"💥 остановлено после {broadcast.counts['sent']} сообщений, "
+                      f"контрольная точка telegram_id={broadcast.last_id}")
+
+        async with build_bot(args.concurrency) as bot:
+            stats = await new_broadcast(bot).run()
+    finally:
+        await api.stop()
+    elapsed = time.perf_counter() - started
+
+    delivered = Counter(call["params"]["chat_id"] for call in api.calls_for("sendMessage", delivered=True))
+    duplicates = sum(count - 1 for count in delivered.values() if count > 1)
+    print(f"Пользователей: {args.users}, с транзитами в окне: {args.users - stats['skipped']}")
+    print(f"Отправлено: {stats['sent']}, ошибок: {stats['failed']}, 429: {len(api.calls_for('sendMessage')) - sum(delivered.values())}")
+    print(f"Доставлено в чаты: {len(delivered)}, повторов после падения: {duplicates}")
+    print(f"Время: {elapsed:.1f} с, {sum(delivered.values()) / elapsed:.0f} сообщений/с (лимит {args.rate:g}/с)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк рассылки")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--table", default=TABLE_PATH, help="таблица эфемерид (без неё транзиты считает swisseph)")
+    parser.add_argument("--days", type=int, default=30, help="окно транзитов, дней")
+    parser.add_argument("--rate", type=float, default=1000, help="лимит сообщений в секунду")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка заглушки Bot API, с")
+    parser.add_argument("--flood-every", type=int, default=0, help="каждый N-й вызов отвечает 429")
+    parser.add_argument("--crash-after", type=int, default=0, help="прервать после N сообщений и продолжить")
+    args = parser.parse_args()
+
+    swe.set_ephe_path('.')
+    if os.path.exists(args.table):
+        set_ephemeris_table(EphemerisTable(args.table))
+    with tempfile.TemporaryDirectory(prefix="astro_broadcast_") as workdir:
+        asyncio.run(run(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_bot_api import FakeBotAPI, callback_update, message_update  # noqa: E402
+from loadtest import free_port  # noqa: E402
+
+# Холодный старт: профиль импорта и время от запуска процесса до первого ответа на /start.
+# Бот запускается как в продакшне (python main.py, BOT_MODE=webhook) против заглушки Bot API;
+# первый апдейт отправляется, как только открылся порт, — так прокси fly.io будит остановленную машину.
+# Следом — данные рождения и кнопка рекомендаций: видно, успел ли прогрев (warmup.py) к этим шагам.
+#   python benchmarks/bench_coldstart.py --runs 5
+#   python benchmarks/bench_coldstart.py --runs 5 --warmup 0 --think 1    # без прогрева
+#   python benchmarks/bench_coldstart.py --profile-only --top 25          # только python -X importtime
+
+APP_MODULES = {os.path.splitext(name)[0] for name in os.listdir(ROOT) if name.endswith(".py")}
+
+
+def child_env(workdir, api_url, port, warmup):
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "coldstart",
+        "OPENAI_API_KEY": "coldstart",
+        "TELEGRAM_API_URL": api_url,
+        "BOT_MODE": "webhook",
+        "WEBHOOK_URL": "",
+        "PORT": str(port),
+        "RECOMMENDATION_MODE": "rules",
+        "CHART_STORE_PATH": os.path.join(workdir, "charts.sqlite3"),
+        "GEOCODE_CACHE_PATH": os.path.join(workdir, "geocode.sqlite3"),
+        "INTERPRETATION_CACHE_PATH": os.path.join(workdir, "interpretations.sqlite3"),
+        "JOB_QUEUE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "WARMUP": str(warmup),
+    })
+    return env
+
+
+# --- профиль импорта ---
+
+def import_profile(module, runs, env):
+    """python -X importtime: собственное и суммарное время модулей (медиана по запускам), мс."""
+    samples = {}
+    walls = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                cwd=ROOT, env=env, capture_output=True, text=True)
+        walls.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        for line in result.stderr.splitlines():
+            match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+            if match:
+                depth = (len(match.group(3)) - 1) // 2
+                samples.setdefault(match.group(4), []).append(
+                    (int(match.group(1)) / 1000, int(match.group(2)) / 1000, depth))
+    profile = {}
+    for name, values in samples.items():
+        profile[name] = {
+            "self": statistics.median(v[0] for v in values),
+            "total": statistics.median(v[1] for v in values),
+            "depth": min(v[2] for v in values),
+        }
+    return profile, statistics.median(walls)
+
+
+def print_profile(module, profile, wall, top):
+    print(f"Импорт {module}: {profile[module]['total']:.0f} мс (процесс целиком {wall * 1000:.0f} мс)")
+    print(f"  Модули бота (суммарно, с зависимостями):")
+    for name, p in sorted(((n, p) for n, p in profile.items() if n in APP_MODULES),
+                          key=lambda item: -item[1]["total"])[:top]:
+        print(f"    {name:<22} {p['total']:7.1f} мс  (собственное {p['self']:.1f})")
+    print(f"  Самые тяжёлые пакеты:")
+    packages = {}
+    for name, p in profile.items():
+        root = name.split(".")[0]
+        if root not in APP_MODULES:
+            packages[root] = packages.get(root, 0) + p["self"]
+    for name, spent in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"    {name:<22} {spent:7.1f} мс")
+
+
+# --- время до первого ответа ---
+
+async def _reply(inbox, pattern, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        call = await asyncio.wait_for(inbox.get(), timeout=max(0.001, deadline - time.monotonic()))
+        if re.search(pattern, str(call["params"].get("text", ""))):
+            return call["at"]
+
+
+async def _wait_http(session, url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"бот завершился с кодом {process.returncode}")
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return time.monotonic()
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.005)
+    raise RuntimeError(f"{url} не ответил за {timeout} с")
+
+
+async def cold_start(args, run):
+    api = await FakeBotAPI(latency=args.telegram_latency).start()
+    port = free_port()
+    chat_id = 1000 + run
+    inbox = api.inbox(chat_id)
+    timings = {}
+    with tempfile.TemporaryDirectory(prefix="astro_coldstart_") as workdir:
+        log = open(os.path.join(workdir, "bot.log"), "w")
+        started = time.monotonic()
+        process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, stdout=log, stderr=subprocess.STDOUT,
+                                   env=child_env(workdir, api.url, port, args.warmup))
+        url = f"http://127.0.0.1:{port}"
+        try:
+            async with aiohttp.ClientSession() as session:
+                listening = await _wait_http(session, f"{url}/ping", process, args.timeout)
+                timings["порт открыт"] = listening - started
+                # Первый апдейт — сразу, не дожидаясь готовности
+                async with session.post(f"{url}/telegram", json=message_update(chat_id, "/start")):
+                    pass
+                ready_task = asyncio.create_task(_wait_ready(session, f"{url}/ready", process, args.timeout))
+                timings["ответ на /start"] = await _reply(inbox, r"^👋", args.timeout) - started
+                ready_at = await ready_task
+                if ready_at is not None:
+                    timings["/ready"] = ready_at - started
+
+                await asyncio.sleep(args.think)
+                sent = time.monotonic()
+                async with session.post(f"{url}/telegram",
+                                        json=message_update(chat_id, "01.02.1990 12:30 Москва")):
+                    pass
+                timings["карта (от сообщения)"] = await _reply(inbox, r"^✅|^⚠️|^❌", args.timeout) - sent
+
+                await asyncio.sleep(args.think)
+                sent = time.monotonic()
+                async with session.post(f"{url}/telegram", json=callback_update(chat_id, "get_recommendations")):
+                    pass
+                timings["рекомендации (от кнопки)"] = await _reply(inbox, r"🧭|^⚠️|^❌", args.timeout) - sent
+        finally:
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+            await api.stop()
+    return timings
+
+
+async def _wait_ready(session, url, process, timeout):
+    # Дерево без /ready (404) — None
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        async with session.get(url) as response:
+            if response.status == 200:
+                return time.monotonic()
+            if response.status == 404:
+                return None
+        await asyncio.sleep(0.005)
+    raise RuntimeError(f"{url} не ответил за {timeout} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="webhook", help="что импортировать для профиля")
+    parser.add_argument("--top", type=int, default=12)
+    parser.add_argument("--warmup", type=int, default=1, choices=[0, 1], help="WARMUP для бота")
+    parser.add_argument("--think", type=float, default=3.0, help="пауза пользователя между шагами, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--target", type=float, default=1.5, help="цель: ответ на /start от запуска процесса, с")
+    parser.add_argument("--profile-only", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="astro_importtime_") as workdir:
+        env = child_env(workdir, "http://127.0.0.1:9", 0, args.warmup)
+        profile, wall = import_profile(args.module, args.runs, env)
+    print_profile(args.module, profile, wall, args.top)
+    if args.profile_only:
+        return
+
+    results = {}
+    for run in range(args.runs):
+        for name, value in asyncio.run(cold_start(args, run)).items():
+            results.setdefault(name, []).append(value)
+    print(f"\nХолодный старт, WARMUP={args.warmup}, медиана по {args.runs} запускам (от запуска процесса):")
+    for name, values in results.items():
+        print(f"  {name:<26} {statistics.median(values):6.2f} с  (max {max(values):.2f})")
+    first = statistics.median(results["ответ на /start"])
+    print(f"Цель {args.target:g} с: {'выполнена' if first <= args.target else 'не выполнена'} ({first:.2f} с)")
+
+
+if __name__ == "__main__":
+    main()
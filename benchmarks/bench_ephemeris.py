@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import swisseph as swe
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from astro_utils import calculate_planet_positions, PLANET_NAMES
+from batch_engine import planet_longitudes
+from ephemeris_table import EphemerisTable, SLOW_PLANETS, TABLE_PATH, set_ephemeris_table
+
+# Сравнение: swisseph напрямую и таблица медленных планет.
+#   python benchmarks/bench_ephemeris.py --table data/slow_planets.eph
+
+
+def timed(func, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", default=TABLE_PATH)
+    parser.add_argument("--charts", type=int, default=2000)
+    args = parser.parse_args()
+
+    swe.set_ephe_path('.')
+    table = EphemerisTable(args.table)
+    rng = np.random.default_rng(0)
+    jds = rng.uniform(table.jd_start, table.jd_end, args.charts)
+
+    # Точность относительно swisseph
+    worst = 0.0
+    for planet in SLOW_PLANETS:
+        exact = np.array([swe.calc_ut(jd, planet)[0][0] for jd in jds.tolist()])
+        error = np.abs((table.longitudes(planet, jds) - exact + 180) % 360 - 180).max() * 3600
+        print(f"{PLANET_NAMES[planet]:>8}: макс. отклонение {error:.3f}″")
+        worst = max(worst, error)
+    print(f"Худшее отклонение: {worst:.3f}″ (при построении: {table.max_error_arcsec:.3f}″)\n")
+
+    # Одна карта: calculate_planet_positions целиком
+    set_ephemeris_table(None)
+    base = timed(lambda: [calculate_planet_positions(jd) for jd in jds.tolist()], 1) / len(jds)
+    set_ephemeris_table(table)
+    fast = timed(lambda: [calculate_planet_positions(jd) for jd in jds.tolist()], 1) / len(jds)
+    print(f"Одна карта:   swisseph {base * 1e6:8.1f} мкс, с таблицей {fast * 1e6:8.1f} мкс, ×{base / fast:.2f}")
+
+    # Транзитный скан: медленные планеты по дням на 5 лет вперёд
+    days = swe.julday(2025, 1, 1, 0) + np.arange(0, 365 * 5, 1.0)
+    base = timed(lambda: [[swe.calc_ut(jd, planet)[0][0] for jd in days.tolist()] for planet in SLOW_PLANETS], 1)
+    fast = timed(lambda: [table.longitudes(planet, days) for planet in SLOW_PLANETS], 5)
+    print(f"Скан 5 лет:   swisseph {base * 1e3:8.1f} мс, с таблицей {fast * 1e3:8.1f} мс, ×{base / fast:.0f}")
+
+    # Пакет карт через batch_engine
+    set_ephemeris_table(None)
+    base = timed(lambda: planet_longitudes(jds), 1)
+    set_ephemeris_table(table)
+    fast = timed(lambda: planet_longitudes(jds), 1)
+    print(f"Пакет {len(jds)}: swisseph {base * 1e3:8.1f} мс, с таблицей {fast * 1e3:8.1f} мс, ×{base / fast:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Бенчмарк конвейера карты: от знака зодиака до ответа ИИ.
+# Сеть не используется: Nominatim и OpenAI заменены заглушками с заданной задержкой,
+# хранилища — во временной папке.
+#
+#   python benchmarks/bench_pipeline.py                       # результат в benchmarks/results/<commit>.json
+#   python benchmarks/bench_pipeline.py --compare benchmarks/results/abc1234.json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+_workdir = tempfile.mkdtemp(prefix="astro_bench_")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ["CHART_STORE_PATH"] = os.path.join(_workdir, "charts.sqlite3")
+os.environ["GEOCODE_CACHE_PATH"] = os.path.join(_workdir, "geocode.sqlite3")
+os.environ["INTERPRETATION_CACHE_POLICY"] = "off"
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import swisseph as swe  # noqa: E402
+
+import ai_interpreter  # noqa: E402
+import astro_calc  # noqa: E402
+from aspect_engine import calculate_aspects, find_aspects  # noqa: E402
+from astro_utils import calculate_planet_positions, calculate_houses, get_zodiac_sign, get_house_number  # noqa: E402
+from geocoder import Geocoder, DiskCache, set_geocoder  # noqa: E402
+from natal_chart import PLANET_ORDER  # noqa: E402
+from stubs import FakeNominatim, FakeOpenAI  # noqa: E402
+from tz_resolver import timezone_at  # noqa: E402
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def measure(func, make_args, iterations, memory_iterations=50):
+    for i in range(min(10, iterations)):
+        func(*make_args(i))
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        args = make_args(i)
+        t0 = time.perf_counter_ns()
+        func(*args)
+        latencies.append((time.perf_counter_ns() - t0) / 1e6)
+    wall = time.perf_counter() - started
+
+    # Пиковую память меряем отдельным коротким прогоном: tracemalloc сильно замедляет код
+    tracemalloc.start()
+    for i in range(min(memory_iterations, iterations)):
+        func(*make_args(i))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": sum(latencies) / len(latencies),
+        "throughput_per_s": iterations / wall if wall else 0.0,
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    swe.set_ephe_path('.')
+
+    nominatim = FakeNominatim(latency=args.geocode_latency)
+    set_geocoder(Geocoder(disk_cache=DiskCache(os.environ["GEOCODE_CACHE_PATH"]), remote=nominatim))
+    openai_stub = FakeOpenAI(latency=args.llm_latency)
+    ai_interpreter.set_clients(openai_stub)
+
+    scale = args.scale
+    jd0 = swe.julday(1950, 1, 1, 0)
+    jds = [jd0 + rng.uniform(0, 365.25 * 60) for _ in range(1000)]
+    coords = [(rng.uniform(-55, 65), rng.uniform(-180, 180)) for _ in range(1000)]
+    degrees = [rng.uniform(0, 360) for _ in range(1000)]
+    cusps = [calculate_houses(jd, lat, lon)["Houses"] for jd, (lat, lon) in zip(jds[:100], coords[:100])]
+    charts = [(calculate_planet_positions(jd), calculate_houses(jd, lat, lon)) for jd, (lat, lon) in zip(jds[:100], coords[:100])]
+    known_cities = ["Москва", "Киев", "Санкт-Петербург", "Минск", "Бердянск", "Алматы", "Берлин", "Женева"]
+
+    def user_args(i):
+        # Доля запросов с новым, ещё не виденным городом — они идут в «удалённый» геокодер
+        city = f"Город-{i}-{rng.random()}" if rng.random() < args.miss_ratio else rng.choice(known_cities)
+        day, month, year = rng.randint(1, 28), rng.randint(1, 12), rng.randint(1950, 2010)
+        return (i, "bench", f"{day:02d}.{month:02d}.{year}", f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}", city)
+
+    def chart_args(i):
+        planets, houses = charts[i % len(charts)]
+        named = {name: {"degree": degree, "house": get_house_number(degree, houses["Houses"])}
+                 for name, degree in planets.items()}
+        return (named["Нептун"], named["Сатурн"], named["Марс"], named["Юпитер"], find_aspects([planets[name] for name in PLANET_ORDER]))
+
+    def quiet_process_user_data(*user):
+        with contextlib.redirect_stdout(io.StringIO()):
+            astro_calc.process_user_data(*user)
+
+    targets = {
+        "get_zodiac_sign": (get_zodiac_sign, lambda i: (degrees[i % 1000],), 50000),
+        "get_house_number": (get_house_number, lambda i: (degrees[i % 1000], cusps[i % 100]), 50000),
+        "timezone_at": (timezone_at, lambda i: coords[i % 1000], 50000),
+        "calculate_planet_positions": (calculate_planet_positions, lambda i: (jds[i % 1000],), 2000),
+        "calculate_houses": (calculate_houses, lambda i: (jds[i % 1000], *coords[i % 1000]), 5000),
+        "calculate_aspects": (calculate_aspects, lambda i: charts[i % 100], 5000),
+        "process_user_data": (quiet_process_user_data, user_args, 300),
+        "generate_transit_message": (ai_interpreter.generate_transit_message, chart_args, 50),
+    }
+
+    results = {}
+    for name, (func, make_args, iterations) in targets.items():
+        if args.only and name not in args.only:
+            continue
+        iterations = max(1, int(iterations * scale))
+        results[name] = measure(func, make_args, iterations)
+        r = results[name]
+        print(f"{name:28} p50 {r['p50_ms']:9.3f} мс  p95 {r['p95_ms']:9.3f}  p99 {r['p99_ms']:9.3f}  "
+              f"{r['throughput_per_s']:10.1f}/с  пик {r['peak_memory_kb']:8.1f} КБ")
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "geocode_latency": args.geocode_latency,
+            "llm_latency": args.llm_latency,
+            "miss_ratio": args.miss_ratio,
+            "scale": args.scale,
+            "seed": args.seed,
+        },
+        "results": results,
+        "stubs": {"geocoder_calls": nominatim.calls, "openai_calls": openai_stub.calls},
+    }
+
+
+def compare(report, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nСравнение с {baseline.get('commit')} ({baseline_path}):")
+    for name, current in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            before, after = previous[metric], current[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            mark = "⚠️" if change > 10 else "  "
+            print(f"{mark} {name:28} {metric:6} {before:9.3f} → {after:9.3f} мс ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера натальной карты")
+    parser.add_argument("--geocode-latency", type=float, default=0.05, help="задержка заглушки Nominatim, с")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="задержка заглушки OpenAI, с")
+    parser.add_argument("--miss-ratio", type=float, default=0.1, help="доля городов, которых нет в кэше")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель числа итераций")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="запустить только перечисленные замеры")
+    parser.add_argument("--output", help="куда сохранить JSON (по умолчанию benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="JSON предыдущего прогона для сравнения")
+    args = parser.parse_args()
+
+    report = run(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"\n💾 {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
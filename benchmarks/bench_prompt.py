@@ -0,0 +1,129 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aspect_engine import format_aspect  # noqa: E402
+from astro_utils import get_zodiac_sign  # noqa: E402
+from natal_chart import CHART_DTYPE, NatalChart, PLANET_ORDER, fill_aspects  # noqa: E402
+from prompt_builder import GUIDES_PROMPT, SYSTEM_PROMPT, build_prompt, count_tokens  # noqa: E402
+from stubs import FakeOpenAI  # noqa: E402
+
+# Размер промпта и время ответа: прежняя сборка запроса против prompt_builder.
+# Запросы идут в заглушку OpenAI, где время зависит от числа токенов промпта,
+# а повторяющийся префикс от --cache-min токенов засчитывается как кэшированный.
+#   python benchmarks/bench_prompt.py --charts 100 --prefill 0.0003
+#   python benchmarks/bench_prompt.py --cache-min 512     # провайдер с более коротким порогом кэша
+
+# Промпт до prompt_builder: без правил для остальных блоков и без описания формата данных в конце
+LEGACY_SYSTEM_PROMPT = "\n" + SYSTEM_PROMPT[:SYSTEM_PROMPT.index("\n\nДанные:")].replace("\n\n" + GUIDES_PROMPT, "") + "\n"
+
+
+def legacy_messages(neptune, saturn, mars, jupiter, aspects):
+    # Прежний промпт получал строки chart["aspects"]
+    aspects = [format_aspect(record, PLANET_ORDER) for record in aspects]
+
+    def format_planet(planet):
+        if not isinstance(planet, dict):
+            return "н/д"
+        deg = planet.get("degree")
+        if deg is None:
+            return "н/д"
+        return f"{deg:.2f}° {get_zodiac_sign(deg)}, дом {planet.get('house', 0)}"
+
+    user_context = f"""
+Нептун: {format_planet(neptune)}
+Сатурн: {format_planet(saturn)}
+Марс: {format_planet(mars)}
+Юпитер: {format_planet(jupiter)}
+Основные аспекты: {', '.join(aspects[:10]) if aspects else "—"}
+"""
+    return [
+        {"role": "system", "content": LEGACY_SYSTEM_PROMPT},
+        {"role": "user", "content": user_context},
+    ]
+
+
+def random_charts(count, seed=0):
+    rng = np.random.default_rng(seed)
+    records = np.zeros(count, dtype=CHART_DTYPE)
+    records["longitudes"] = rng.uniform(0, 360, (count, records["longitudes"].shape[1]))
+    records["houses"] = rng.integers(1, 13, (count, records["houses"].shape[1]))
+    fill_aspects(records)
+    charts = []
+    for record in records:
+        chart = NatalChart(record)
+        planets = chart.planets
+        charts.append((planets["Нептун"], planets["Сатурн"], planets["Марс"], planets["Юпитер"], chart.aspect_records()))
+    return charts
+
+
+def run_layout(name, make_messages, charts, args):
+    stub = FakeOpenAI(latency=args.latency, prefill_per_token=args.prefill, cache_min_tokens=args.cache_min)
+    system, context, prompt, cached, latencies = [], [], [], [], []
+    for chart in charts:
+        messages = make_messages(*chart)
+        system.append(count_tokens(messages[0]["content"]))
+        context.append(count_tokens(messages[1]["content"]))
+        started = time.perf_counter()
+        response = stub.chat.completions.create(model="gpt-4o", messages=messages)
+        latencies.append((time.perf_counter() - started) * 1000)
+        prompt.append(response.usage.prompt_tokens)
+        cached.append(response.usage.prompt_tokens_details.cached_tokens)
+    latencies.sort()
+    result = {
+        "system": statistics.mean(system),
+        "context": statistics.mean(context),
+        "prompt": statistics.mean(prompt),
+        "cached": statistics.mean(cached),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+    }
+    print(f"{name:<10} system {result['system']:6.0f}  данные {result['context']:5.0f}  "
+          f"prompt {result['prompt']:6.0f}  из кэша {result['cached']:6.0f}  "
+          f"p50 {result['p50']:6.1f} мс  p95 {result['p95']:6.1f} мс")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк размера промпта")
+    parser.add_argument("--charts", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="базовая задержка заглушки OpenAI, с")
+    parser.add_argument("--prefill", type=float, default=0.0003, help="добавка за токен промпта, с")
+    parser.add_argument("--cache-min", type=int, default=1024, help="минимальный кэшируемый префикс, токенов")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    charts = random_charts(args.charts, args.seed)
+    print(f"Карт: {args.charts}, аспектов в карте в среднем {statistics.mean(len(c[4]) for c in charts):.1f}")
+    print("Пример данных карты (prompt_builder):")
+    print(build_prompt(*charts[0]).messages[1]["content"])
+    print()
+
+    before = run_layout("прежний", legacy_messages, charts, args)
+    after = run_layout("builder", lambda *chart: build_prompt(*chart).messages, charts, args)
+
+    started = time.perf_counter()
+    for chart in charts:
+        build_prompt(*chart)
+    build_cost = (time.perf_counter() - started) / len(charts) * 1e6
+
+    print()
+    print(f"Токенов промпта: {before['prompt']:.0f} → {after['prompt']:.0f} "
+          f"({after['prompt'] / before['prompt'] - 1:+.0%}), данных карты: "
+          f"{before['context']:.0f} → {after['context']:.0f} (−{1 - after['context'] / before['context']:.0%})")
+    print(f"Некэшированных токенов: {before['prompt'] - before['cached']:.0f} → {after['prompt'] - after['cached']:.0f}")
+    print(f"Время ответа p50: {before['p50']:.1f} → {after['p50']:.1f} мс, p95: {before['p95']:.1f} → {after['p95']:.1f} мс")
+    print(f"Сборка промпта: {build_cost:.0f} мкс")
+    if after["cached"] == 0:
+        print(f"Статичный префикс ≈{after['system']:.0f} токенов — короче порога кэша {args.cache_min}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from natal_chart import CHART_DTYPE, PLANET_ORDER  # noqa: E402
+from synastry import ChartIndex, SIGNATURE, SIMILAR_TOLERANCE, synastry_scores  # noqa: E402
+
+# Похожие карты и синастрия по базе в миллион карт: индекс по корзинам долгот против полного прохода.
+#   python benchmarks/bench_synastry.py --charts 1000000
+#   python benchmarks/bench_synastry.py --charts 100000 --store     # плюс сборка индекса из SQLite
+# Долготы — по средним движениям планет для дат рождения 1950–2010 годов, поэтому Сатурн и Нептун
+# связаны с годом рождения, как в настоящей базе, а не разбросаны равномерно.
+
+# Период обращения по долготе, дни; Меркурий и Венера — около Солнца в пределах элонгации
+PERIODS = {"Солнце": 365.25, "Луна": 27.32, "Марс": 686.98, "Юпитер": 4332.6, "Сатурн": 10759.2,
+           "Уран": 30688.5, "Нептун": 60182.0, "Плутон": 90560.0}
+ELONGATION = {"Меркурий": 28.0, "Венера": 47.0}
+
+
+def mean_longitudes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    days = rng.uniform(0, 60 * 365.25, count)  # дни от 1950 года
+    sun = (280.0 + 360.0 * days / PERIODS["Солнце"]) % 360
+    longitudes = np.empty((count, len(PLANET_ORDER)))
+    for i, name in enumerate(PLANET_ORDER):
+        if name in ELONGATION:
+            longitudes[:, i] = (sun + rng.uniform(-ELONGATION[name], ELONGATION[name], count)) % 360
+        else:
+            longitudes[:, i] = (rng.uniform(0, 360) + 360.0 * days / PERIODS[name]) % 360
+    return longitudes
+
+
+def timings(func, queries):
+    values = []
+    for query in queries:
+        started = time.perf_counter()
+        func(query)
+        values.append((time.perf_counter() - started) * 1000)
+    values.sort()
+    return values[len(values) // 2], values[int(len(values) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк синастрии и похожих карт")
+    parser.add_argument("--charts", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--store", action="store_true", help="собрать индекс из chart_store (SQLite)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    longitudes = mean_longitudes(args.charts, args.seed)
+    telegram_ids = np.arange(1, args.charts + 1)
+
+    started = time.perf_counter()
+    index = ChartIndex(telegram_ids, longitudes)
+    print(f"Индекс: {len(index)} карт за {time.perf_counter() - started:.2f} с, "
+          f"{(index.longitudes.nbytes + index.order.nbytes + index.offsets.nbytes) / 2 ** 20:.0f} МБ")
+
+    if args.store:
+        from chart_store import ChartStore
+        with tempfile.TemporaryDirectory(prefix="astro_synastry_") as workdir:
+            store = ChartStore(os.path.join(workdir, "charts.sqlite3"))
+            records = np.zeros(args.charts, dtype=CHART_DTYPE)
+            records["telegram_id"] = telegram_ids
+            records["longitudes"] = longitudes
+            conn = store._connection()
+            with conn:
+                conn.executemany("INSERT INTO charts (telegram_id, chart, updated_at) VALUES (?, ?, 0)",
+                                 ((int(r["telegram_id"]), r.tobytes()) for r in records))
+            started = time.perf_counter()
+            ChartIndex.from_store(store)
+            print(f"Сборка из SQLite: {time.perf_counter() - started:.2f} с")
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [index.longitudes[i] for i in rng.integers(0, len(index), args.queries)]
+
+    found = [index.similar(q, limit=20)[0] for q in queries]
+    p50, p95 = timings(lambda q: index.similar(q, limit=20), queries)
+    print(f"Похожие {' и '.join(SIGNATURE)} (±{SIMILAR_TOLERANCE:g}°): p50 {p50:.2f} мс, p95 {p95:.2f} мс, "
+          f"найдено в среднем {np.mean(found):.0f}")
+
+    candidates = [len(index.contacts(q)) for q in queries]
+    p50, p95 = timings(lambda q: index.partners(q, limit=20), queries)
+    print(f"Синастрия по кандидатам индекса: p50 {p50:.1f} мс, p95 {p95:.1f} мс, "
+          f"кандидатов в среднем {np.mean(candidates):.0f}")
+
+    started = time.perf_counter()
+    synastry_scores(queries[0], index.longitudes)
+    full = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    sat, nep = (PLANET_ORDER.index(name) for name in SIGNATURE)
+    d = np.abs(index.longitudes[:, [sat, nep]] - queries[0][[sat, nep]]) % 360
+    (np.minimum(d, 360 - d) <= SIMILAR_TOLERANCE).all(axis=1).sum()
+    scan = (time.perf_counter() - started) * 1000
+    print(f"Без индекса: полный проход похожих {scan:.1f} мс, синастрия со всеми картами {full:.0f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+# Локальная заглушка Telegram Bot API для тестов webhook-режима, рассылки и нагрузочных прогонов.
+# Бот подключается к ней через TELEGRAM_API_URL=http://127.0.0.1:<port>.
+# Поддерживает методы, которыми пользуется бот; каждый вызов записывается в calls.
+#
+#   api = FakeBotAPI(latency=0.05, flood_every=0)
+#   await api.start()              # api.url → TELEGRAM_API_URL
+#   api.push_update(message_update(42, "/start"))   # для режима polling
+#   inbox = api.inbox(42)          # сообщения и правки в чат 42 по мере прихода
+#   ...
+#   await api.stop()
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "AstroBot", "username": "astro_test_bot"}
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(chat_id):
+    return {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}", "username": f"user{chat_id}"}
+
+
+def _chat(chat_id):
+    return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+
+def message_update(chat_id, text):
+    """Апдейт с текстовым сообщением (команда или ответ пользователя)."""
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": _chat(chat_id),
+        "from": _user(chat_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(chat_id, data):
+    """Апдейт с нажатием inline-кнопки."""
+    message = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": _chat(chat_id),
+        "from": BOT_USER,
+        "text": "👇 Нажми кнопку ниже, чтобы продолжить:",
+    }
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(chat_id),
+            "chat_instance": str(chat_id),
+            "message": message,
+            "data": data,
+        },
+    }
+
+
+def _decode(value):
+    # PTB шлёт параметры формой, сложные значения — JSON-строками
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, flood_every=0, retry_after=1, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.flood_every = flood_every  # каждый N-й вызов отвечает 429 Too Many Requests
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.calls = []
+        self.inboxes = {}
+        self.updates = asyncio.Queue()
+        self.webhook = None
+        self.runner = None
+        self._counter = 0
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def push_update(self, update):
+        self.updates.put_nowait(update)
+
+    def inbox(self, chat_id):
+        """Очередь вызовов sendMessage/editMessageText для чата (кроме отвеченных 429)."""
+        return self.inboxes.setdefault(chat_id, asyncio.Queue())
+
+    def close_inbox(self, chat_id):
+        self.inboxes.pop(chat_id, None)
+
+    def calls_for(self, method, chat_id=None, delivered=False):
+        """Вызовы метода (для чата); delivered=True — без отвеченных 429."""
+        return [c for c in self.calls
+                if c["method"] == method and (chat_id is None or c["params"].get("chat_id") == chat_id)
+                and not (delivered and c["flooded"])]
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {key: _decode(value) for key, value in (await request.post()).items()}
+        call = {"method": method, "params": params, "at": time.monotonic(), "flooded": False}
+        self.calls.append(call)
+
+        if method != "getUpdates":
+            self._counter += 1
+            if self.flood_every and self._counter % self.flood_every == 0:
+                call["flooded"] = True
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, status=429)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+        if method in ("sendMessage", "editMessageText"):
+            inbox = self.inboxes.get(params.get("chat_id"))
+            if inbox is not None:
+                inbox.put_nowait(call)
+
+        handler = getattr(self, "_" + method, None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        return web.json_response({"ok": True, "result": await handler(params)})
+
+    async def _getMe(self, params):
+        return BOT_USER
+
+    async def _setWebhook(self, params):
+        self.webhook = params.get("url")
+        return True
+
+    async def _deleteWebhook(self, params):
+        self.webhook = None
+        return True
+
+    async def _getUpdates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01)))
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    async def _sendMessage(self, params):
+        return {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(int(params["chat_id"])),
+            "from": BOT_USER,
+            "text": str(params.get("text", "")),
+        }
+
+    async def _editMessageText(self, params):
+        return {
+            "message_id": int(params["message_id"]),
+            "date": int(time.time()),
+            "chat": _chat(int(params["chat_id"])),
+            "from": BOT_USER,
+            "text": str(params.get("text", "")),
+        }
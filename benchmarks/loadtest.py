@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_bot_api import FakeBotAPI, callback_update, message_update  # noqa: E402
+
+# Нагрузочный прогон всего бота: «после рекламного поста N человек за минуту прислали данные рождения».
+# Бот работает отдельным процессом в режиме webhook (webhook.py, настоящие обработчики start,
+# handle_message, handle_transit), Bot API — локальная заглушка (fake_bot_api.py),
+# геокодер и OpenAI внутри процесса бота заменены заглушками (stubs.py) с задержкой и долей ошибок.
+# Каждый виртуальный пользователь: /start → данные рождения → кнопка рекомендаций,
+# следующий шаг — только после ответа бота, как у живого человека.
+#
+#   python benchmarks/loadtest.py --users 100,500,1000,2000,5000 --window 60
+#   python benchmarks/loadtest.py --users 2000 --llm-errors 0.2 --geocode-latency 1.0 --mode llm
+#
+# По каждой ступени: задержки ответов (p50/p95/p99), доля неудач по причинам, задержка event loop
+# бота (из /metrics), память процесса бота и его пула; в конце — ступень, на которой бот «ломается»:
+# неудач больше --max-failures или p95 ответа на данные рождения дольше --slo секунд.
+
+CITIES = ["Москва", "Киев", "Санкт-Петербург", "Минск", "Алматы", "Берлин", "Женева", "Бердянск"]
+
+# Чем закончился шаг: по тексту ответа бота
+SUCCESS = {
+    "start": re.compile(r"^👋"),
+    "chart": re.compile(r"^✅"),
+    "transit": re.compile(r"🧭"),
+    "transit_done": re.compile(r"^❓"),
+    "enrichment": re.compile(r"^✨"),
+}
+FAILURES = [
+    ("перегрузка", re.compile(r"^⚠️ Сейчас слишком много")),
+    ("таймаут бота", re.compile(r"^⚠️ Расчёт занял")),
+    ("формат", re.compile(r"^⚠️ Убедись")),
+    ("нет карты", re.compile(r"^⚠️ Не нашёл")),
+    ("ИИ недоступен", re.compile(r"🚫 Сейчас не получается")),
+    ("повтор", re.compile(r"^⏳ Уже готовлю")),
+    ("ошибка", re.compile(r"^❌|^⚠️ Не удалось")),
+]
+
+
+# --- процесс бота ---
+
+def serve_bot(args):
+    """Дочерний процесс: заглушки геокодера и OpenAI, затем обычный webhook-сервер бота."""
+    import ai_interpreter
+    import webhook
+    from geocoder import DiskCache, Geocoder, set_geocoder
+    from stubs import FakeNominatim, FakeOpenAI
+
+    set_geocoder(Geocoder(disk_cache=DiskCache(os.environ["GEOCODE_CACHE_PATH"]),
+                          remote=FakeNominatim(latency=args.geocode_latency, error_rate=args.geocode_errors)))
+    llm = dict(latency=args.llm_latency, first_token_latency=args.llm_first_token, error_rate=args.llm_errors)
+    ai_interpreter.set_clients(FakeOpenAI(**llm), FakeOpenAI(is_async=True, **llm))
+    asyncio.run(webhook.serve(host="127.0.0.1", port=args.port, url=""))
+
+
+def _rss(pid):
+    # Память процесса бота и его потомков (пул процессов стадии chart), байты
+    total = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return total
+    return total + sum(_rss(child) for child in children)
+
+
+def _lag_histogram(text):
+    # astrobot_event_loop_lag_seconds_bucket{le="0.01"} 12 → {0.01: 12, ...}, плюс сумма и число
+    buckets, total, count = {}, 0.0, 0
+    for line in text.splitlines():
+        if line.startswith("astrobot_event_loop_lag_seconds_bucket"):
+            le = re.search(r'le="([^"]+)"', line).group(1)
+            buckets[float("inf") if le == "+Inf" else float(le)] = float(line.split()[-1])
+        elif line.startswith("astrobot_event_loop_lag_seconds_sum"):
+            total = float(line.split()[-1])
+        elif line.startswith("astrobot_event_loop_lag_seconds_count"):
+            count = int(float(line.split()[-1]))
+    return buckets, total, count
+
+
+def _lag_summary(before, after):
+    buckets = {le: after[0].get(le, 0) - before[0].get(le, 0) for le in after[0]}
+    count = after[2] - before[2]
+    if not count:
+        return {"mean": 0.0, "p50": 0.0, "p99": 0.0}
+
+    def quantile(q):
+        # Верхняя граница корзины, в которую попал квантиль
+        for le in sorted(buckets):
+            if buckets[le] >= q * count:
+                return le
+        return float("inf")
+
+    return {"mean": (after[1] - before[1]) / count, "p50": quantile(0.5), "p99": quantile(0.99)}
+
+
+# --- виртуальные пользователи ---
+
+class Stage:
+    def __init__(self, users):
+        self.users = users
+        self.latencies = {step: [] for step in SUCCESS}
+        self.failures = Counter()
+        self.completed = 0
+
+
+async def _expect(inbox, step, timeout, deadline_failure="нет ответа"):
+    """Ждать ответа бота на шаг: (секунды или None, причина неудачи или None)."""
+    started = time.monotonic()
+    while True:
+        left = timeout - (time.monotonic() - started)
+        try:
+            call = await asyncio.wait_for(inbox.get(), timeout=max(left, 0.001))
+        except asyncio.TimeoutError:
+            return None, deadline_failure
+        text = str(call["params"].get("text", ""))
+        for reason, pattern in FAILURES:
+            if pattern.search(text):
+                return None, reason
+        if SUCCESS[step].search(text):
+            return call["at"] - started, None
+
+
+async def _post(session, url, update):
+    async with session.post(url, json=update) as response:
+        if response.status != 200:
+            raise RuntimeError(f"webhook ответил {response.status}")
+
+
+async def virtual_user(chat_id, stage, api, session, url, args, rng):
+    inbox = api.inbox(chat_id)
+    try:
+        steps = [
+            ("start", message_update(chat_id, "/start")),
+            ("chart", message_update(chat_id, "{:02d}.{:02d}.{} {:02d}:{:02d} {}".format(
+                rng.randint(1, 28), rng.randint(1, 12), rng.randint(1950, 2010), rng.randint(0, 23),
+                rng.randint(0, 59),
+                f"Город-{chat_id}" if rng.random() < args.miss_ratio else rng.choice(CITIES)))),
+            ("transit", callback_update(chat_id, "get_recommendations")),
+        ]
+        for step, update in steps:
+            await _post(session, url, update)
+            latency, failure = await _expect(inbox, step, args.reply_timeout)
+            if failure:
+                stage.failures[f"{step}: {failure}"] += 1
+                return
+            stage.latencies[step].append(latency)
+            if step == "transit":
+                break
+            await asyncio.sleep(rng.uniform(0, args.think))
+        # После ответа на кнопку: замыкающее сообщение и (hybrid) разбор ИИ следом
+        started = time.monotonic()
+        latency, failure = await _expect(inbox, "transit_done", args.reply_timeout)
+        if failure:
+            stage.failures[f"transit_done: {failure}"] += 1
+            return
+        stage.latencies["transit_done"].append(latency + stage.latencies["transit"][-1])
+        if args.mode == "hybrid":
+            latency, failure = await _expect(inbox, "enrichment", args.enrichment_timeout, "не пришёл")
+            if failure:
+                # Ответ по правилам пользователь уже получил — считаем отдельно, не как неудачу
+                stage.failures[f"(разбор ИИ: {failure})"] += 1
+            else:
+                stage.latencies["enrichment"].append(time.monotonic() - started + stage.latencies["transit"][-1])
+        stage.completed += 1
+    except Exception as e:
+        stage.failures[f"клиент: {type(e).__name__}"] += 1
+    finally:
+        api.close_inbox(chat_id)
+
+
+def _percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+async def run_stage(users, first_chat_id, api, bot_url, pid, args):
+    stage = Stage(users)
+    rng = random.Random(args.seed + users)
+    arrivals = sorted(rng.uniform(0, args.window) for _ in range(users))
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async with session.get(f"{bot_url}/metrics") as response:
+            lag_before = _lag_histogram(await response.text())
+        rss = [_rss(pid)]
+        sampling = True
+
+        async def sample_memory():
+            while sampling:
+                rss.append(_rss(pid))
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.create_task(sample_memory())
+        started = time.monotonic()
+
+        async def arrive(i, at):
+            await asyncio.sleep(max(0.0, at - (time.monotonic() - started)))
+            await virtual_user(first_chat_id + i, stage, api, session, f"{bot_url}/telegram", args,
+                               random.Random(rng.random()))
+
+        await asyncio.gather(*(arrive(i, at) for i, at in enumerate(arrivals)))
+        elapsed = time.monotonic() - started
+        sampling = False
+        await sampler
+        rss.append(_rss(pid))
+        async with session.get(f"{bot_url}/metrics") as response:
+            lag = _lag_summary(lag_before, _lag_histogram(await response.text()))
+
+    failed = sum(count for reason, count in stage.failures.items() if not reason.startswith("("))
+    result = {
+        "users": users,
+        "elapsed": elapsed,
+        "failure_rate": failed / users,
+        "failures": dict(stage.failures),
+        "latency": {step: {"p50": _percentile(v, 50), "p95": _percentile(v, 95), "p99": _percentile(v, 99),
+                           "count": len(v)}
+                    for step, v in stage.latencies.items() if v},
+        "loop_lag": lag,
+        "rss_mb": {"start": rss[0] / 2 ** 20, "peak": max(rss) / 2 ** 20, "end": rss[-1] / 2 ** 20},
+    }
+    print_stage(result, args)
+    return result
+
+
+def print_stage(result, args):
+    print(f"\n=== {result['users']} пользователей за {args.window:g} с (прогон {result['elapsed']:.0f} с) ===")
+    for step, s in result["latency"].items():
+        print(f"  {step:<13} p50 {s['p50']:7.2f} с  p95 {s['p95']:7.2f} с  p99 {s['p99']:7.2f} с  ({s['count']})")
+    print(f"  неудачи: {result['failure_rate']:.1%}" +
+          "".join(f"\n    {reason}: {count}" for reason, count in sorted(result["failures"].items())))
+    lag = result["loop_lag"]
+    print(f"  event loop: задержка в среднем {lag['mean'] * 1000:.1f} мс, p50 ≤ {lag['p50'] * 1000:g} мс, "
+          f"p99 ≤ {lag['p99'] * 1000:g} мс")
+    rss = result["rss_mb"]
+    print(f"  память бота: {rss['start']:.0f} → {rss['end']:.0f} МБ (пик {rss['peak']:.0f} МБ)")
+
+
+def collapsed(result, args):
+    chart = result["latency"].get("chart")
+    return result["failure_rate"] > args.max_failures or chart is None or chart["p95"] > args.slo
+
+
+async def wait_ready(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"процесс бота завершился с кодом {process.returncode}")
+            try:
+                async with session.get(f"{url}/ping") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("бот не поднялся")
+
+
+def free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def main_async(args, workdir):
+    api = await FakeBotAPI(latency=args.telegram_latency, flood_every=args.flood_every).start()
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "loadtest",
+        "OPENAI_API_KEY": "loadtest",
+        "TELEGRAM_API_URL": api.url,
+        "CHART_STORE_PATH": os.path.join(workdir, "charts.sqlite3"),
+        "GEOCODE_CACHE_PATH": os.path.join(workdir, "geocode.sqlite3"),
+        "INTERPRETATION_CACHE_PATH": os.path.join(workdir, "interpretations.sqlite3"),
+        "INTERPRETATION_CACHE_POLICY": "off",
+        "JOB_QUEUE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "RECOMMENDATION_MODE": args.mode,
+        "JOB_QUEUE_MODE": "inline",
+    })
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)] + [
+        f"--{name.replace('_', '-')}={getattr(args, name)}"
+        for name in ("geocode_latency", "geocode_errors", "llm_latency", "llm_first_token", "llm_errors")
+    ]
+    log = open(os.path.join(workdir, "bot.log"), "w")
+    process = subprocess.Popen(command, env=env, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+    bot_url = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        await wait_ready(bot_url, process)
+        for n, users in enumerate(args.users):
+            result = await run_stage(users, (n + 1) * 10_000_000, api, bot_url, process.pid, args)
+            results.append(result)
+            if collapsed(result, args) and not args.keep_going:
+                break
+            await asyncio.sleep(args.pause)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        await api.stop()
+
+    broken = next((r["users"] for r in results if collapsed(r, args)), None)
+    print()
+    if broken is None:
+        print(f"Бот выдержал все ступени (до {results[-1]['users']} пользователей за {args.window:g} с)")
+    else:
+        held = [r["users"] for r in results if not collapsed(r, args)]
+        print(f"Бот ломается на {broken} пользователях за {args.window:g} с"
+              + (f"; последняя выдержанная ступень — {held[-1]}" if held else ""))
+    if args.workdir:
+        print(f"Лог бота: {os.path.join(workdir, 'bot.log')}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "stages": results, "collapse_at": broken}, f,
+                      ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота")
+    parser.add_argument("--users", type=lambda s: [int(x) for x in s.split(",")], default=[100, 500, 1000, 2000, 5000],
+                        help="ступени: пользователей за окно, через запятую")
+    parser.add_argument("--window", type=float, default=60, help="за сколько секунд приходят пользователи ступени")
+    parser.add_argument("--think", type=float, default=3.0, help="пауза пользователя между шагами, до N с")
+    parser.add_argument("--mode", default="hybrid", choices=["hybrid", "rules", "llm"], help="RECOMMENDATION_MODE")
+    parser.add_argument("--miss-ratio", type=float, default=0.1, help="доля городов не из справочника")
+    parser.add_argument("--geocode-latency", type=float, default=0.3)
+    parser.add_argument("--geocode-errors", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=8.0, help="полное время ответа OpenAI, с")
+    parser.add_argument("--llm-first-token", type=float, default=1.0)
+    parser.add_argument("--llm-errors", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="задержка заглушки Bot API, с")
+    parser.add_argument("--flood-every", type=int, default=0, help="каждый N-й вызов Bot API отвечает 429")
+    parser.add_argument("--connections", type=int, default=100, help="одновременных HTTP-запросов к webhook")
+    parser.add_argument("--reply-timeout", type=float, default=90, help="сколько ждать ответа на шаг, с")
+    parser.add_argument("--enrichment-timeout", type=float, default=120)
+    parser.add_argument("--slo", type=float, default=10.0, help="предел p95 ответа на данные рождения, с")
+    parser.add_argument("--max-failures", type=float, default=0.01)
+    parser.add_argument("--keep-going", action="store_true", help="не останавливаться на первой сломанной ступени")
+    parser.add_argument("--pause", type=float, default=5.0, help="пауза между ступенями, с")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="папка для хранилищ и лога бота (по умолчанию временная)")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_bot(args)
+        return
+    if args.workdir:
+        os.makedirs(args.workdir, exist_ok=True)
+        asyncio.run(main_async(args, args.workdir))
+    else:
+        with tempfile.TemporaryDirectory(prefix="astro_loadtest_") as workdir:
+            asyncio.run(main_async(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
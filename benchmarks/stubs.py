@@ -0,0 +1,148 @@
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+# Локальные заменители Nominatim и OpenAI с настраиваемой задержкой —
+# чтобы бенчмарки и нагрузочные тесты не ходили в сеть и не тратили токены.
+
+STUB_ANSWER = (
+    "🧭 <b>Что делать?</b>\n"
+    "Сатурн в твоей карте просит структуры: выдели время под один долгосрочный проект.\n\n"
+    "🛠️ <b>Как делать?</b>\n"
+    "Маленькими регулярными шагами, через тело и действие.\n\n"
+    "🎯 <b>Ради чего?</b>\n"
+    "Ради ощущения опоры и смысла.\n\n"
+    "📌 <b>Что нужно, чтобы получить возможность желаемого?</b>\n"
+    "Ясно сформулировать желание и записать его.\n\n"
+    "🛡️ <b>Как нейтрализовать риски?</b>\n"
+    "Не брать на себя лишнего.\n\n"
+    "✅ <b>Практические шаги:</b>\n"
+    "1. Записать желание.\n2. Составить план.\n3. Сделать первый шаг.\n4. Подвести итог через месяц.\n"
+)
+
+
+class FakeNominatim:
+    """geocode(city) с задержкой latency секунд; координаты детерминированы по названию."""
+
+    def __init__(self, latency=0.3, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.calls = 0
+
+    def geocode(self, city):
+        self.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise TimeoutError("Nominatim stub: timeout")
+        rng = random.Random(city)
+        return SimpleNamespace(latitude=rng.uniform(-55, 65), longitude=rng.uniform(-180, 180))
+
+
+# Кэш промпта как у OpenAI: префикс от 1024 токенов, засчитывается кусками по 128
+PROMPT_CACHE_BLOCK = 128
+
+
+def _tokens(text):
+    return len(text) // 3
+
+
+def _usage(answer, messages, cached_tokens=0):
+    prompt_tokens = sum(_tokens(m["content"]) for m in messages)
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=_tokens(answer),
+        total_tokens=prompt_tokens + _tokens(answer),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+    )
+
+
+def _cached_tokens(owner, messages):
+    """Сколько токенов запроса нашлось бы в кэше префиксов: по целым сообщениям с начала."""
+    cached, prefix, tokens = 0, "", 0
+    for message in messages:
+        prefix += f"{message['role']}\0{message['content']}\0"
+        tokens += _tokens(message["content"])
+        if prefix in owner.prefixes and tokens >= owner.cache_min_tokens:
+            cached = tokens // PROMPT_CACHE_BLOCK * PROMPT_CACHE_BLOCK
+        owner.prefixes.add(prefix)
+    return cached
+
+
+def _prefill(owner, messages, cached_tokens):
+    # Чтение промпта моделью: некэшированные токены дороже кэшированных
+    prompt_tokens = sum(_tokens(m["content"]) for m in messages)
+    return owner.prefill_per_token * (prompt_tokens - cached_tokens * (1 - owner.cached_cost))
+
+
+class _Completions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, messages, stream=False, **kwargs):
+        owner = self.owner
+        owner.calls += 1
+        owner.requests.append(messages)
+        cached = _cached_tokens(owner, messages)
+        time.sleep(owner.latency + _prefill(owner, messages, cached))
+        if random.random() < owner.error_rate:
+            raise RuntimeError("OpenAI stub: 500 Internal Server Error")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=owner.answer))],
+            usage=_usage(owner.answer, messages, cached),
+        )
+
+
+class _AsyncCompletions:
+    def __init__(self, owner):
+        self.owner = owner
+
+    async def create(self, messages, stream=False, **kwargs):
+        owner = self.owner
+        owner.calls += 1
+        owner.requests.append(messages)
+        cached = _cached_tokens(owner, messages)
+        await asyncio.sleep((owner.first_token_latency if stream else owner.latency) + _prefill(owner, messages, cached))
+        if random.random() < owner.error_rate:
+            raise RuntimeError("OpenAI stub: 500 Internal Server Error")
+        if not stream:
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=owner.answer))],
+                usage=_usage(owner.answer, messages, cached),
+            )
+        return self._stream(messages, cached)
+
+    async def _stream(self, messages, cached):
+        owner = self.owner
+        pieces = [owner.answer[i:i + owner.chunk_size] for i in range(0, len(owner.answer), owner.chunk_size)]
+        delay = max(owner.latency - owner.first_token_latency, 0) / max(len(pieces), 1)
+        for piece in pieces:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+            await asyncio.sleep(delay)
+        yield SimpleNamespace(choices=[], usage=_usage(owner.answer, messages, cached))
+
+
+class FakeOpenAI:
+    """Подменяет OpenAI/AsyncOpenAI: client.chat.completions.create(...).
+
+    latency — полное время ответа, first_token_latency — до первого куска при stream=True;
+    prefill_per_token — добавка за каждый токен промпта, cached_cost — доля этой добавки
+    для токенов из кэша префиксов (кэшируется префикс не короче cache_min_tokens).
+    """
+
+    def __init__(self, latency=2.0, first_token_latency=0.5, error_rate=0.0, answer=STUB_ANSWER,
+                 chunk_size=12, is_async=False, prefill_per_token=0.0, cached_cost=0.1,
+                 cache_min_tokens=1024):
+        self.latency = latency
+        self.prefill_per_token = prefill_per_token
+        self.cached_cost = cached_cost
+        self.cache_min_tokens = cache_min_tokens
+        self.prefixes = set()
+        self.first_token_latency = first_token_latency
+        self.error_rate = error_rate
+        self.answer = answer
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.requests = []
+        completions = _AsyncCompletions(self) if is_async else _Completions(self)
+        self.chat = SimpleNamespace(completions=completions)
@@ -1,12 +1,23 @@
+import asyncio
 import logging
 import os
-import json
-import threading
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes
-from astro_calc import process_user_data
-from ai_interpreter import generate_transit_message
-from server import app  # импортируем Flask-приложение
+from ai_interpreter import stream_transit_message
+from llm_scheduler import (
+    get_scheduler, DuplicateRequest, DUPLICATE_TEXT, UNAVAILABLE_TEXT, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+)
+from recommendations import render_recommendations, MODE as RECOMMENDATION_MODE
+from job_queue import get_queue
+from executor import run_stage, stage_slot, get_stage, shutdown_stages, StageOverloaded
+from telegram_stream import StreamingReply
+from metrics import timed, timed_handler, monitor_event_loop
+from warmup import mark_ready, start_warmup
+from texts import (
+    OVERLOADED_TEXT, TIMEOUT_TEXT, ENRICHMENT_HEADER, FORMAT_HINT_TEXT, NO_CHART_TEXT, CHART_SAVED_TEXT,
+    CHART_QUEUED_TEXT, CONTINUE_TEXT, WAIT_TEXT, QUESTIONS_TEXT, SIMILAR_TEXT, SIMILAR_NONE_TEXT,
+    recommendations_keyboard,
+)
 
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
@@ -19,6 +30,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# JOB_QUEUE_MODE=queue — расчёт карты и запрос к ИИ уходят задачами в job_queue,
+# их выполняют процессы worker.py и сами отвечают в чат. inline — всё в процессе бота.
+JOB_QUEUE_MODE = os.environ.get("JOB_QUEUE_MODE", "inline")
+
+
+def queued_notifier(message):
+    # Сообщаем об очереди один раз за запрос, даже если ждать пришлось на нескольких стадиях
+    notified = False
+
+    async def notify(position):
+        nonlocal notified
+        if not notified:
+            notified = True
+            await message.reply_text(f"⏳ Сейчас много запросов — ты в очереди (позиция {position}). Ответ придёт автоматически.")
+
+    return notify
+
+
+async def stream_recommendations(bot, chat_id, chart, on_queued, user_id=None, header="", fallback=UNAVAILABLE_TEXT,
+                                 priority=PRIORITY_INTERACTIVE):
+    # Ответ модели появляется в одном сообщении и дописывается по мере генерации.
+    # header уходит вместе с первым куском: если модель ничего не прислала, сообщения не будет
+    reply = StreamingReply(bot, chat_id)
+    async with stage_slot("llm", on_queued=on_queued):
+        try:
+            async for chunk in stream_transit_message(
+                neptune=chart["planets"]["Нептун"],
+                saturn=chart["planets"]["Сатурн"],
+                mars=chart["planets"]["Марс"],
+                jupiter=chart["planets"]["Юпитер"],
+                aspects=chart.aspect_records(),
+                user_id=user_id,
+                priority=priority
+            ):
+                if header and not reply.full_text:
+                    chunk = header + chunk
+                await reply.append(chunk)
+        except DuplicateRequest:
+            raise
+        except asyncio.CancelledError:
+            # Таймаут снаружи (wait_for): последняя правка без курсора, иначе « ▌» так и останется
+            await reply.abort()
+            raise
+        except Exception as e:
+            # Подробности — в лог, пользователю — понятный текст без внутренностей OpenAI
+            logger.error("Ошибка при обращении к ИИ: %s", e)
+            if fallback:
+                await reply.append(f"\n\n{fallback}")
+    return await reply.finish()
+
+
+async def enrich_recommendations(bot, chat_id, chart, user_id):
+    # Фоновое дополнение к ответу по правилам: пользователь уже получил рекомендации,
+    # поэтому ошибки и таймауты только пишутся в лог
+    scheduler = get_scheduler()
+    if not scheduler.reserve(user_id):
+        return  # разбор для этого пользователя уже готовится
+    try:
+        await asyncio.wait_for(
+            stream_recommendations(bot, chat_id, chart, None, user_id=user_id,
+                                   header=ENRICHMENT_HEADER, fallback=None, priority=PRIORITY_BACKGROUND),
+            timeout=get_stage("llm").timeout
+        )
+    except DuplicateRequest:
+        pass
+    except Exception as e:
+        logger.warning("Разбор ИИ не получен: %s", e)
+    finally:
+        scheduler.release(user_id)
+
+
+async def enqueue_recommendations(user_id, chat_id, enrichment):
+    """Задача «рекомендации ИИ» для worker.py; False — у пользователя такая уже ждёт."""
+    payload = {"telegram_id": user_id, "chat_id": chat_id, "enrichment": enrichment}
+    job_id = await run_stage("storage", get_queue().enqueue_unique, "recommendations", payload, "telegram_id")
+    return job_id is not None
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(
@@ -36,6 +124,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
+@timed_handler("handle_message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         text = update.message.text
@@ -44,85 +133,165 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # 👇 Разбиваем текст на дату, время и город
         date_str, time_str, city = text.split(" ", 2)
 
-        # 👇 Вызываем функцию с пятью аргументами
         username = update.message.from_user.username or update.message.from_user.full_name
-        chart_path = process_user_data(
-            telegram_id=user_id,
-            username=username,
-            date_str=date_str,
-            time_str=time_str,
-            city=city
+        on_queued = queued_notifier(update.message)
+        if JOB_QUEUE_MODE == "queue":
+            await run_stage("storage", get_queue().enqueue, "chart", {
+                "telegram_id": user_id, "chat_id": update.effective_chat.id, "username": username,
+                "date": date_str, "time": time_str, "city": city,
+            }, on_queued=on_queued)
+            await update.message.reply_text(CHART_QUEUED_TEXT)
+            return
+
+        # Расчёт карты импортируется здесь, а не при старте: к этому шагу его обычно уже прогрел warmup.py
+        from astro_calc import get_coordinates, build_chart, save_user_data
+
+        # 👇 Геокодинг — в потоках, расчёт карты — в процессах, чтобы не блокировать event loop
+        lat, lon = await run_stage("geocode", get_coordinates, city, on_queued=on_queued)
+        user_data = await run_stage(
+            "chart", build_chart, user_id, username, date_str, time_str, city, lat, lon, on_queued=on_queued
         )
-
-        await update.message.reply_text("✅ Данные сохранены! Натальная карта рассчитана.\nНажми на кнопку ниже, чтобы получить рекомендации:")
-
-        keyboard = [[InlineKeyboardButton("🔮 Получить рекомендации", callback_data="get_recommendations")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await update.message.reply_text("👇 Нажми кнопку ниже, чтобы продолжить:", reply_markup=reply_markup)
-
+        await run_stage("storage", save_user_data, user_data, user_id, on_queued=on_queued)
+
+        with timed("telegram_send"):
+            await update.message.reply_text(CHART_SAVED_TEXT)
+            await update.message.reply_text(CONTINUE_TEXT, reply_markup=recommendations_keyboard())
+
+    except StageOverloaded as e:
+        logging.warning(f"⚠️ Стадия {e} перегружена")
+        await update.message.reply_text(OVERLOADED_TEXT)
+    except asyncio.TimeoutError:
+        logging.error("❌ Превышено время расчёта карты")
+        await update.message.reply_text(TIMEOUT_TEXT)
     except ValueError as e:
         logging.error(f"❌ Ошибка обработки сообщения: {e}")
-        await update.message.reply_text("⚠️ Убедись, что данные введены в правильном формате: ДД.ММ.ГГГГ ЧЧ:ММ Город")
+        await update.message.reply_text(FORMAT_HINT_TEXT)
     except Exception as e:
         logging.error(f"❌ Ошибка обработки сообщения: {e}")
         await update.message.reply_text(f"❌ Ошибка: {e}")
         
 
+@timed_handler("handle_transit")
 async def handle_transit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
 
     user_id = query.from_user.id
     chat_id = update.effective_chat.id
-    chart_path = f"data/astro_user_{user_id}.json"
 
-    try:
-        # Сообщаем, что данные обрабатываются
-        await query.message.reply_text("⏳ Подожди немного, я готовлю рекомендации на основе твоей натальной карты...")
-        
-        # Анимация "печатает..."
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing") 
+    # Повторное нажатие, пока готовится прошлый ответ, — не новый запрос к ИИ.
+    # Пользователь занят сразу, а не когда запрос дойдёт до OpenAI: второе нажатие,
+    # пока первое ждёт карту или место в стадии llm, тоже получит DUPLICATE_TEXT
+    scheduler = get_scheduler()
+    reserved = RECOMMENDATION_MODE == "llm" and JOB_QUEUE_MODE != "queue"
+    if reserved and not scheduler.reserve(user_id):
+        await query.message.reply_text(DUPLICATE_TEXT)
+        return
+    if RECOMMENDATION_MODE == "llm" and not reserved and scheduler.user_in_flight(user_id):
+        await query.message.reply_text(DUPLICATE_TEXT)
+        return
 
-        with open(chart_path, "r", encoding="utf-8") as f:
-            chart = json.load(f)
+    try:
+        if RECOMMENDATION_MODE == "llm" and JOB_QUEUE_MODE == "queue":
+            # Карту загрузит и ответ пришлёт воркер
+            if await enqueue_recommendations(user_id, chat_id, enrichment=False):
+                await query.message.reply_text(WAIT_TEXT)
+            else:
+                await query.message.reply_text(DUPLICATE_TEXT)
+            return
+
+        if RECOMMENDATION_MODE == "llm":
+            # Сообщаем, что данные обрабатываются
+            await query.message.reply_text(WAIT_TEXT)
+
+            # Анимация "печатает..."
+            await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+
+        from chart_store import load_chart
+        on_queued = queued_notifier(query.message)
+        with timed("chart_load"):
+            chart = await run_stage("storage", load_chart, user_id, on_queued=on_queued)
+        if chart is None:
+            await query.message.reply_text(NO_CHART_TEXT)
+            return
 
         saturn = chart["planets"]["Сатурн"]
         mars = chart["planets"]["Марс"]
         jupiter = chart["planets"]["Юпитер"]
-        aspects = chart["aspects"]
+        aspects = chart.aspect_records()
 
         logger.info(f"📌 Данные для анализа: Сатурн={saturn}, Марс={mars}, Юпитер={jupiter}, Аспекты={len(aspects)} шт.")
 
-        message = generate_transit_message(
-            neptune=chart["planets"]["Нептун"],
-            saturn=saturn,
-            mars=mars,
-            jupiter=jupiter,
-            aspects=aspects
-        )
-        if not message or not message.strip():
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text="⚠️ Не удалось сгенерировать рекомендации. Попробуйте ещё раз или обратитесь к поддержке.",
-                parse_mode="HTML"
+        if RECOMMENDATION_MODE == "llm":
+            message = await asyncio.wait_for(
+                stream_recommendations(context.bot, chat_id, chart, on_queued, user_id=user_id),
+                timeout=get_stage("llm").timeout
             )
+            if not message or not message.strip():
+                await context.bot.send_message(
+                    chat_id=chat_id,
+                    text="⚠️ Не удалось сгенерировать рекомендации. Попробуйте ещё раз или обратитесь к поддержке.",
+                    parse_mode="HTML"
+                )
         else:
-            await context.bot.send_message(chat_id=chat_id, text=message, parse_mode="HTML")
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=(
-                "❓ <b>Остались вопросы?</b>\n"
-                "🔹 Заполни короткую форму — и я отвечу, как только смогу 👉 <a href='https://forms.gle/YuCsqzEbuYAQ6eba8'>форма</a>\n"
-                "🤖 Или задай вопрос нашему помощнику: <a href='https://t.me/lifeinastro_bot'>@lifeinastro_bot</a>"
-            ),
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
+            # Ответ по правилам — сразу, без сети; разбор ИИ (hybrid) приходит следом отдельным сообщением
+            with timed("rules_render"):
+                text = render_recommendations(
+                    chart["planets"]["Нептун"], saturn, mars, jupiter, aspects
+                )
+            with timed("telegram_send"):
+                await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+            if RECOMMENDATION_MODE == "hybrid" and JOB_QUEUE_MODE == "queue":
+                await enqueue_recommendations(user_id, chat_id, enrichment=True)
+            elif RECOMMENDATION_MODE == "hybrid" and not scheduler.user_in_flight(user_id):
+                context.application.create_task(
+                    enrich_recommendations(context.bot, chat_id, chart, user_id), update=update
+                )
+        with timed("telegram_send"):
+            await context.bot.send_message(
+                chat_id=chat_id, text=QUESTIONS_TEXT, parse_mode="HTML", disable_web_page_preview=True
+            )
 
 
+    except DuplicateRequest:
+        await query.message.reply_text(DUPLICATE_TEXT)
+    except StageOverloaded as e:
+        logger.warning("Стадия %s перегружена", e)
+        await query.message.reply_text(OVERLOADED_TEXT)
+    except asyncio.TimeoutError:
+        logger.error("Превышено время ожидания рекомендаций")
+        await query.message.reply_text(TIMEOUT_TEXT)
     except Exception as e:
         logger.error("Ошибка анализа транзита: %s", e)
         await query.message.reply_text(f"❌ Ошибка анализа транзита: {e}")
+    finally:
+        if reserved:
+            scheduler.release(user_id)
+
+@timed_handler("similar_command")
+async def similar_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    from chart_store import load_chart
+    from synastry import similar_count, SIMILAR_TOLERANCE
+    user_id = update.effective_user.id
+    try:
+        chart = await run_stage("storage", load_chart, user_id)
+        if chart is None:
+            await update.message.reply_text(NO_CHART_TEXT)
+            return
+        # Поиск по индексу карт (synastry.py): миллисекунды даже на миллионе карт
+        count = await run_stage("storage", similar_count, chart)
+    except StageOverloaded as e:
+        logger.warning("Стадия %s перегружена", e)
+        await update.message.reply_text(OVERLOADED_TEXT)
+        return
+    except asyncio.TimeoutError:
+        logger.error("Превышено время поиска похожих карт")
+        await update.message.reply_text(TIMEOUT_TEXT)
+        return
+    if count:
+        await update.message.reply_text(SIMILAR_TEXT.format(tolerance=SIMILAR_TOLERANCE, count=count), parse_mode="HTML")
+    else:
+        await update.message.reply_text(SIMILAR_NONE_TEXT)
 
 async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     print("🛠️ Команда /about получена")
@@ -183,16 +352,47 @@ async def instruction_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
 
 
-def main() -> None:
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+async def on_startup(application: Application) -> None:
+    # Задержка event loop — в /metrics (astrobot_event_loop_lag_seconds)
+    application.bot_data["loop_monitor"] = asyncio.create_task(monitor_event_loop())
+    # После post_init бот обрабатывает апдейты: /ready отвечает 200, в фоне — прогрев (warmup.py)
+    mark_ready()
+    start_warmup()
 
+
+async def on_shutdown(application: Application) -> None:
+    monitor = application.bot_data.pop("loop_monitor", None)
+    if monitor is not None:
+        monitor.cancel()
+    shutdown_stages()
+
+
+def build_application():
+    # concurrent_updates: без него PTB обрабатывает апдейты строго по одному
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(int(os.environ.get("BOT_CONCURRENT_UPDATES", "256")))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    # TELEGRAM_API_URL — другой адрес Bot API (локальный сервер или заглушка для тестов)
+    api_url = os.environ.get("TELEGRAM_API_URL")
+    if api_url:
+        builder = builder.base_url(api_url.rstrip("/") + "/bot")
+
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("about", about_command))
     app.add_handler(CommandHandler("instruction", instruction_command))
+    app.add_handler(CommandHandler("similar", similar_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_handler(CallbackQueryHandler(handle_transit))
+    return app
+
 
-    app.run_polling()
+def main() -> None:
+    build_application().run_polling()
 
 
 if __name__ == "__main__":
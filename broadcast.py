@@ -0,0 +1,450 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import swisseph as swe
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
+
+from metrics import REGISTRY, Counter
+from rate_limit import AsyncTokenBucket
+from telegram_stream import MESSAGE_LIMIT, balance_html, open_tags, split_point
+from transit_scanner import TransitSamples, format_hit, natal_arrays, natal_targets, scan
+
+logger = logging.getLogger(__name__)
+
+# Рассылка транзитов Сатурна и Нептуна всем пользователям из хранилища карт.
+#
+#   чтение    — карты идут пачками по telegram_id (iter_batches, по ключу), текст для пачки
+#               считается одним вызовом transit_scanner.scan в отдельном потоке;
+#   отправка  — CONCURRENCY отправителей берут токены из общего ведра (лимит Bot API на бота),
+#               части одного сообщения уходят в чат не чаще PER_CHAT_INTERVAL;
+#               429 Retry-After останавливает ведро для всех отправителей;
+#               таймаут не повторяется: сообщение могло дойти, повтор дал бы дубль;
+#   контрольная точка — в SQLite сохраняются наибольший telegram_id, до которого включительно
+#               всё отправлено, и чаты после него, которым сообщение уже ушло. После падения
+#               рассылка продолжается с неё: повторно могут уйти только сообщения, отправленные
+#               за последние CHECKPOINT_EVERY секунд (при SIGINT — ни одного).
+#
+#   python broadcast.py --campaign conjunction-2026-02 --from-date 2026-02-01 --days 30
+
+CHECKPOINT_PATH = os.environ.get("BROADCAST_DB_PATH", "data/broadcasts.sqlite3")
+# Общий лимит Bot API ~30 сообщений в секунду на бота; оставляем запас под ответы бота
+GLOBAL_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+PER_CHAT_INTERVAL = float(os.environ.get("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "64"))
+BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "2000"))
+MAX_RETRIES = 3
+MAX_FLOOD_RETRIES = 10
+CHECKPOINT_EVERY = 2.0   # секунд между записями контрольной точки
+REPORT_EVERY = 10.0      # секунд между строками прогресса в логе
+
+WINDOW_DAYS = 30
+MAX_HITS = 8
+BROADCAST_PLANETS = [swe.SATURN, swe.NEPTUNE]
+
+STATUSES = ("sent", "blocked", "failed", "skipped")
+
+MESSAGES = REGISTRY.register(Counter(
+    "astrobot_broadcast_messages_total", "Сообщения рассылки по результату", ["status"]
+))
+FLOOD_WAITS = REGISTRY.register(Counter(
+    "astrobot_broadcast_retry_after_total", "Ответы 429 Retry-After во время рассылки"
+))
+TIMEOUTS = REGISTRY.register(Counter(
+    "astrobot_broadcast_timeouts_total", "Отправки без ответа Bot API: сообщение могло дойти, учтены как ошибка"
+))
+
+CHECKPOINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    campaign TEXT PRIMARY KEY,
+    last_id INTEGER,
+    sent INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS broadcast_ahead (
+    campaign TEXT NOT NULL,
+    telegram_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (campaign, telegram_id)
+)
+"""
+
+
+class CheckpointStore:
+    """Состояние рассылок: где остановились и сколько отправлено."""
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(CHECKPOINT_SCHEMA)
+
+    def load(self, campaign):
+        self.conn.row_factory = sqlite3.Row
+        try:
+            row = self.conn.execute("SELECT * FROM broadcasts WHERE campaign = ?", (campaign,)).fetchone()
+        finally:
+            self.conn.row_factory = None
+        return dict(row) if row is not None else None
+
+    def load_ahead(self, campaign):
+        """Чаты после контрольной точки, которым сообщение уже ушло: telegram_id → статус."""
+        return dict(self.conn.execute(
+            "SELECT telegram_id, status FROM broadcast_ahead WHERE campaign = ?", (campaign,)
+        ))
+
+    def save(self, campaign, last_id, counts, started_at, ahead=(), finished=False):
+        now = time.time()
+        with self.conn:
+            self.conn.execute("DELETE FROM broadcast_ahead WHERE campaign = ?", (campaign,))
+            self.conn.executemany(
+                "INSERT INTO broadcast_ahead (campaign, telegram_id, status) VALUES (?, ?, ?)",
+                [(campaign, telegram_id, status) for telegram_id, status in ahead],
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO broadcasts "
+                "(campaign, last_id, sent, blocked, failed, skipped, started_at, updated_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (campaign, last_id, *(counts[status] for status in STATUSES), started_at, now,
+                 now if finished else None),
+            )
+
+    def reset(self, campaign):
+        with self.conn:
+            self.conn.execute("DELETE FROM broadcasts WHERE campaign = ?", (campaign,))
+            self.conn.execute("DELETE FROM broadcast_ahead WHERE campaign = ?", (campaign,))
+
+    def close(self):
+        self.conn.close()
+
+
+def _jd(date):
+    return swe.julday(date.year, date.month, date.day, 0.0)
+
+
+class TransitComposer:
+    """Тексты рассылки для пачки карт: ближайшие точные транзиты Сатурна и Нептуна.
+
+    Эфемериды на окно считаются один раз на всю рассылку; карты без транзитов
+    в окне получают None и пропускаются.
+    """
+
+    def __init__(self, date_from, days=WINDOW_DAYS, planets=BROADCAST_PLANETS, max_hits=MAX_HITS):
+        self.samples = TransitSamples(_jd(date_from), _jd(date_from + timedelta(days=days)), planets)
+        self.max_hits = max_hits
+        self.period = f"{date_from:%d.%m.%Y} — {date_from + timedelta(days=days):%d.%m.%Y}"
+
+    def __call__(self, charts):
+        longitudes, cusps = natal_arrays(charts)
+        hits = scan(self.samples, natal_targets(longitudes, cusps))
+        # hits отсортированы по карте, затем по времени — границы карт через searchsorted
+        bounds = np.searchsorted(hits["chart"], np.arange(len(charts) + 1))
+        messages = []
+        for i, chart in enumerate(charts):
+            chart_hits = hits[bounds[i]:bounds[i + 1]][:self.max_hits]
+            messages.append((chart.telegram_id, self.render(chart_hits) if len(chart_hits) else None))
+        return messages
+
+    def render(self, hits):
+        lines = "\n".join(f"• {format_hit(hit)}" for hit in hits)
+        return (
+            "🪐 <b>Сатурн и Нептун: твои точные транзиты</b>\n"
+            f"<i>{self.period}</i>\n\n"
+            f"{lines}\n\n"
+            "В эти дни особенно важно действовать по своим рекомендациям — "
+            "в них Сатурн подскажет, что строить, а Нептун — ради какой мечты."
+        )
+
+
+def split_text(text, limit=MESSAGE_LIMIT):
+    """Разбить HTML на части не длиннее limit по переводам строк, не разрывая теги.
+
+    Теги, открытые к концу части, закрываются в ней и открываются заново в следующей.
+    """
+    parts = []
+    prefix = ""
+    while len(prefix) + len(text) > limit:
+        body = prefix + text
+        cut = split_point(body, limit, start=len(prefix))
+        head = body[:cut]
+        parts.append(balance_html(head))
+        prefix = "".join(tag for _, tag in open_tags(head))
+        text = body[cut:].lstrip("\n")
+    parts.append(prefix + text)
+    return parts
+
+
+class _Job:
+    __slots__ = ("telegram_id", "text", "status")
+
+    def __init__(self, telegram_id, text, status=None):
+        self.telegram_id = telegram_id
+        self.text = text
+        self.status = status  # None — ещё не отправлено
+
+
+class Broadcast:
+    def __init__(self, bot, store, campaign, compose, checkpoints=None, rate=GLOBAL_RATE,
+                 concurrency=CONCURRENCY, batch_size=BATCH_SIZE, per_chat_interval=PER_CHAT_INTERVAL,
+                 max_retries=MAX_RETRIES):
+        self.bot = bot
+        self.store = store
+        self.campaign = campaign
+        self.compose = compose
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.bucket = AsyncTokenBucket(rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+
+        self.counts = dict.fromkeys(STATUSES, 0)  # только задания до контрольной точки
+        self.retry_after = 0
+        self.resume_at = 0.0      # до какого момента ведро остановлено после 429
+        self.pending = deque()    # задания в порядке telegram_id, ещё не вошедшие в контрольную точку
+        self.ahead = {}           # уже отправленные после контрольной точки (из прошлого запуска)
+        self.last_id = None
+        self.started_at = None
+        self.saved_at = 0.0
+        self.sent_this_run = 0
+        self.run_started = None
+
+    async def run(self):
+        """Разослать всем (или продолжить с контрольной точки). Возвращает stats()."""
+        state = self.checkpoints.load(self.campaign)
+        if state is not None:
+            if state["finished_at"] is not None:
+                logger.info("Рассылка %s уже завершена", self.campaign)
+                self._restore(state)
+                return self.stats()
+            self._restore(state)
+            self.ahead = self.checkpoints.load_ahead(self.campaign)
+            logger.info("Продолжаем рассылку %s после telegram_id=%s", self.campaign, self.last_id)
+        self.started_at = self.started_at or time.time()
+        self.run_started = time.monotonic()
+
+        queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        workers = [asyncio.create_task(self._work(queue)) for _ in range(self.concurrency)]
+        reporter = asyncio.create_task(self._report())
+        try:
+            await self._produce(queue)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            self._advance()
+            self.checkpoints.save(self.campaign, self.last_id, self.counts, self.started_at, finished=True)
+        except BaseException:
+            # Отмена (SIGINT) или ошибка — фиксируем всё, что успело уйти подряд
+            self._advance(force=True)
+            raise
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+        stats = self.stats()
+        logger.info("Рассылка %s завершена: %s", self.campaign, stats)
+        return stats
+
+    def _restore(self, state):
+        self.last_id = state["last_id"]
+        self.started_at = state["started_at"]
+        for status in STATUSES:
+            self.counts[status] = state[status]
+
+    async def _produce(self, queue):
+        loop = asyncio.get_running_loop()
+        # Один поток на чтение: соединение SQLite у генератора iter_batches привязано к потоку
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast-reader") as reader:
+            batches = self.store.iter_batches(self.batch_size, after_id=self.last_id)
+            try:
+                while True:
+                    messages = await loop.run_in_executor(reader, self._next_messages, batches)
+                    if messages is None:
+                        return
+                    for telegram_id, text in messages:
+                        status = "skipped" if text is None else self.ahead.pop(telegram_id, None)
+                        job = _Job(telegram_id, text, status)
+                        self.pending.append(job)
+                        if status is None:
+                            await queue.put(job)
+                        elif status == "skipped":
+                            MESSAGES.inc(status=status)
+                    self._advance()
+            finally:
+                await loop.run_in_executor(reader, batches.close)
+
+    def _next_messages(self, batches):
+        charts = next(batches, None)
+        return None if charts is None else self.compose(charts)
+
+    async def _work(self, queue):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            try:
+                status = await self._deliver(job)
+            except Exception as e:
+                # Один сбойный чат не должен останавливать отправителя
+                logger.error("Чат %s: ошибка рассылки: %s", job.telegram_id, e)
+                status = "failed"
+            MESSAGES.inc(status=status)
+            job.status = status
+            self._advance()
+
+    async def _deliver(self, job):
+        for i, part in enumerate(split_text(job.text)):
+            if i:
+                await asyncio.sleep(self.per_chat_interval)
+            status = await self._send(job.telegram_id, part)
+            if status != "sent":
+                return status
+        return "sent"
+
+    async def _send(self, chat_id, text):
+        attempt = 0
+        floods = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML",
+                                            disable_web_page_preview=True)
+                self.sent_this_run += 1
+                return "sent"
+            except RetryAfter as e:
+                floods += 1
+                self._flood_wait(e.retry_after)
+                if floods > MAX_FLOOD_RETRIES:
+                    logger.warning("Чат %s: 429 повторяется, пропускаем", chat_id)
+                    return "failed"
+            except Forbidden:
+                # Пользователь заблокировал бота или удалил чат
+                return "blocked"
+            except BadRequest as e:
+                logger.warning("Чат %s: сообщение отклонено: %s", chat_id, e)
+                return "failed"
+            except TimedOut as e:
+                # Запрос мог дойти до Telegram — повтор рискует задублировать сообщение
+                TIMEOUTS.inc()
+                logger.warning("Чат %s: нет ответа Bot API, не повторяем: %s", chat_id, e)
+                return "failed"
+            except NetworkError as e:
+                if attempt >= self.max_retries:
+                    logger.warning("Чат %s: не удалось отправить после %d попыток: %s", chat_id, attempt + 1, e)
+                    return "failed"
+                await asyncio.sleep(random.uniform(0, 2 ** attempt))
+                attempt += 1
+
+    def _flood_wait(self, retry_after):
+        # 429 касается всего бота: останавливаем общее ведро, но не суммируем паузы
+        # от нескольких отправителей, получивших 429 одновременно
+        self.retry_after += 1
+        FLOOD_WAITS.inc()
+        now = time.monotonic()
+        resume_at = now + float(retry_after)
+        if resume_at > self.resume_at:
+            self.bucket.pause(resume_at - max(now, self.resume_at))
+            self.resume_at = resume_at
+            logger.warning("Bot API: 429, пауза рассылки на %s с", retry_after)
+
+    def _advance(self, force=False):
+        # Контрольная точка — последний telegram_id, до которого всё отправлено подряд.
+        # Отправленные после неё (обогнавшие медленный чат) сохраняются отдельным списком,
+        # чтобы после перезапуска не получить сообщение второй раз
+        while self.pending and self.pending[0].status is not None:
+            job = self.pending.popleft()
+            self.last_id = job.telegram_id
+            self.counts[job.status] += 1
+        now = time.monotonic()
+        if force or now - self.saved_at >= CHECKPOINT_EVERY:
+            self.saved_at = now
+            ahead = [(job.telegram_id, job.status) for job in self.pending if job.status is not None]
+            self.checkpoints.save(self.campaign, self.last_id, self.counts, self.started_at, ahead=ahead)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(REPORT_EVERY)
+            stats = self.stats()
+            logger.info("Рассылка %s: отправлено %d (%.1f/с), заблокировали %d, ошибок %d, 429: %d",
+                        self.campaign, stats["sent"], stats["rate"], stats["blocked"], stats["failed"],
+                        stats["retry_after"])
+
+    def stats(self):
+        elapsed = time.monotonic() - self.run_started if self.run_started is not None else 0.0
+        return dict(
+            self.counts,
+            campaign=self.campaign,
+            last_id=self.last_id,
+            retry_after=self.retry_after,
+            elapsed=elapsed,
+            rate=self.sent_this_run / elapsed if elapsed > 0 else 0.0,
+        )
+
+
+def build_bot(concurrency=CONCURRENCY):
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise ValueError("❌ TELEGRAM_BOT_TOKEN не найден в переменных окружения")
+    # Пул соединений по числу отправителей — по умолчанию у PTB одно соединение на бота
+    request = HTTPXRequest(connection_pool_size=concurrency)
+    api_url = os.environ.get("TELEGRAM_API_URL")
+    if api_url:
+        return Bot(token, base_url=api_url.rstrip("/") + "/bot", request=request)
+    return Bot(token, request=request)
+
+
+async def run_broadcast(campaign, date_from, days=WINDOW_DAYS, restart=False, rate=GLOBAL_RATE,
+                        concurrency=CONCURRENCY, store=None, bot=None):
+    from chart_store import get_store
+
+    checkpoints = CheckpointStore()
+    if restart:
+        checkpoints.reset(campaign)
+    bot = bot or build_bot(concurrency)
+    try:
+        async with bot:
+            broadcast = Broadcast(bot, store or get_store(), campaign, TransitComposer(date_from, days),
+                                  checkpoints=checkpoints, rate=rate, concurrency=concurrency)
+            return await broadcast.run()
+    finally:
+        checkpoints.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Рассылка транзитов Сатурна и Нептуна всем пользователям")
+    parser.add_argument("--campaign", required=True, help="имя рассылки — по нему продолжается прерванная")
+    parser.add_argument("--from-date", default=datetime.now(timezone.utc).strftime("%Y-%m-%d"), help="начало окна, ГГГГ-ММ-ДД")
+    parser.add_argument("--days", type=int, default=WINDOW_DAYS, help="длина окна транзитов, дней")
+    parser.add_argument("--rate", type=float, default=GLOBAL_RATE, help="сообщений в секунду на бота")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--restart", action="store_true", help="начать рассылку заново")
+    args = parser.parse_args()
+
+    swe.set_ephe_path('.')
+    stats = asyncio.run(run_broadcast(
+        args.campaign, datetime.strptime(args.from_date, "%Y-%m-%d"), days=args.days,
+        restart=args.restart, rate=args.rate, concurrency=args.concurrency,
+    ))
+    print(f"✅ {stats['campaign']}: отправлено {stats['sent']}, заблокировали {stats['blocked']}, "
+          f"ошибок {stats['failed']}, без транзитов {stats['skipped']}, 429: {stats['retry_after']}, "
+          f"{stats['rate']:.1f} сообщений/с")
@@ -0,0 +1,242 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from natal_chart import CHART_DTYPE, NatalChart
+
+# Хранилище натальных карт: одна таблица SQLite (WAL) вместо файла на пользователя.
+# Карта лежит одной бинарной записью NatalChart фиксированного размера (см. natal_chart.py),
+# имя и город — в своих текстовых колонках (без ограничения длины), ключ — telegram_id.
+# Чтение — NatalChart поверх bytes из SQLite, без разбора JSON.
+
+STORE_PATH = os.environ.get("CHART_STORE_PATH", "data/charts.sqlite3")
+CACHE_SIZE = int(os.environ.get("CHART_CACHE_SIZE", "10000"))
+# Запас на запись, время которой взято до коммита, а коммит пришёлся после сверки кэша
+SYNC_SLACK = 5.0
+LEGACY_DIR = "data"
+
+COLUMNS = "telegram_id, chart, updated_at, username, city"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS charts (
+    telegram_id INTEGER PRIMARY KEY,
+    chart BLOB NOT NULL,
+    updated_at REAL NOT NULL,
+    username TEXT,
+    city TEXT
+)
+"""
+INDEXES = "CREATE INDEX IF NOT EXISTS idx_charts_updated ON charts (updated_at)"
+
+
+def _as_chart(chart):
+    return chart if isinstance(chart, NatalChart) else NatalChart.from_dict(chart)
+
+
+def encode_chart(chart):
+    chart = _as_chart(chart)
+    return chart.telegram_id, chart.to_bytes(), time.time(), chart.username, chart.city
+
+
+def decode_chart(row):
+    return NatalChart.from_buffer(row[1], username=row[3], city=row[4])
+
+
+class ChartStore:
+    def __init__(self, path=STORE_PATH, cache_size=CACHE_SIZE):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.local = threading.local()
+        self.synced_at = time.time()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(SCHEMA)
+        conn.execute(INDEXES)
+        conn.commit()
+
+    def _connection(self):
+        # Своё соединение на поток: писать можно из любого потока стадии storage
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self.local.conn = conn
+        return conn
+
+    def _sync_cache(self, conn):
+        # Карты пишут и другие процессы (worker.py): data_version соединения меняется после
+        # чужого коммита — тогда убираем из кэша карты, изменённые с прошлой сверки
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == getattr(self.local, "data_version", None):
+            return
+        self.local.data_version = version
+        with self.cache_lock:
+            since, self.synced_at = self.synced_at - SYNC_SLACK, time.time()
+            if not self.cache:
+                return
+        changed = conn.execute("SELECT telegram_id FROM charts WHERE updated_at >= ?", (since,)).fetchall()
+        with self.cache_lock:
+            for (telegram_id,) in changed:
+                self.cache.pop(telegram_id, None)
+
+    def _cache_put(self, telegram_id, chart):
+        with self.cache_lock:
+            self.cache[telegram_id] = chart
+            self.cache.move_to_end(telegram_id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def invalidate(self, telegram_id):
+        with self.cache_lock:
+            self.cache.pop(telegram_id, None)
+
+    def put(self, chart):
+        self.put_many([chart])
+
+    def put_many(self, charts):
+        """Сохранить карты: NatalChart или прежние словари."""
+        rows = [encode_chart(chart) for chart in charts]
+        conn = self._connection()
+        with conn:
+            conn.executemany(f"INSERT OR REPLACE INTO charts ({COLUMNS}) VALUES (?, ?, ?, ?, ?)", rows)
+        for row in rows:
+            self.invalidate(row[0])
+
+    def get(self, telegram_id):
+        """NatalChart пользователя (только для чтения — объект общий с кэшем) или None."""
+        self._sync_cache(self._connection())
+        with self.cache_lock:
+            chart = self.cache.get(telegram_id)
+            if chart is not None:
+                self.cache.move_to_end(telegram_id)
+                return chart
+        row = self._connection().execute(
+            f"SELECT {COLUMNS} FROM charts WHERE telegram_id = ?", (telegram_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        chart = decode_chart(row)
+        self._cache_put(telegram_id, chart)
+        return chart
+
+    def get_many(self, telegram_ids):
+        result = {}
+        missing = []
+        self._sync_cache(self._connection())
+        with self.cache_lock:
+            for telegram_id in telegram_ids:
+                chart = self.cache.get(telegram_id)
+                if chart is None:
+                    missing.append(telegram_id)
+                else:
+                    result[telegram_id] = chart
+        conn = self._connection()
+        # Ограничение SQLite на число параметров — читаем кусками
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            rows = conn.execute(
+                f"SELECT {COLUMNS} FROM charts WHERE telegram_id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            for row in rows:
+                result[row[0]] = decode_chart(row)
+        return result
+
+    def iter_batches(self, batch_size=1000, after_id=None):
+        """Все карты по возрастанию telegram_id пачками (без OFFSET — по ключу)."""
+        conn = self._connection()
+        last_id = after_id if after_id is not None else -1
+        while True:
+            rows = conn.execute(
+                f"SELECT {COLUMNS} FROM charts WHERE telegram_id > ? ORDER BY telegram_id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            yield [decode_chart(row) for row in rows]
+            last_id = rows[-1][0]
+
+    def iter_records(self, batch_size=1000):
+        """Все карты пачками массивов CHART_DTYPE — для расчётов по всей базе без NatalChart на каждую карту."""
+        cursor = self._connection().execute("SELECT chart FROM charts ORDER BY telegram_id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield np.frombuffer(b"".join(row[0] for row in rows), dtype=CHART_DTYPE)
+
+    def count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM charts").fetchone()[0]
+
+
+def migrate_json_dir(store, directory=LEGACY_DIR, batch_size=1000):
+    """Перенос старых data/astro_user_{id}.json в хранилище. Возвращает число карт."""
+    migrated = 0
+    batch = []
+    for filename in sorted(glob.glob(os.path.join(directory, "astro_user_*.json"))):
+        with open(filename, "r", encoding="utf-8") as f:
+            batch.append(json.load(f))
+        if len(batch) >= batch_size:
+            store.put_many(batch)
+            migrated += len(batch)
+            batch = []
+    if batch:
+        store.put_many(batch)
+        migrated += len(batch)
+    return migrated
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChartStore()
+    return _store
+
+
+def save_chart(user_data):
+    get_store().put(user_data)
+
+
+def load_chart(telegram_id):
+    store = get_store()
+    chart = store.get(telegram_id)
+    if chart is None:
+        # Пользователь из времён JSON-файлов, которого ещё не перенесли
+        legacy_path = os.path.join(LEGACY_DIR, f"astro_user_{telegram_id}.json")
+        if os.path.exists(legacy_path):
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                store.put(json.load(f))
+            chart = store.get(telegram_id)
+    return chart
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Хранилище натальных карт")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="импортировать data/astro_user_*.json")
+    migrate.add_argument("directory", nargs="?", default=LEGACY_DIR)
+    migrate.add_argument("--store", default=STORE_PATH)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    store = ChartStore(args.store)
+    count = migrate_json_dir(store, args.directory)
+    print(f"✅ Перенесено карт: {count} за {time.perf_counter() - started:.1f} с, всего в хранилище: {store.count()}")
@@ -0,0 +1,164 @@
+import argparse
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import swisseph as swe
+
+# Предрассчитанная таблица эфемерид медленных планет.
+# Для каждой планеты и каждого отрезка в SEGMENT_DAYS дней хранятся коэффициенты
+# Чебышёва для долготы. Файл открывается через memmap, поэтому процессы-воркеры
+# делят одни и те же страницы памяти. Вне диапазона таблицы — обычный swisseph.
+#
+# Отрезки короткие (8 дней), потому что swe.calc_ut возвращает видимые долготы
+# с нутацией, у которой есть двухнедельный член: на отрезках в 32 дня ошибка
+# упирается в ~1″, на 8-дневных — ~0.03″. Допуск всё же 10″: без файлов эфемерид
+# swisseph считает по Moshier, и в его выдаче встречаются скачки в пару секунд дуги,
+# которые гладкий полином не повторяет. Для карты это в сотни раз меньше значимого.
+
+SLOW_PLANETS = [swe.JUPITER, swe.SATURN, swe.URANUS, swe.NEPTUNE, swe.PLUTO]
+
+TABLE_PATH = os.environ.get("EPHEMERIS_TABLE_PATH", "data/slow_planets.eph")
+SEGMENT_DAYS = 8.0
+COEFFICIENTS = 9
+TOLERANCE_ARCSEC = 10.0
+
+MAGIC = b"ASTEPH01"
+# magic, jd_start, segment_days, segments, planets, coefficients, max_error_arcsec
+HEADER = struct.Struct("<8sddiiid")
+PLANET_ID = struct.Struct("<i")
+
+
+def _chebyshev_nodes(count):
+    return np.cos(np.pi * (np.arange(count) + 0.5) / count)
+
+
+def _clenshaw(coeffs, x):
+    # Одинаковый порядок операций для скаляров и массивов — результат совпадает бит в бит
+    x2 = 2 * x
+    b1 = 0.0
+    b2 = 0.0
+    for c in coeffs[:0:-1]:
+        b1, b2 = x2 * b1 - b2 + c, b1
+    return x * b1 - b2 + coeffs[0]
+
+
+class EphemerisTable:
+    def __init__(self, path=TABLE_PATH):
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            magic, jd_start, segment_days, segments, planets, coefficients, max_error = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{path}: не файл таблицы эфемерид")
+            planet_ids = [PLANET_ID.unpack(f.read(PLANET_ID.size))[0] for _ in range(planets)]
+        self.path = path
+        self.jd_start = jd_start
+        self.segment_days = segment_days
+        self.segments = segments
+        self.jd_end = jd_start + segments * segment_days
+        self.max_error_arcsec = max_error
+        self.planet_index = {planet: i for i, planet in enumerate(planet_ids)}
+        self.coeffs = np.memmap(
+            path, dtype="<f8", mode="r",
+            offset=HEADER.size + PLANET_ID.size * planets,
+            shape=(planets, segments, coefficients),
+        )
+
+    def covers(self, planet, jd):
+        return planet in self.planet_index and self.jd_start <= jd < self.jd_end
+
+    def longitude(self, planet, jd):
+        offset = (jd - self.jd_start) / self.segment_days
+        segment = int(offset)
+        x = 2 * (offset - segment) - 1
+        coeffs = self.coeffs[self.planet_index[planet], segment].tolist()
+        return _clenshaw(coeffs, x) % 360.0
+
+    def longitudes(self, planet, jds):
+        """Векторная версия longitude; все jds должны попадать в диапазон таблицы."""
+        offset = (np.asarray(jds, dtype=np.float64) - self.jd_start) / self.segment_days
+        segment = offset.astype(np.int64)
+        x = 2 * (offset - segment) - 1
+        coeffs = self.coeffs[self.planet_index[planet]][segment]
+        return np.mod(_clenshaw(list(coeffs.T), x), 360.0)
+
+
+def build_table(path, year_from, year_to, segment_days=SEGMENT_DAYS, coefficients=COEFFICIENTS):
+    jd_start = swe.julday(year_from, 1, 1, 0)
+    jd_end = swe.julday(year_to + 1, 1, 1, 0)
+    segments = int(np.ceil((jd_end - jd_start) / segment_days))
+    nodes = _chebyshev_nodes(coefficients)
+    probes = np.linspace(-1, 1, 2 * coefficients + 1)
+
+    table = np.empty((len(SLOW_PLANETS), segments, coefficients), dtype="<f8")
+    max_error = 0.0
+    for p, planet in enumerate(SLOW_PLANETS):
+        for s in range(segments):
+            start = jd_start + s * segment_days
+            jds = start + (nodes + 1) / 2 * segment_days
+            lon = np.unwrap([swe.calc_ut(jd, planet)[0][0] for jd in jds.tolist()], period=360)
+            coeffs = np.polynomial.chebyshev.chebfit(nodes, lon, coefficients - 1)
+            table[p, s] = coeffs
+
+            # Проверка между узлами: отклонение от swisseph в угловых секундах
+            exact = np.array([swe.calc_ut(jd, planet)[0][0] for jd in (start + (probes + 1) / 2 * segment_days).tolist()])
+            approx = np.polynomial.chebyshev.chebval(probes, coeffs) % 360
+            error = np.abs((approx - exact + 180) % 360 - 180).max() * 3600
+            max_error = max(max_error, error)
+
+    if max_error > TOLERANCE_ARCSEC:
+        raise ValueError(f"Погрешность таблицы {max_error:.3f}″ превышает допуск {TOLERANCE_ARCSEC}″")
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, jd_start, segment_days, segments, len(SLOW_PLANETS), coefficients, max_error))
+        for planet in SLOW_PLANETS:
+            f.write(PLANET_ID.pack(planet))
+        f.write(table.tobytes())
+    os.replace(tmp_path, path)
+    return max_error
+
+
+_table = None
+_table_loaded = False
+_table_lock = threading.Lock()
+
+
+def get_ephemeris_table():
+    """Таблица по EPHEMERIS_TABLE_PATH или None, если файла нет (тогда везде swisseph)."""
+    global _table, _table_loaded
+    if not _table_loaded:
+        with _table_lock:
+            if not _table_loaded:
+                if TABLE_PATH and os.path.exists(TABLE_PATH):
+                    _table = EphemerisTable(TABLE_PATH)
+                _table_loaded = True
+    return _table
+
+
+def set_ephemeris_table(table):
+    """Подменить таблицу (None — всегда считать через swisseph)."""
+    global _table, _table_loaded
+    with _table_lock:
+        _table = table
+        _table_loaded = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Построить таблицу эфемерид медленных планет")
+    parser.add_argument("--from-year", type=int, default=1900)
+    parser.add_argument("--to-year", type=int, default=2100)
+    parser.add_argument("--output", default=TABLE_PATH)
+    args = parser.parse_args()
+
+    swe.set_ephe_path('.')
+    started = time.perf_counter()
+    error = build_table(args.output, args.from_year, args.to_year)
+    size = os.path.getsize(args.output) / 1024 / 1024
+    print(f"✅ {args.output}: {args.from_year}–{args.to_year}, {size:.1f} МБ, "
+          f"макс. погрешность {error:.4f}″, {time.perf_counter() - started:.1f} с")
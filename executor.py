@@ -0,0 +1,258 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import REGISTRY, QUEUE_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Стадии обработки запроса. Сетевые вызовы (геокодинг, OpenAI, диск) идут в потоки,
+# математика swisseph — в процессы, чтобы не держать GIL основного event loop.
+#   kind    — "thread" или "process"
+#   workers — сколько задач стадии выполняется одновременно
+#   queue   — сколько задач может ждать свободного воркера, сверх этого — отказ
+#   timeout — предельное время (ожидание + выполнение), секунды
+STAGES = {
+    "geocode": {"kind": "thread", "workers": 8, "queue": 64, "timeout": 20},
+    "chart": {"kind": "process", "workers": os.cpu_count() or 2, "queue": 128, "timeout": 15},
+    "storage": {"kind": "thread", "workers": 4, "queue": 256, "timeout": 10},
+    "llm": {"kind": "thread", "workers": 16, "queue": 128, "timeout": 90},
+}
+
+
+def _stage_setting(stage, key):
+    # Переопределение через окружение: STAGE_LLM_WORKERS=32, STAGE_CHART_TIMEOUT=30 и т.п.
+    value = os.environ.get(f"STAGE_{stage.upper()}_{key.upper()}")
+    if value is None:
+        return STAGES[stage][key]
+    return float(value) if key == "timeout" else int(value)
+
+
+class StageOverloaded(Exception):
+    """Очередь стадии заполнена — запрос не принят."""
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.kind = STAGES[name]["kind"]
+        self.workers = _stage_setting(name, "workers")
+        self.max_queue = _stage_setting(name, "queue")
+        self.timeout = _stage_setting(name, "timeout")
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.semaphore = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+
+    def _get_pool(self):
+        # Под замком: пул может создать и event loop, и поток прогрева (warmup.py)
+        with self.pool_lock:
+            if self.pool is None:
+                if self.kind == "process":
+                    # spawn, а не fork: в основном процессе уже работают потоки (Flask, httpx)
+                    self.pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                else:
+                    self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"stage-{self.name}")
+            return self.pool
+
+    def _drop_pool(self, pool):
+        # Процесс пула погиб (OOM, падение swisseph) — пул больше не принимает задач,
+        # следующий вызов создаст новый
+        with self.pool_lock:
+            if self.pool is not pool:
+                return
+            self.pool = None
+        logger.error("Стадия %s: пул процессов сломан, создаём заново", self.name)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def prestart(self, func):
+        """Запустить всех воркеров стадии заранее, каждый выполняет func (импорт модулей, чтение таблиц).
+
+        Процесс spawn-пула стартует при первой задаче — без прогрева это время достаётся первому пользователю.
+        """
+        pool = self._get_pool()
+        return [pool.submit(func) for _ in range(self.workers)]
+
+    def _get_semaphore(self):
+        # Семафор создаём внутри работающего event loop
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.workers)
+        return self.semaphore
+
+    async def _acquire(self, on_queued=None):
+        semaphore = self._get_semaphore()
+        if semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise StageOverloaded(self.name)
+            if on_queued is not None:
+                await on_queued(self.waiting + 1)
+
+        self.waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        QUEUE_WAIT.observe(time.perf_counter() - queued_at, stage=self.name)
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, on_queued=None):
+        """Место в стадии для async-кода, который сам не блокирует loop (например, стриминг)."""
+        await self._acquire(on_queued)
+        try:
+            yield
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+        finally:
+            self._release()
+
+    def _finish(self, future, pool):
+        # Место освобождается, когда поток/процесс действительно закончил, а не когда ждать перестал вызывающий
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or error is not None:
+            self.failed += 1
+            if isinstance(error, BrokenProcessPool):
+                self._drop_pool(pool)
+        else:
+            self.completed += 1
+        self._release()
+
+    async def run(self, func, *args, on_queued=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            await asyncio.wait_for(self._acquire(on_queued), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            logger.warning("Стадия %s: превышено время ожидания %.0f с", self.name, self.timeout)
+            raise
+
+        pool = self._get_pool()
+        try:
+            if self.kind == "process":
+                # Метрики, записанные в процессе-воркере, возвращаются вместе с результатом
+                future = pool.submit(_call_collecting_metrics, func, args, kwargs)
+            elif kwargs:
+                future = pool.submit(_call_with_kwargs, func, args, kwargs)
+            else:
+                future = pool.submit(func, *args)
+        except BaseException as e:
+            # Задача не принята — место освобождаем сразу, иначе _finish его уже не вернёт
+            self.failed += 1
+            self._release()
+            if isinstance(e, BrokenProcessPool):
+                self._drop_pool(pool)
+            raise
+        done = asyncio.wrap_future(future)
+        done.add_done_callback(lambda done: self._finish(done, pool))
+
+        try:
+            # shield: тайм-аут или отмена вызывающего не отменяют задачу — она держит место, пока не доработает
+            result = await asyncio.wait_for(asyncio.shield(done), timeout=max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            # Поток/процесс может ещё доработать, но пользователь ответ ждать не будет
+            self.timed_out += 1
+            logger.warning("Стадия %s: превышено время ожидания %.0f с", self.name, self.timeout)
+            raise
+        if self.kind == "process":
+            result, delta = result
+            REGISTRY.merge_delta(delta)
+        return result
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+
+def _call_with_kwargs(func, args, kwargs):
+    return func(*args, **kwargs)
+
+
+def _call_collecting_metrics(func, args, kwargs):
+    REGISTRY.export_delta()
+    result = func(*args, **kwargs)
+    return result, REGISTRY.export_delta()
+
+
+_stages = {}
+
+
+def get_stage(name):
+    stage = _stages.get(name)
+    if stage is None:
+        # setdefault — стадию может впервые запросить и поток прогрева
+        stage = _stages.setdefault(name, Stage(name))
+    return stage
+
+
+async def run_stage(name, func, *args, on_queued=None, **kwargs):
+    return await get_stage(name).run(func, *args, on_queued=on_queued, **kwargs)
+
+
+def stage_slot(name, on_queued=None):
+    return get_stage(name).slot(on_queued=on_queued)
+
+
+def stage_stats():
+    return {name: stage.stats() for name, stage in _stages.items()}
+
+
+def shutdown_stages():
+    for stage in _stages.values():
+        stage.shutdown()
+
+
+def _collect_metrics():
+    stats = stage_stats()
+    return [
+        ("astrobot_executor_in_flight", "gauge", "Задачи стадии, занимающие воркер",
+         [({"stage": name}, s["in_flight"]) for name, s in stats.items()]),
+        ("astrobot_executor_waiting", "gauge", "Задачи стадии в очереди",
+         [({"stage": name}, s["waiting"]) for name, s in stats.items()]),
+        ("astrobot_executor_rejected_total", "counter", "Отказы из-за переполненной очереди",
+         [({"stage": name}, s["rejected"]) for name, s in stats.items()]),
+        ("astrobot_executor_timeouts_total", "counter", "Превышения времени ожидания",
+         [({"stage": name}, s["timed_out"]) for name, s in stats.items()]),
+    ]
+
+
+REGISTRY.add_collector(_collect_metrics)
@@ -0,0 +1,235 @@
+import bisect
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+# Слои геокодинга (от быстрого к медленному):
+# 1. LRU в памяти
+# 2. Встроенный офлайн-справочник городов (точное совпадение)
+# 3. Постоянный кэш на диске (SQLite)
+# 4. Nominatim — только при настоящем промахе
+# 5. Справочник: однозначный префикс, затем нечёткий поиск — только если Nominatim не ответил
+#    или не нашёл город. Раньше Nominatim они путали настоящие города с похожими
+#    («Бердск» → Бердянск, «Петропавловск» → Петропавловск-Камчатский, «Ростов» → Ростов-на-Дону),
+#    поэтому совпадение должно быть единственным, а результат не кэшируется.
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.json")
+CACHE_PATH = os.environ.get("GEOCODE_CACHE_PATH", "data/geocode_cache.sqlite3")
+LRU_SIZE = int(os.environ.get("GEOCODE_LRU_SIZE", "4096"))
+FUZZY_CUTOFF = 0.9
+MIN_PREFIX_LENGTH = 4
+
+
+def normalize_city(city):
+    name = city.strip().lower().replace("ё", "е")
+    name = re.sub(r"^(г\.|город)\s*", "", name)
+    name = re.sub(r"[\s\-_.,]+", " ", name)
+    return name.strip()
+
+
+class Gazetteer:
+    def __init__(self, path=GAZETTEER_PATH):
+        self.index = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for name, lat, lon, aliases in entries:
+                for alias in [name] + aliases:
+                    self.index.setdefault(normalize_city(alias), (lat, lon))
+        self.sorted_names = sorted(self.index)
+
+    def exact(self, key):
+        return self.index.get(key)
+
+    def prefix(self, key):
+        # Префикс засчитывается, только если он однозначно указывает на один город
+        if len(key) < MIN_PREFIX_LENGTH:
+            return None
+        start = bisect.bisect_left(self.sorted_names, key)
+        matches = set()
+        for name in self.sorted_names[start:]:
+            if not name.startswith(key):
+                break
+            matches.add(self.index[name])
+            if len(matches) > 1:
+                return None
+        return matches.pop() if matches else None
+
+    def fuzzy(self, key):
+        # Два разных города выше порога — не угадываем
+        names = difflib.get_close_matches(key, self.sorted_names, n=2, cutoff=FUZZY_CUTOFF)
+        matches = {self.index[name] for name in names}
+        return matches.pop() if len(matches) == 1 else None
+
+
+class DiskCache:
+    def __init__(self, path=CACHE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT lat, lon FROM geocode WHERE key = ?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, key, coords):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)", (key, coords[0], coords[1]))
+            self.conn.commit()
+
+
+class Geocoder:
+    def __init__(self, gazetteer=None, disk_cache=None, remote=None, lru_size=LRU_SIZE):
+        self.gazetteer = gazetteer or Gazetteer()
+        self._disk_cache = disk_cache
+        self._remote = remote
+        self.lru_size = lru_size
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "gazetteer_hits": 0,
+            "disk_hits": 0,
+            "prefix_hits": 0,
+            "fuzzy_hits": 0,
+            "remote_hits": 0,
+            "misses": 0,
+        }
+
+    @property
+    def disk_cache(self):
+        # Файл кэша открываем лениво — чтобы импорт модуля ничего не создавал на диске
+        if self._disk_cache is None:
+            self._disk_cache = DiskCache()
+        return self._disk_cache
+
+    @property
+    def remote(self):
+        # Один клиент Nominatim на процесс вместо нового на каждый запрос
+        if self._remote is None:
+            from geopy.geocoders import Nominatim
+            self._remote = Nominatim(user_agent="astro_bot")
+        return self._remote
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _remember(self, key, coords):
+        with self.lock:
+            self.lru[key] = coords
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.lru_size:
+                self.lru.popitem(last=False)
+
+    def _approximate(self, key):
+        # Неточные совпадения по справочнику — только запасной вариант после Nominatim
+        coords = self.gazetteer.prefix(key)
+        if coords is not None:
+            self._count("prefix_hits")
+            return coords
+        coords = self.gazetteer.fuzzy(key)
+        if coords is not None:
+            self._count("fuzzy_hits")
+        return coords
+
+    def geocode(self, city):
+        key = normalize_city(city)
+        if not key:
+            raise ValueError("Город не найден.")
+
+        with self.lock:
+            coords = self.lru.get(key)
+            if coords is not None:
+                self.lru.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return coords
+
+        coords = self.gazetteer.exact(key)
+        if coords is not None:
+            self._count("gazetteer_hits")
+            self._remember(key, coords)
+            return coords
+
+        coords = self.disk_cache.get(key)
+        if coords is not None:
+            self._count("disk_hits")
+            self._remember(key, coords)
+            return coords
+
+        try:
+            location = self.remote.geocode(city)
+        except Exception:
+            # Nominatim недоступен: похожее название из справочника лучше отказа, но не запоминаем —
+            # в следующий раз спросим Nominatim
+            coords = self._approximate(key)
+            if coords is None:
+                raise
+            return coords
+        if not location:
+            coords = self._approximate(key)
+            if coords is not None:
+                return coords
+            self._count("misses")
+            raise ValueError("Город не найден.")
+        coords = (location.latitude, location.longitude)
+        self._count("remote_hits")
+        self.disk_cache.put(key, coords)
+        self._remember(key, coords)
+        return coords
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["lru_size"] = len(self.lru)
+        total = sum(stats[name] for name in self.counters)
+        stats["remote_ratio"] = (stats["remote_hits"] + stats["misses"]) / total if total else 0.0
+        return stats
+
+
+_default_geocoder = None
+_default_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _default_geocoder
+    if _default_geocoder is None:
+        with _default_lock:
+            if _default_geocoder is None:
+                _default_geocoder = Geocoder()
+    return _default_geocoder
+
+
+def set_geocoder(geocoder):
+    """Подменить геокодер процесса (бенчмарки, нагрузочные тесты)."""
+    global _default_geocoder
+    with _default_lock:
+        _default_geocoder = geocoder
+
+
+def geocode(city):
+    return get_geocoder().geocode(city)
+
+
+def _collect_metrics():
+    if _default_geocoder is None:
+        return []
+    counters = _default_geocoder.stats()
+    return [("astrobot_geocode_lookups_total", "counter", "Запросы геокодинга по источнику ответа",
+             [({"source": name}, counters[name]) for name in _default_geocoder.counters])]
+
+
+REGISTRY.add_collector(_collect_metrics)
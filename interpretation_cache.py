@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import REGISTRY
+
+# Кэш интерпретаций: ответ модели зависит только от знака и дома Нептуна, Сатурна, Марса
+# и Юпитера и от первых 10 аспектов — по ним и строим ключ.
+#
+# Политика (INTERPRETATION_CACHE_POLICY):
+#   reuse      — отдавать готовый ответ, пока он не устарел (по умолчанию)
+#   regenerate — всегда спрашивать модель, но сохранять свежий ответ в кэш
+#   off        — кэш не используется
+
+CACHE_PATH = os.environ.get("INTERPRETATION_CACHE_PATH", "data/interpretations.sqlite3")
+POLICY = os.environ.get("INTERPRETATION_CACHE_POLICY", "reuse")
+TTL_SECONDS = float(os.environ.get("INTERPRETATION_CACHE_TTL", str(30 * 24 * 3600)))
+MEMORY_SIZE = int(os.environ.get("INTERPRETATION_CACHE_MEMORY_SIZE", "1024"))
+DISK_MAX_ENTRIES = int(os.environ.get("INTERPRETATION_CACHE_MAX_ENTRIES", "100000"))
+
+ASPECT_LIMIT = 10
+
+
+def _planet_features(planet):
+    if not isinstance(planet, dict) or planet.get("degree") is None:
+        return None
+    return [int(planet["degree"] // 30) % 12, planet.get("house", 0)]
+
+
+def _aspect_features(aspect):
+    # "Солнце квадрат Юпитер (83.82°, орб ...)" → "Солнце квадрат Юпитер": градусы в ключ не входят
+    return re.sub(r"\s*\(.*\)\s*$", "", aspect)
+
+
+def fingerprint(neptune, saturn, mars, jupiter, aspects, salt=""):
+    features = {
+        "planets": [_planet_features(p) for p in (neptune, saturn, mars, jupiter)],
+        "aspects": [_aspect_features(a) for a in (aspects or [])[:ASPECT_LIMIT]],
+        "salt": salt,
+    }
+    payload = json.dumps(features, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryTier:
+    def __init__(self, max_size=MEMORY_SIZE, ttl=TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            value, created_at = item
+            if time.time() - created_at > self.ttl:
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def put(self, key, value, created_at=None):
+        with self.lock:
+            self.items[key] = (value, created_at or time.time())
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+class DiskTier:
+    def __init__(self, path=CACHE_PATH, ttl=TTL_SECONDS, max_entries=DISK_MAX_ENTRIES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS interpretations ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_interpretations_accessed ON interpretations (accessed_at)")
+        self.conn.commit()
+        self.writes = 0
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, created_at FROM interpretations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM interpretations WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE interpretations SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return row
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO interpretations VALUES (?, ?, ?, ?)", (key, value, now, now))
+            self.writes += 1
+            # Вытеснение по размеру проверяем не на каждой записи
+            if self.writes % 100 == 0:
+                self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM interpretations WHERE created_at < ?", (now - self.ttl,))
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM interpretations").fetchone()
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM interpretations WHERE key IN "
+                "(SELECT key FROM interpretations ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+class InterpretationCache:
+    def __init__(self, policy=POLICY, memory=None, disk=None):
+        self.policy = policy
+        self.memory = memory or MemoryTier()
+        self._disk = disk
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+    @property
+    def disk(self):
+        if self._disk is None:
+            self._disk = DiskTier()
+        return self._disk
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get(self, key):
+        if self.policy != "reuse":
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        row = self.disk.get(key)
+        if row is not None:
+            self._count("disk_hits")
+            self.memory.put(key, row[0], created_at=row[1])
+            return row[0]
+        self._count("misses")
+        return None
+
+    def put(self, key, value):
+        if self.policy == "off":
+            return
+        self.memory.put(key, value)
+        self.disk.put(key, value)
+        self._count("stores")
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, policy=self.policy)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_cache():
+    global _default_cache
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = InterpretationCache()
+    return _default_cache
+
+
+def _collect_metrics():
+    if _default_cache is None:
+        return []
+    counters = _default_cache.stats()
+    return [("astrobot_interpretation_cache_total", "counter", "Обращения к кэшу интерпретаций",
+             [({"result": name}, counters[name]) for name in _default_cache.counters])]
+
+
+REGISTRY.add_collector(_collect_metrics)
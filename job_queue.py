@@ -0,0 +1,268 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import REGISTRY
+
+# Очередь задач между ботом и воркерами (worker.py) в SQLite.
+# Семантика — «хотя бы один раз», как у SQS:
+#   claim    — задача становится невидимой для других на visibility timeout и получает lease;
+#   ack      — выполнена (только с действующим lease: просроченный воркер ничего не затрёт);
+#   nack     — вернуть в очередь с задержкой; после max_attempts попыток — в dead;
+#              lease, истёкший на последней попытке, тоже ведёт в dead: claim отдаёт такую задачу
+#              с dead=True, чтобы воркер сообщил пользователю;
+#   extend   — продлить невидимость, пока обработка идёт (heartbeat).
+# Если воркер упал, lease истекает и задачу забирает другой — поэтому обработчики
+# должны переносить повтор (повторное сообщение пользователю — допустимо).
+# Файл общий для процессов одной машины; брокер (Redis, SQS) можно подставить
+# через set_queue с тем же интерфейсом.
+
+QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "data/jobs.sqlite3")
+VISIBILITY_TIMEOUT = float(os.environ.get("JOB_VISIBILITY_TIMEOUT", "120"))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+KEEP_DONE_SECONDS = 24 * 3600
+THROUGHPUT_WINDOW = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    visible_at REAL NOT NULL,
+    lease TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (queue, status, visible_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (status, finished_at);
+"""
+
+
+class Job:
+    __slots__ = ("id", "queue", "payload", "attempts", "max_attempts", "lease", "created_at", "dead")
+
+    def __init__(self, id, queue, payload, attempts, max_attempts, lease, created_at, dead=False):
+        self.id = id
+        self.queue = queue
+        self.payload = payload
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.created_at = created_at
+        self.dead = dead  # попытки кончились, выполнять не нужно — только сообщить пользователю
+
+    def __repr__(self):
+        return f"Job(id={self.id}, queue={self.queue!r}, attempts={self.attempts})"
+
+
+class JobQueue:
+    def __init__(self, path=QUEUE_PATH, visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # isolation_level=None: транзакции открываем сами (BEGIN IMMEDIATE в claim)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self.local.conn = conn
+        return conn
+
+    def enqueue(self, queue, payload, delay=0.0, max_attempts=None):
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO jobs (queue, payload, max_attempts, visible_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (queue, json.dumps(payload, ensure_ascii=False), max_attempts or self.max_attempts, now + delay, now),
+        )
+        return cursor.lastrowid
+
+    def enqueue_unique(self, queue, payload, key, delay=0.0, max_attempts=None):
+        """enqueue, если у очереди нет невыполненной задачи с тем же payload[key]; иначе None.
+
+        Проверка и вставка — в одной транзакции: два быстрых нажатия из разных потоков не поставят две задачи.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT 1 FROM jobs WHERE queue = ? AND status = 'ready' AND json_extract(payload, ?) = ? LIMIT 1",
+                (queue, f"$.{key}", payload[key]),
+            ).fetchone()
+            job_id = None
+            if row is None:
+                job_id = conn.execute(
+                    "INSERT INTO jobs (queue, payload, max_attempts, visible_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (queue, json.dumps(payload, ensure_ascii=False), max_attempts or self.max_attempts,
+                     now + delay, now),
+                ).lastrowid
+            conn.execute("COMMIT")
+            return job_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, queue, visibility_timeout=None):
+        """Следующая видимая задача очереди или None.
+
+        Задача, чей lease истёк на последней попытке, переводится в dead и возвращается с dead=True.
+        """
+        now = time.time()
+        lease = uuid.uuid4().hex
+        conn = self._connection()
+        # BEGIN IMMEDIATE — сразу блокировка записи: два воркера не заберут одну задачу
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, payload, attempts, max_attempts, created_at FROM jobs "
+                "WHERE queue = ? AND status = 'ready' AND visible_at <= ? ORDER BY visible_at LIMIT 1",
+                (queue, now),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, payload, attempts, max_attempts, created_at = row
+            if attempts >= max_attempts:
+                # Прошлый воркер не отчитался ни разу из max_attempts — больше не пробуем,
+                # но пользователь должен узнать, что ответа не будет
+                conn.execute(
+                    "UPDATE jobs SET status = 'dead', lease = NULL, finished_at = ?, "
+                    "error = COALESCE(error, 'visibility timeout') WHERE id = ?",
+                    (now, job_id),
+                )
+                conn.execute("COMMIT")
+                return Job(job_id, queue, json.loads(payload), attempts, max_attempts, None, created_at, dead=True)
+            conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, lease = ?, visible_at = ?, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (lease, now + (visibility_timeout or self.visibility_timeout), now, job_id),
+            )
+            conn.execute("COMMIT")
+            return Job(job_id, queue, json.loads(payload), attempts + 1, max_attempts, lease, created_at)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def ack(self, job):
+        """Задача выполнена. False — lease уже истёк и задачу мог забрать другой воркер."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'done', lease = NULL, finished_at = ? WHERE id = ? AND lease = ?",
+            (time.time(), job.id, job.lease),
+        )
+        return cursor.rowcount == 1
+
+    def nack(self, job, error=None, delay=0.0):
+        """Вернуть задачу в очередь через delay секунд (или в dead, если попытки кончились)."""
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'dead' ELSE 'ready' END, "
+            "finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END, "
+            "lease = NULL, visible_at = ?, error = ? WHERE id = ? AND lease = ?",
+            (now, now + delay, error, job.id, job.lease),
+        )
+        return cursor.rowcount == 1
+
+    def extend(self, job, visibility_timeout=None):
+        cursor = self._connection().execute(
+            "UPDATE jobs SET visible_at = ? WHERE id = ? AND lease = ?",
+            (time.time() + (visibility_timeout or self.visibility_timeout), job.id, job.lease),
+        )
+        return cursor.rowcount == 1
+
+    def purge(self, older_than=KEEP_DONE_SECONDS):
+        """Удалить выполненные и мёртвые задачи старше older_than секунд."""
+        cursor = self._connection().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'dead') AND finished_at < ?", (time.time() - older_than,)
+        )
+        return cursor.rowcount
+
+    def stats(self):
+        """По очередям: ready, in_flight, delayed (ждёт повтора), done, dead,
+        выполнено в секунду за последнюю минуту и среднее ожидание до начала обработки."""
+        now = time.time()
+        conn = self._connection()
+        stats = {}
+        # Счёт по индексу (queue, status, visible_at), без чтения самих задач
+        rows = conn.execute(
+            "SELECT queue, status, visible_at <= ?, COUNT(*) FROM jobs GROUP BY queue, status, visible_at <= ?",
+            (now, now),
+        )
+        for queue, status, visible, count in rows:
+            s = stats.setdefault(queue, {"ready": 0, "in_flight": 0, "delayed": 0, "done": 0, "dead": 0,
+                                         "per_second": 0.0, "avg_wait": 0.0})
+            if status == "ready":
+                s["ready" if visible else "delayed"] += count
+            else:
+                s[status] += count
+        rows = conn.execute(
+            "SELECT queue, COUNT(*) FROM jobs WHERE status = 'ready' AND visible_at > ? AND lease IS NOT NULL "
+            "GROUP BY queue",
+            (now,),
+        )
+        for queue, count in rows:
+            stats[queue]["in_flight"] = count
+            stats[queue]["delayed"] -= count
+        rows = conn.execute(
+            "SELECT queue, COUNT(*), AVG(started_at - created_at) FROM jobs "
+            "WHERE status = 'done' AND finished_at >= ? GROUP BY queue",
+            (now - THROUGHPUT_WINDOW,),
+        )
+        for queue, count, avg_wait in rows:
+            stats[queue]["per_second"] = count / THROUGHPUT_WINDOW
+            stats[queue]["avg_wait"] = avg_wait or 0.0
+        return stats
+
+
+_default_queue = None
+_default_lock = threading.Lock()
+
+
+def get_queue():
+    global _default_queue
+    if _default_queue is None:
+        with _default_lock:
+            if _default_queue is None:
+                _default_queue = JobQueue()
+    return _default_queue
+
+
+def set_queue(queue):
+    global _default_queue
+    with _default_lock:
+        _default_queue = queue
+
+
+def _collect_metrics():
+    if _default_queue is None:
+        return []
+    stats = _default_queue.stats()
+    return [
+        ("astrobot_jobs", "gauge", "Задачи в очереди по состоянию",
+         [({"queue": queue, "state": state}, s[state]) for queue, s in stats.items()
+          for state in ("ready", "in_flight", "delayed", "done", "dead")]),
+        ("astrobot_jobs_per_second", "gauge", "Выполнено задач в секунду за последнюю минуту",
+         [({"queue": queue}, s["per_second"]) for queue, s in stats.items()]),
+        ("astrobot_jobs_wait_seconds", "gauge", "Среднее ожидание задачи до начала обработки за последнюю минуту",
+         [({"queue": queue}, s["avg_wait"]) for queue, s in stats.items()]),
+    ]
+
+
+REGISTRY.add_collector(_collect_metrics)
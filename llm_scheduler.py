@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+from metrics import REGISTRY, Counter, Histogram
+from rate_limit import PriorityTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Планировщик запросов к OpenAI.
+#   single-flight — повторные нажатия одного пользователя не создают новых запросов,
+#                   а одинаковые карты (один fingerprint) разных пользователей читают один поток;
+#   бюджет       — токены и запросы в минуту (лимиты аккаунта OpenAI), ожидающие — по приоритету;
+#   повторы      — при 429/5xx/обрыве соединения, с экспоненциальной задержкой и случайным разбросом,
+#                   только пока пользователю не ушло ни одного куска текста.
+# Пользователь видит понятное сообщение (UNAVAILABLE_TEXT), а не текст исключения OpenAI.
+
+TOKENS_PER_MINUTE = float(os.environ.get("OPENAI_TOKENS_PER_MINUTE", "30000"))
+REQUESTS_PER_MINUTE = float(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", "500"))
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.environ.get("LLM_RETRY_MAX_DELAY", "20.0"))
+
+PRIORITY_INTERACTIVE = 0  # пользователь ждёт ответ
+PRIORITY_BACKGROUND = 1   # рассылки, прогрев кэша
+
+UNAVAILABLE_TEXT = "🚫 Сейчас не получается получить ответ ИИ. Попробуй, пожалуйста, через пару минут."
+DUPLICATE_TEXT = "⏳ Уже готовлю твои рекомендации — они появятся в сообщении выше."
+
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "astrobot_llm_queue_wait_seconds", "Ожидание бюджета OpenAI перед запросом", ["priority"]
+))
+COALESCED = REGISTRY.register(Counter(
+    "astrobot_llm_coalesced_total", "Запросы, присоединённые к уже идущему (user — повторное нажатие)", ["kind"]
+))
+RETRIES = REGISTRY.register(Counter(
+    "astrobot_llm_retries_total", "Повторы запросов к OpenAI", ["error"]
+))
+FAILURES = REGISTRY.register(Counter(
+    "astrobot_llm_failures_total", "Запросы, не выполненные после всех попыток", ["error"]
+))
+
+
+class LLMUnavailable(Exception):
+    """OpenAI не ответил после всех попыток."""
+
+
+class DuplicateRequest(Exception):
+    """У пользователя уже идёт запрос к ИИ."""
+
+
+def retryable_errors():
+    """429, 5xx и обрыв соединения; openai импортируется при первом запросе, а не при старте бота."""
+    import openai
+    return openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError
+
+
+def retry_delay(attempt, error=None, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Задержка перед повтором: Retry-After от OpenAI или «full jitter» по экспоненте."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value:
+            try:
+                return min(cap, float(value) * scale) + random.uniform(0, base)
+            except ValueError:
+                pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retry(func, *args, retries=MAX_RETRIES, **kwargs):
+    """Синхронный вызов с повторами; после последней попытки — LLMUnavailable."""
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except retryable_errors() as e:
+            if attempt == retries:
+                FAILURES.inc(error=type(e).__name__)
+                raise LLMUnavailable(str(e)) from e
+            RETRIES.inc(error=type(e).__name__)
+            time.sleep(retry_delay(attempt, e))
+
+
+class _Flight:
+    """Один запрос к OpenAI и все, кто читает его результат."""
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self):
+        # Новый подписчик сначала получает уже пришедшие куски, потом — новые
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class LLMScheduler:
+    def __init__(self, tokens_per_minute=TOKENS_PER_MINUTE, requests_per_minute=REQUESTS_PER_MINUTE,
+                 max_retries=MAX_RETRIES):
+        self.tokens = PriorityTokenBucket(tokens_per_minute / 60, capacity=tokens_per_minute)
+        self.requests = PriorityTokenBucket(requests_per_minute / 60, capacity=requests_per_minute)
+        self.max_retries = max_retries
+        self.flights = {}  # fingerprint → _Flight
+        self.users = {}    # user_id → fingerprint (None — занят через reserve, запрос ещё не начат)
+
+    def user_in_flight(self, user_id):
+        return user_id in self.users
+
+    def reserve(self, user_id):
+        """Занять пользователя до очереди стадии llm; False — у него уже идёт запрос.
+
+        Без этого второе нажатие, пока первое ждёт места в стадии, проходит user_in_flight.
+        Освобождается release(); stream() для занятого так пользователя не считается повтором.
+        """
+        if user_id in self.users:
+            COALESCED.inc(kind="user")
+            return False
+        self.users[user_id] = None
+        return True
+
+    def release(self, user_id):
+        self.users.pop(user_id, None)
+
+    async def stream(self, key, produce, user_id=None, priority=PRIORITY_INTERACTIVE, estimated_tokens=2000):
+        """Текст ответа кусками.
+
+        key — fingerprint запроса; produce(on_usage) — async-итератор кусков одного обращения
+        к OpenAI (вызывается заново на каждую попытку), on_usage(usage) — для учёта токенов.
+        """
+        if user_id is not None and self.users.get(user_id) is not None:
+            COALESCED.inc(kind="user")
+            raise DuplicateRequest(user_id)
+        reserved = user_id is not None and user_id in self.users
+
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = _Flight(key)
+            flight.task = asyncio.create_task(self._run(flight, produce, priority, estimated_tokens))
+        else:
+            COALESCED.inc(kind="fingerprint")
+
+        flight.subscribers += 1
+        if user_id is not None:
+            self.users[user_id] = key
+        try:
+            async for chunk in flight.follow():
+                yield chunk
+        finally:
+            flight.subscribers -= 1
+            if reserved:
+                self.users[user_id] = None
+            elif user_id is not None:
+                self.users.pop(user_id, None)
+            # Все ушли (таймаут, отмена) — незачем тратить токены дальше
+            if flight.subscribers == 0 and not flight.done:
+                flight.task.cancel()
+
+    async def _acquire(self, priority, estimated_tokens):
+        started = time.perf_counter()
+        await self.requests.acquire(1, priority=priority)
+        await self.tokens.acquire(estimated_tokens, priority=priority)
+        QUEUE_WAIT.observe(time.perf_counter() - started, priority=str(priority))
+
+    async def _run(self, flight, produce, priority, estimated_tokens):
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._acquire(priority, estimated_tokens)
+                used = []
+                try:
+                    async for chunk in produce(used.append):
+                        flight.push(chunk)
+                    flight.finish()
+                    return
+                except retryable_errors() as e:
+                    if flight.chunks or attempt == self.max_retries:
+                        FAILURES.inc(error=type(e).__name__)
+                        logger.error("OpenAI недоступен после %d попыток: %s", attempt + 1, e)
+                        flight.finish(LLMUnavailable(str(e)))
+                        return
+                    RETRIES.inc(error=type(e).__name__)
+                    delay = retry_delay(attempt, e)
+                    if isinstance(e, retryable_errors()[0]):
+                        # 429 касается всего аккаунта — сдвигаем бюджет для всех на время задержки
+                        self.tokens.refund(-delay * self.tokens.rate)
+                    logger.warning("OpenAI: %s, повтор через %.1f с", type(e).__name__, delay)
+                    await asyncio.sleep(delay)
+                finally:
+                    self._settle(estimated_tokens, used)
+        except asyncio.CancelledError:
+            flight.finish(LLMUnavailable("cancelled"))
+            raise
+        except Exception as e:
+            FAILURES.inc(error=type(e).__name__)
+            logger.error("Ошибка запроса к OpenAI: %s", e)
+            flight.finish(LLMUnavailable(str(e)))
+        finally:
+            self.flights.pop(flight.key, None)
+
+    def _settle(self, estimated_tokens, used):
+        # Бюджет резервируется по оценке, а списывается по факту из usage
+        if used:
+            usage = used[-1]
+            actual = (getattr(usage, "prompt_tokens", 0) or 0) + (getattr(usage, "completion_tokens", 0) or 0)
+            self.tokens.refund(estimated_tokens - actual)
+
+    def stats(self):
+        return {
+            "in_flight": len(self.flights),
+            "users": len(self.users),
+            "queue_depth": {
+                priority: self.tokens.depth().get(priority, 0) + self.requests.depth().get(priority, 0)
+                for priority in (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
+            },
+            "tokens_available": self.tokens.tokens,
+        }
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _default_scheduler
+    if _default_scheduler is None:
+        with _default_lock:
+            if _default_scheduler is None:
+                _default_scheduler = LLMScheduler()
+    return _default_scheduler
+
+
+def set_scheduler(scheduler):
+    global _default_scheduler
+    with _default_lock:
+        _default_scheduler = scheduler
+
+
+def _collect_metrics():
+    if _default_scheduler is None:
+        return []
+    stats = _default_scheduler.stats()
+    return [
+        ("astrobot_llm_queue_depth", "gauge", "Запросы, ждущие бюджета OpenAI",
+         [({"priority": str(priority)}, depth) for priority, depth in stats["queue_depth"].items()]),
+        ("astrobot_llm_in_flight", "gauge", "Запросы к OpenAI, выполняющиеся сейчас", [({}, stats["in_flight"])]),
+        ("astrobot_llm_tokens_available", "gauge", "Остаток бюджета токенов в минуту", [({}, stats["tokens_available"])]),
+    ]
+
+
+REGISTRY.add_collector(_collect_metrics)
@@ -1,22 +1,49 @@
+import os
 import threading
-import asyncio
-import time
 
-from server import app as flask_app
-from bot import main as telegram_main
+# BOT_MODE=webhook — один aiohttp-сервер принимает апдейты и отдаёт /ping и /metrics (продакшн).
+# BOT_MODE=polling — Flask в отдельном потоке + long polling (локальная разработка).
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# JOB_QUEUE_MODE=queue — рядом с ботом запускаются процессы worker.py (WORKER_PROCESSES, 0 — воркеры отдельно)
+JOB_QUEUE_MODE = os.environ.get("JOB_QUEUE_MODE", "inline")
+
 
 # Запускаем Flask-сервер
 def run_flask():
+    from server import app as flask_app
     print("🚀 Flask запускается...")
-    flask_app.run(host="0.0.0.0", port=8080)
+    flask_app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "8080")))
+
 
 # Запускаем Telegram-бота
 def run_telegram():
+    from bot import main as telegram_main
     print("🤖 Telegram бот запускается...")
-    asyncio.run(telegram_main())
+    # run_polling сам создаёт event loop и блокирует поток до остановки
+    telegram_main()
+
+
+def run_webhook():
+    import webhook
+    print("🌐 Telegram бот запускается в режиме webhook...")
+    webhook.main()
+
+
+def start_workers():
+    from worker import start_pool, WORKER_PROCESSES
+    if WORKER_PROCESSES > 0:
+        print(f"🧵 Запускаем воркеры очереди задач: {WORKER_PROCESSES}")
+        start_pool(WORKER_PROCESSES)
+
 
 if __name__ == "__main__":
-    print("💡 Запуск приложения...")
-    threading.Thread(target=run_flask).start()
-    time.sleep(2)
-    run_telegram()
+    print(f"💡 Запуск приложения (режим {BOT_MODE})...")
+    if JOB_QUEUE_MODE == "queue":
+        start_workers()
+    if BOT_MODE == "webhook":
+        run_webhook()
+    elif BOT_MODE == "polling":
+        threading.Thread(target=run_flask, daemon=True).start()
+        run_telegram()
+    else:
+        raise ValueError(f"❌ Неизвестный BOT_MODE: {BOT_MODE} (ожидается webhook или polling)")
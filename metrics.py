@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+# Метрики в формате Prometheus без внешних зависимостей.
+# Запись — это perf_counter, один lock и bisect по корзинам (~1–2 мкс), поэтому
+# таймеры можно держать включёнными под полной нагрузкой.
+# Воркеры из пула процессов копят свои значения локально и отдают их вместе
+# с результатом (export_delta), основной процесс складывает их в общий реестр (merge_delta).
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self.lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self.values.items()]
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector):
+        """collector() → [(имя, тип, описание, [(словарь меток, значение), ...]), ...] на момент запроса."""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            body = metric.render()
+            if body:
+                lines.extend(metric.header())
+                lines.extend(body)
+        for collector in self.collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def export_delta(self):
+        """Счётчики и гистограммы, накопленные с прошлого вызова (для передачи из процесса-воркера)."""
+        delta = {}
+        for metric in list(self.metrics.values()):
+            if metric.kind == "gauge":
+                continue
+            with metric.lock:
+                if metric.values:
+                    delta[metric.name] = metric.values
+                    metric.values = {}
+        return delta
+
+    def merge_delta(self, delta):
+        for name, values in delta.items():
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            with metric.lock:
+                for key, value in values.items():
+                    if metric.kind == "counter":
+                        metric.values[key] = metric.values.get(key, 0) + value
+                        continue
+                    state = metric.values.get(key)
+                    if state is None:
+                        metric.values[key] = [list(value[0]), value[1], value[2]]
+                    else:
+                        state[0] = [a + b for a, b in zip(state[0], value[0])]
+                        state[1] += value[1]
+                        state[2] += value[2]
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "astrobot_stage_duration_seconds", "Время выполнения стадии обработки запроса", ["stage"]
+))
+STAGE_IN_FLIGHT = REGISTRY.register(Gauge(
+    "astrobot_stage_in_flight", "Сколько вызовов стадии выполняется сейчас", ["stage"]
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "astrobot_stage_errors_total", "Ошибки по стадиям и типам исключений", ["stage", "error"]
+))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "astrobot_queue_wait_seconds", "Ожидание свободного воркера стадии", ["stage"]
+))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    "astrobot_openai_tokens_total", "Токены OpenAI: prompt, completion, cached", ["kind"]
+))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "astrobot_event_loop_lag_seconds", "Насколько позже срока просыпается таймер event loop",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+))
+
+
+@contextlib.contextmanager
+def timed(stage):
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        STAGE_ERRORS.inc(stage=stage, error=type(e).__name__)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=stage)
+        STAGE_IN_FLIGHT.dec(stage=stage)
+
+
+def timed_handler(stage):
+    """Декоратор для async-обработчиков: то же, что timed, на всё время выполнения."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with timed(stage):
+                return await handler(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def monitor_event_loop(interval=0.1):
+    """Фоновая задача: задержка event loop. Растёт, когда обработчики держат loop синхронной работой."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+
+def record_usage(usage):
+    """Учёт токенов по объекту usage из ответа OpenAI."""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+    OPENAI_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+    OPENAI_TOKENS.inc(cached or 0, kind="cached")
+
+
+def render():
+    return REGISTRY.render()
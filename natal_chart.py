@@ -0,0 +1,232 @@
+import math
+from datetime import datetime, timezone
+
+import numpy as np
+
+from aspect_engine import aspect_values, find_aspects, format_aspect
+from astro_utils import PLANETS, PLANET_NAMES
+
+# Натальная карта одной записью фиксированного размера (CHART_DTYPE, ~0.4 КБ)
+# вместо вложенных словарей. NatalChart — тонкая обёртка над записью: поля читаются
+# прямо из буфера (bytes из SQLite, memmap, ответ пула процессов) без копирования.
+# Имя и город — текст произвольной длины (полное имя в Telegram — до 128 символов,
+# город — как ввёл пользователь), поэтому они лежат рядом с записью, а не в ней.
+# Для старого кода есть адаптер: chart["planets"], chart["houses"], chart["aspects"]
+# и to_dict() возвращают прежний словарь.
+
+PLANET_ORDER = [PLANET_NAMES[p] for p in PLANETS]
+PLANET_INDEX = {name: i for i, name in enumerate(PLANET_ORDER)}
+# Для 10 планет и аспектов не шире 10° у пары планет бывает не больше одного аспекта
+MAX_ASPECTS = len(PLANET_ORDER) * (len(PLANET_ORDER) - 1) // 2
+
+CHART_DTYPE = np.dtype([
+    ("telegram_id", "<i8"),
+    ("latitude", "<f8"),          # NaN — координаты неизвестны
+    ("longitude", "<f8"),
+    ("utc_timestamp", "<f8"),     # момент рождения, секунды Unix (UTC)
+    ("birth_date", "S10"),        # как ввёл пользователь: ДД.ММ.ГГГГ
+    ("birth_time", "S5"),         # ЧЧ:ММ
+    ("longitudes", "<f8", (len(PLANET_ORDER),)),  # в порядке PLANET_ORDER
+    ("houses", "u1", (len(PLANET_ORDER),)),       # дом каждой планеты, 1–12 (0 — не определён)
+    ("cusps", "<f8", (14,)),                      # 12 куспидов + Asc + MC
+    ("aspect_count", "u1"),
+    ("aspects", "u1", (MAX_ASPECTS, 3)),          # (p1, p2, aspect) от самого точного
+])
+CHART_SIZE = CHART_DTYPE.itemsize
+
+_LEGACY_KEYS = {"telegram_id", "username", "birth_date", "birth_time", "city", "latitude", "longitude",
+                "utc_time", "planets", "houses", "aspects"}
+
+
+def encode_text(value, size):
+    # Обрезаем по границе символа, чтобы не оставить половину UTF-8 последовательности
+    data = (value or "").encode("utf-8")
+    if len(data) > size:
+        data = data[:size].decode("utf-8", errors="ignore").encode("utf-8")
+    return data
+
+
+def _decode_text(value):
+    return value.decode("utf-8") or None
+
+
+def _optional(value):
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class NatalChart:
+    __slots__ = ("record", "username", "city")
+
+    def __init__(self, record, username=None, city=None):
+        self.record = record
+        self.username = username or None
+        self.city = city or None
+
+    # --- создание ---
+
+    @classmethod
+    def build(cls, telegram_id, username, birth_date, birth_time, city, latitude, longitude, utc_dt,
+              longitudes, houses, cusps, aspects=None):
+        """Карта из результатов расчёта; aspects — записи find_aspects (посчитаются, если не переданы)."""
+        record = np.zeros(1, dtype=CHART_DTYPE)[0]
+        record["telegram_id"] = telegram_id
+        record["latitude"] = np.nan if latitude is None else latitude
+        record["longitude"] = np.nan if longitude is None else longitude
+        record["utc_timestamp"] = np.nan if utc_dt is None else utc_dt.timestamp()
+        record["birth_date"] = encode_text(birth_date, 10)
+        record["birth_time"] = encode_text(birth_time, 5)
+        record["longitudes"] = longitudes
+        record["houses"] = houses
+        record["cusps"] = cusps
+
+        if aspects is None:
+            aspects = find_aspects(record["longitudes"])
+        count = min(len(aspects), MAX_ASPECTS)
+        record["aspect_count"] = count
+        record["aspects"][:count, 0] = aspects["p1"][:count]
+        record["aspects"][:count, 1] = aspects["p2"][:count]
+        record["aspects"][:count, 2] = aspects["aspect"][:count]
+        return cls(record, username, city)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Из прежнего словаря (JSON-файлы, старые строки хранилища).
+
+        Строки аспектов не разбираются: аспекты заново считаются по долготам тем же
+        движком, что и при расчёте карты.
+        """
+        planets = data["planets"]
+        houses = data["houses"]
+        utc_time = data.get("utc_time")
+        return cls.build(
+            data["telegram_id"], data.get("username"), data.get("birth_date"), data.get("birth_time"),
+            data.get("city"), data.get("latitude"), data.get("longitude"),
+            datetime.fromisoformat(utc_time) if utc_time else None,
+            [planets[name]["degree"] for name in PLANET_ORDER],
+            [planets[name]["house"] for name in PLANET_ORDER],
+            list(houses["Houses"]) + [houses["Asc"], houses["MC"]],
+        )
+
+    @classmethod
+    def from_buffer(cls, buffer, offset=0, username=None, city=None):
+        """Карта поверх готового буфера без копирования (bytes, memoryview, mmap)."""
+        return cls(np.frombuffer(buffer, dtype=CHART_DTYPE, count=1, offset=offset)[0], username, city)
+
+    def to_bytes(self):
+        return self.record.tobytes()
+
+    def __reduce__(self):
+        # В пул процессов и обратно уходят 0.4 КБ байтов и две строки, а не дерево словарей
+        return (NatalChart.from_buffer, (self.to_bytes(), 0, self.username, self.city))
+
+    # --- поля ---
+
+    @property
+    def telegram_id(self):
+        return int(self.record["telegram_id"])
+
+    @property
+    def birth_date(self):
+        return _decode_text(self.record["birth_date"])
+
+    @property
+    def birth_time(self):
+        return _decode_text(self.record["birth_time"])
+
+    @property
+    def latitude(self):
+        return _optional(self.record["latitude"])
+
+    @property
+    def longitude(self):
+        return _optional(self.record["longitude"])
+
+    @property
+    def utc_time(self):
+        timestamp = _optional(self.record["utc_timestamp"])
+        if timestamp is None:
+            return None
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+    @property
+    def longitudes(self):
+        return self.record["longitudes"]
+
+    @property
+    def planet_houses(self):
+        return self.record["houses"]
+
+    @property
+    def cusps(self):
+        return self.record["cusps"][:12]
+
+    def planet(self, name):
+        """Планета в прежнем виде: {"degree": ..., "house": ...}."""
+        i = PLANET_INDEX[name]
+        return {"degree": float(self.record["longitudes"][i]), "house": int(self.record["houses"][i])}
+
+    def aspect_records(self):
+        """Аспекты карты записями ASPECT_DTYPE (от самого точного)."""
+        triples = self.record["aspects"][:int(self.record["aspect_count"])]
+        return aspect_values(self.record["longitudes"], triples[:, 0], triples[:, 1], triples[:, 2])
+
+    @property
+    def aspects(self):
+        return [format_aspect(record, PLANET_ORDER) for record in self.aspect_records()]
+
+    # --- адаптер к словарю ---
+
+    @property
+    def planets(self):
+        return {name: self.planet(name) for name in PLANET_ORDER}
+
+    @property
+    def houses_dict(self):
+        cusps = self.record["cusps"]
+        return {"Asc": float(cusps[12]), "MC": float(cusps[13]), "Houses": cusps[:12].tolist()}
+
+    def __getitem__(self, key):
+        if key not in _LEGACY_KEYS:
+            raise KeyError(key)
+        return self.houses_dict if key == "houses" else getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return {
+            "telegram_id": self.telegram_id,
+            "username": self.username,
+            "birth_date": self.birth_date,
+            "birth_time": self.birth_time,
+            "city": self.city,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "utc_time": self.utc_time,
+            "planets": self.planets,
+            "houses": self.houses_dict,
+            "aspects": self.aspects,
+        }
+
+    def __repr__(self):
+        return f"NatalChart(telegram_id={self.telegram_id}, city={self.city!r}, utc_time={self.utc_time!r})"
+
+
+def fill_aspects(records):
+    """Аспекты для массива записей CHART_DTYPE по их долготам — одним пакетом find_aspects."""
+    aspects = find_aspects(records["longitudes"])
+    chart = aspects["chart"]
+    # Записи уже отсортированы по карте и орбису: место аспекта внутри карты — смещение от первой записи карты
+    first = np.searchsorted(chart, chart, side="left")
+    rank = np.arange(len(aspects)) - first
+    keep = rank < MAX_ASPECTS
+    chart, rank, aspects = chart[keep], rank[keep], aspects[keep]
+    records["aspects"][chart, rank, 0] = aspects["p1"]
+    records["aspects"][chart, rank, 1] = aspects["p2"]
+    records["aspects"][chart, rank, 2] = aspects["aspect"]
+    records["aspect_count"] = np.minimum(np.bincount(chart, minlength=len(records)), MAX_ASPECTS)
+    return records
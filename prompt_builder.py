@@ -0,0 +1,141 @@
+import logging
+import math
+import os
+
+import numpy as np
+
+from aspect_engine import ASPECT_DTYPE, ASPECT_LABELS
+from astro_utils import get_zodiac_sign
+from metrics import REGISTRY, Histogram
+from natal_chart import PLANET_ORDER
+from recommendations import prompt_guides, prompt_rules
+
+logger = logging.getLogger(__name__)
+
+# Сборка запроса к модели. Порядок сообщений рассчитан на кэш промпта у провайдера:
+#   1. SYSTEM_PROMPT — статичный префикс, байт в байт одинаковый во всех запросах
+#      (никаких дат, имён и данных пользователя — иначе кэш префикса не сработает);
+#   2. данные карты — в конце, в сжатом виде: знак и градус в знаке, дом,
+#      не больше MAX_PROMPT_ASPECTS аспектов с самым тугим орбисом
+#      (записи ASPECT_DTYPE из NatalChart.aspect_records(), уже от самого точного).
+# Размер каждой части оценивается в токенах и пишется в метрику astrobot_prompt_tokens;
+# точное число токенов и сколько из них взято из кэша — в astrobot_openai_tokens_total из usage.
+# OpenAI кэширует префикс от 1024 токенов: всё, что меняется, должно идти после него.
+# Поэтому в префиксе — правила для всех блоков ответа (таблицы recommendations.py), а не только
+# для Нептуна и Сатурна: ≈1870 токенов по count_tokens. Русский текст у токенизатора OpenAI
+# плотнее оценки, но и с запасом на это префикс длиннее порога; попадания — cached_tokens в usage.
+
+MAX_PROMPT_ASPECTS = int(os.environ.get("PROMPT_MAX_ASPECTS", "6"))
+
+GUIDES_PROMPT = "Используй эти правила для остальных блоков, дополняя их своими словами:\n" + prompt_guides()
+
+SYSTEM_PROMPT = """Ты — продвинутый практический астролог нового поколения. Твоя задача — интерпретировать взаимодействие Нептуна и Сатурна на основе натальных данных пользователя.
+Используй чёткую структуру, минимум «воды», максимум пользы и практичности.
+Формат ответа:
+🧭 <b>Что делать?</b>\n
+🛠️ <b>Как делать?</b>\n
+🎯 <b>Ради чего?</b>\n
+📌 <b>Что нужно, чтобы получить возможность желаемого?</b>\n
+🛡️ <b>Как нейтрализовать риски?</b>\n
+✅ <b>Практические шаги:</b>\n
+
+Внимание:
+- Используй дома и знаки Марса для ответа на вопрос "Как делать?".
+- Используй дома и знаки Юпитера и управителя 9 дома для ответа на вопрос "Ради чего?".
+- Пример: "Сатурн в 8 доме" → дай конкретную рекомендацию (например, «написать антикризисный план»).
+- Пример: "Нептун в 9 доме" → «обратиться к молитве, духовному наставнику».
+- Если дом = 0, напиши, что данных недостаточно.
+- Не выдумывай другие дома, знаки или аспекты. Используй только те значения, которые я тебе передаю.
+
+Используй инструкцию с рекомендациями по домам для Нептуна и Сатурна для ответа на вопрос "Что делать?":
+""" + prompt_rules() + """
+
+""" + GUIDES_PROMPT + """
+
+Шаблон можно дополнять, но не меняй структуру блоков.
+Старайся дать 4 конкретных пунктов в "Практические шаги".
+Используй HTML для оформления: жирный шрифт — через <b>, курсив — через <i>, абзацы — через \\n.
+
+Данные: «Планета: знак градус в знаке, дом N»; аспекты — от самого точного, с орбисом."""
+
+PLANET_NAMES = ("Нептун", "Сатурн", "Марс", "Юпитер")
+
+PROMPT_TOKENS = REGISTRY.register(Histogram(
+    "astrobot_prompt_tokens", "Оценка токенов запроса к модели по частям промпта", ["section"],
+    buckets=(25, 50, 100, 200, 400, 800, 1200, 1600, 2400, 3200),
+))
+
+
+def count_tokens(text):
+    """Грубая оценка токенов (~3 символа на токен для русского текста); точное число — в usage ответа."""
+    return (len(text) + 2) // 3
+
+
+SYSTEM_TOKENS = count_tokens(SYSTEM_PROMPT)
+
+
+def select_aspects(aspects, limit=MAX_PROMPT_ASPECTS):
+    """До limit аспектов с самым тугим орбисом: записи ASPECT_DTYPE уже отсортированы по орбису."""
+    if aspects is None:
+        return np.empty(0, dtype=ASPECT_DTYPE)
+    return aspects[:limit]
+
+
+def format_planet(name, planet):
+    if not isinstance(planet, dict) or planet.get("degree") is None:
+        return f"{name}: н/д"
+    degree = planet["degree"] % 360
+    # Отбрасываем, а не округляем: 29.97° — ещё «29.9°» в том же знаке, а не «30.0°»
+    in_sign = math.floor(degree % 30 * 10) / 10
+    return f"{name}: {get_zodiac_sign(degree)} {in_sign:.1f}°, дом {planet.get('house', 0)}"
+
+
+def aspect_name(record):
+    return f"{PLANET_ORDER[record['p1']]} {ASPECT_LABELS[record['aspect']]} {PLANET_ORDER[record['p2']]}"
+
+
+def format_aspect(record):
+    return f"{aspect_name(record)} {record['orb']:.1f}°"
+
+
+class Prompt:
+    """Сообщения для chat.completions, выбранные аспекты (ASPECT_DTYPE) и оценка токенов по частям."""
+
+    __slots__ = ("messages", "aspects", "sections")
+
+    def __init__(self, messages, aspects, sections):
+        self.messages = messages
+        self.aspects = aspects
+        self.sections = sections
+
+    @property
+    def tokens(self):
+        return sum(self.sections.values())
+
+    @property
+    def aspect_names(self):
+        # Для ключа кэша интерпретаций: орбис в ключ не входит
+        return [aspect_name(record) for record in self.aspects]
+
+
+def build_prompt(neptune, saturn, mars, jupiter, aspects):
+    """aspects — записи ASPECT_DTYPE карты (NatalChart.aspect_records()), от самого точного."""
+    selected = select_aspects(aspects)
+    planets = "\n".join(
+        format_planet(name, planet) for name, planet in zip(PLANET_NAMES, (neptune, saturn, mars, jupiter))
+    )
+    aspect_line = "Аспекты: " + ("; ".join(format_aspect(a) for a in selected) if len(selected) else "—")
+    sections = {
+        "system": SYSTEM_TOKENS,
+        "planets": count_tokens(planets),
+        "aspects": count_tokens(aspect_line),
+    }
+    for section, tokens in sections.items():
+        PROMPT_TOKENS.observe(tokens, section=section)
+    logger.debug("Промпт ≈%d токенов: %s", sum(sections.values()),
+                 ", ".join(f"{section} {tokens}" for section, tokens in sections.items()))
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"{planets}\n{aspect_line}"},
+    ]
+    return Prompt(messages, selected, sections)
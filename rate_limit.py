@@ -0,0 +1,93 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class AsyncTokenBucket:
+    """Ведро токенов для asyncio: rate токенов в секунду, не больше capacity за раз."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """Взять токены без ожидания; False, если их сейчас нет."""
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens=1):
+        """Дождаться и взять токены. Ожидающие обслуживаются по очереди."""
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Остановить выдачу токенов на seconds (например, после 429 Retry-After)."""
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+        self.updated_at = time.monotonic()
+
+
+class PriorityTokenBucket(AsyncTokenBucket):
+    """AsyncTokenBucket, в котором ожидающие обслуживаются по приоритету (меньше — раньше),
+    а при равном приоритете — по очереди. Взятое можно частично вернуть через refund."""
+
+    def __init__(self, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self.waiters = []  # куча (priority, номер, tokens, future)
+        self.counter = itertools.count()
+        self.pump_task = None
+
+    async def acquire(self, tokens=1, priority=0):
+        # Запрос больше ёмкости иначе не выполнится никогда
+        tokens = min(tokens, self.capacity)
+        if not self.waiters and self.try_acquire(tokens):
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), tokens, future))
+        if self.pump_task is None or self.pump_task.done():
+            self.pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self.waiters:
+            _, _, tokens, future = self.waiters[0]
+            if future.done():
+                # Ожидающего отменили (таймаут, пользователь ушёл)
+                heapq.heappop(self.waiters)
+                continue
+            self._refill()
+            if self.tokens >= tokens:
+                heapq.heappop(self.waiters)
+                self.tokens -= tokens
+                future.set_result(None)
+                continue
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def refund(self, tokens):
+        """Вернуть неиспользованное (отрицательное значение — доплатить перерасход)."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def depth(self):
+        """Число ожидающих по приоритетам."""
+        depth = {}
+        for priority, _, _, future in self.waiters:
+            if not future.done():
+                depth[priority] = depth.get(priority, 0) + 1
+        return depth
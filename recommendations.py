@@ -0,0 +1,246 @@
+import os
+
+from aspect_engine import ASPECT_LABELS
+from astro_utils import get_zodiac_sign
+from natal_chart import PLANET_ORDER
+
+# Рекомендации по правилам: те же указания по домам Нептуна и Сатурна, что раньше были
+# только текстом в SYSTEM_PROMPT, плюс правила для Марса («Как делать?»), Юпитера («Ради чего?»)
+# и напряжённых аспектов («Как нейтрализовать риски?»). Ответ собирается из карты без сети
+# за доли миллисекунды; модель — необязательное дополнение (см. MODE).
+#
+# RECOMMENDATION_MODE:
+#   hybrid — сразу ответ по правилам, разбор ИИ приходит следом отдельным сообщением (по умолчанию)
+#   rules  — только ответ по правилам, OpenAI не вызывается
+#   llm    — только ответ ИИ, как раньше
+
+MODE = os.environ.get("RECOMMENDATION_MODE", "hybrid")
+
+# «Что делать?» — по дому Нептуна и дому Сатурна. Из этих же таблиц собирается SYSTEM_PROMPT.
+NEPTUNE_HOUSES = {
+    1: "плавание, активности на природе",
+    2: "еда (рыба) + вино",
+    3: "писать (стихи, тексты, посты, книги)",
+    4: "поставить иконы дома, уход за предками, помощь своему Роду",
+    5: "погрузиться в свое хобби, кулинария, творчество",
+    6: "уход за собой (пиявки, иглоукалывание)",
+    7: "помощь другу неудачнику, забота о партнере",
+    8: "энергетические практики (активация чакр)",
+    9: "молитва, церковь",
+    10: "час явного безделия у всех на виду, лениться",
+    11: "волонтерство, благотворительность, поддержать единомышленников",
+    12: "сходить на концерт, единение с природой",
+}
+
+SATURN_HOUSES = {
+    1: "физкультура, активный спорт регулярно",
+    2: "коллекционировать, покупки с запасом",
+    3: "вести блог, дневники",
+    4: "деятельность связанная с долгом Родине и Роду (взять на себя ответственность или помочь)",
+    5: "организация праздника, мероприятия, руководить проектом",
+    6: "диета, аскеза, очистка",
+    7: "друзьям и партнерам дать слово, подписать с ними договор, выполнить данное вами обещание",
+    8: "побороть страх, разобраться с долгами, закрыть любые висячие вопросы с другими людьми и их ресурсами",
+    9: "сходить в церковь, храм, посетить эксклюзивное мероприятие, высшее общество",
+    10: "взять подчиненного, над кем-то взять ответственность",
+    11: "вступить в клуб, партию, группу, посетить мероприятие",
+    12: "нарисовать, визуализировать, проявить эмоцию, страх и найти решение",
+}
+
+HOUSE_AREAS = {
+    1: "личности и тела",
+    2: "денег и ресурсов",
+    3: "общения и обучения",
+    4: "дома и семьи",
+    5: "творчества и детей",
+    6: "здоровья и ежедневной работы",
+    7: "партнёрства",
+    8: "кризисов и общих ресурсов",
+    9: "мировоззрения и учёбы",
+    10: "карьеры и статуса",
+    11: "друзей и сообществ",
+    12: "уединения и внутреннего мира",
+}
+
+# «Как делать?» — стиль действий по знаку Марса, сфера — по дому Марса
+MARS_SIGNS = {
+    "Овен": "быстро и напористо, короткими рывками, беря инициативу на себя",
+    "Телец": "медленно и основательно, шаг за шагом, не жертвуя комфортом",
+    "Близнецы": "через общение и переписку, держа в работе несколько задач сразу",
+    "Рак": "бережно, вместе с близкими, опираясь на дом",
+    "Лев": "ярко и на виду, личным примером",
+    "Дева": "по плану и чек-листу, аккуратно, с вниманием к деталям",
+    "Весы": "в паре или команде, через договорённости",
+    "Скорпион": "сосредоточенно и до конца, без лишней огласки",
+    "Стрелец": "с размахом, через учёбу, поездки и большую цель",
+    "Козерог": "дисциплинированно, по графику, с результатом к сроку",
+    "Водолей": "нестандартно, вместе с единомышленниками, через технологии",
+    "Рыбы": "мягко и интуитивно, в своём ритме, через воображение",
+}
+
+MARS_HOUSES = {
+    1: "через тело и личную активность",
+    2: "через заработок и работу с ресурсами",
+    3: "через тексты, обучение и короткие поездки",
+    4: "дома и в семейных делах",
+    5: "через хобби, творчество и игру",
+    6: "в ежедневной рутине и работе",
+    7: "в партнёрстве, договариваясь",
+    8: "через решение трудных и запущенных вопросов",
+    9: "через учёбу, путешествия и наставников",
+    10: "в карьере и на публике",
+    11: "в команде и сообществе",
+    12: "наедине с собой, без свидетелей",
+}
+
+# «Ради чего?» — по дому Юпитера
+JUPITER_HOUSES = {
+    1: "ради уверенности в себе и личного роста",
+    2: "ради достатка и ощущения собственной ценности",
+    3: "ради новых знаний и полезных связей",
+    4: "ради крепкого дома и поддержки Рода",
+    5: "ради радости, любви и самовыражения",
+    6: "ради здоровья и любимого дела",
+    7: "ради гармоничных отношений и надёжных партнёров",
+    8: "ради внутренней силы и обновления",
+    9: "ради мудрости, веры и новых горизонтов",
+    10: "ради признания и профессионального роста",
+    11: "ради единомышленников и исполнения мечты",
+    12: "ради душевного покоя и духовного роста",
+}
+
+# «Как нейтрализовать риски?» — по планетам в напряжённых аспектах (квадрат, оппозиция)
+TENSE_ASPECTS = ("квадрат", "оппозиция")
+PLANET_RISKS = {
+    "Нептун": "иллюзии и размытые границы — проверяй факты и не обещай лишнего",
+    "Сатурн": "страх и перегруз — дели задачу на маленькие шаги и отдыхай по расписанию",
+    "Марс": "спешка и конфликты — делай паузу перед резкими решениями",
+    "Юпитер": "переоценка сил — оставляй запас времени и денег",
+}
+MAX_RISKS = 3
+
+NO_DATA = "данных недостаточно (дом не определён)"
+
+_TENSE_INDEXES = {ASPECT_LABELS.index(label) for label in TENSE_ASPECTS}
+
+
+def prompt_rules():
+    """Правила по домам Нептуна и Сатурна в том виде, в каком они идут в SYSTEM_PROMPT."""
+    lines = []
+    for title, rules in (("Нептун", NEPTUNE_HOUSES), ("Сатурн", SATURN_HOUSES)):
+        lines.append(f"{title}:")
+        for house in range(1, 13):
+            preposition = "во" if house == 2 else "в"
+            ending = "." if house == 12 else ","
+            lines.append(f"{preposition} {house} - {rules[house]}{ending}")
+    return "\n".join(lines)
+
+
+def prompt_guides():
+    """Правила для Марса, Юпитера и рисков — те же таблицы, что в ответе по правилам, для SYSTEM_PROMPT."""
+    lines = ['Стиль действий по знаку Марса (для "Как делать?"):']
+    lines += [f"{sign} — {rule};" for sign, rule in MARS_SIGNS.items()]
+    lines.append('Сфера действий по дому Марса (для "Как делать?"):')
+    lines += [f"{house} дом — {rule};" for house, rule in MARS_HOUSES.items()]
+    lines.append('Цель по дому Юпитера (для "Ради чего?"):')
+    lines += [f"{house} дом — {rule};" for house, rule in JUPITER_HOUSES.items()]
+    lines.append('Сфера жизни по дому Сатурна (для "Что нужно, чтобы получить возможность желаемого?"):')
+    lines += [f"{house} дом — сфера {area};" for house, area in HOUSE_AREAS.items()]
+    lines.append(f'Риски планеты в аспекте {" или ".join(TENSE_ASPECTS)} (для "Как нейтрализовать риски?"):')
+    lines += [f"{planet} — {risk};" for planet, risk in PLANET_RISKS.items()]
+    return "\n".join(lines)
+
+
+def _house(planet):
+    if not isinstance(planet, dict):
+        return 0
+    return planet.get("house") or 0
+
+
+def _sign(planet):
+    if not isinstance(planet, dict) or planet.get("degree") is None:
+        return None
+    return get_zodiac_sign(planet["degree"])
+
+
+def _position(name, planet):
+    sign, house = _sign(planet), _house(planet)
+    if sign is None:
+        return f"{name}: н/д"
+    return f"{name} — {sign}, {house} дом" if house else f"{name} — {sign}"
+
+
+def _capitalize(text):
+    return text[:1].upper() + text[1:]
+
+
+def _risks(aspects):
+    # aspects — записи ASPECT_DTYPE (NatalChart.aspect_records()), от самого точного
+    risks = []
+    for record in aspects if aspects is not None else ():
+        if record["aspect"] not in _TENSE_INDEXES:
+            continue
+        first, kind, second = PLANET_ORDER[record["p1"]], ASPECT_LABELS[record["aspect"]], PLANET_ORDER[record["p2"]]
+        planet = next((p for p in (first, second) if p in PLANET_RISKS), None)
+        if planet is None:
+            continue
+        risks.append(f"{first} {kind} {second}: {PLANET_RISKS[planet]}")
+        if len(risks) >= MAX_RISKS:
+            break
+    return risks
+
+
+def render_recommendations(neptune, saturn, mars, jupiter, aspects):
+    """Полный ответ 🧭/🛠️/🎯/📌/🛡️/✅ в HTML для Telegram — без обращения к модели.
+
+    aspects — записи ASPECT_DTYPE карты (NatalChart.aspect_records()).
+    """
+    neptune_house, saturn_house = _house(neptune), _house(saturn)
+    mars_house, jupiter_house = _house(mars), _house(jupiter)
+    mars_sign, jupiter_sign = _sign(mars), _sign(jupiter)
+
+    what = []
+    what.append(f"• Нептун в {neptune_house} доме: {NEPTUNE_HOUSES[neptune_house]}." if neptune_house in NEPTUNE_HOUSES
+                else f"• Нептун: {NO_DATA}.")
+    what.append(f"• Сатурн в {saturn_house} доме: {SATURN_HOUSES[saturn_house]}." if saturn_house in SATURN_HOUSES
+                else f"• Сатурн: {NO_DATA}.")
+
+    if mars_sign is None:
+        how = f"Марс: {NO_DATA}."
+    else:
+        how = f"{_position('Марс', mars)}: действуй {MARS_SIGNS[mars_sign]}"
+        how += f", {MARS_HOUSES[mars_house]}." if mars_house in MARS_HOUSES else "."
+
+    if jupiter_house in JUPITER_HOUSES:
+        why = f"{_position('Юпитер', jupiter)}: всё это — {JUPITER_HOUSES[jupiter_house]}."
+    else:
+        why = f"Юпитер: {NO_DATA}."
+
+    if saturn_house in HOUSE_AREAS:
+        need = (f"Регулярность и ответственность в сфере {HOUSE_AREAS[saturn_house]} (Сатурн в {saturn_house} доме): "
+                f"выбери одно дело из списка Сатурна и делай его по расписанию, а не по настроению.")
+    else:
+        need = f"Сатурн: {NO_DATA}."
+
+    risks = _risks(aspects) or [f"{name}: {PLANET_RISKS[name]}" for name in ("Нептун", "Сатурн")]
+
+    steps = []
+    if neptune_house in NEPTUNE_HOUSES:
+        steps.append(f"{_capitalize(NEPTUNE_HOUSES[neptune_house])} — выдели на это время на этой неделе.")
+    if saturn_house in SATURN_HOUSES:
+        steps.append(f"{_capitalize(SATURN_HOUSES[saturn_house])} — внеси в календарь как обязательство.")
+    if mars_sign is not None:
+        steps.append(f"Начни первый шаг в течение трёх дней — {MARS_SIGNS[mars_sign]}.")
+    if jupiter_house in JUPITER_HOUSES:
+        steps.append(f"Раз в неделю сверяйся с целью: {JUPITER_HOUSES[jupiter_house]}.")
+    steps.append("Через месяц подведи итог: что получилось и что мешало.")
+
+    sections = [
+        "🧭 <b>Что делать?</b>\n" + "\n".join(what),
+        "🛠️ <b>Как делать?</b>\n" + how,
+        "🎯 <b>Ради чего?</b>\n" + why,
+        "📌 <b>Что нужно, чтобы получить возможность желаемого?</b>\n" + need,
+        "🛡️ <b>Как нейтрализовать риски?</b>\n" + "\n".join(f"• {risk}" for risk in risks),
+        "✅ <b>Практические шаги:</b>\n" + "\n".join(f"{i}. {step}" for i, step in enumerate(steps[:4], 1)),
+    ]
+    return "\n\n".join(sections)
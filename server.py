@@ -1,4 +1,6 @@
-from flask import Flask
+from flask import Flask, Response
+from metrics import render
+from warmup import is_ready
 app = Flask(__name__)
 
 @app.route("/")
@@ -8,3 +10,11 @@ def home():
 @app.route("/ping")
 def ping():
     return "pong", 200
+
+@app.route("/ready")
+def ready():
+    return ("ready", 200) if is_ready() else ("starting", 503)
+
+@app.route("/metrics")
+def metrics():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,287 @@
+import argparse
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from aspect_engine import ASPECT_ANGLES, PLANET_ORBS, find_cross_aspects, format_aspect
+from chart_store import get_store
+from metrics import timed
+from natal_chart import PLANET_INDEX, PLANET_ORDER
+
+logger = logging.getLogger(__name__)
+
+# Синастрия и поиск похожих карт по всей базе.
+#
+# synastry_scores — аспекты одной карты сразу с N картами: массив (N, P, Q) угловых расстояний,
+# у каждой пары берётся ближайший угол аспекта по таблице на каждый градус (орбисы меньше
+# половины промежутка между углами, так что второго аспекта у пары не бывает); правила
+# орбисов — те же, что в aspect_engine.
+#
+# ChartIndex — долготы всех карт в памяти (float32, 40 МБ на миллион) и для каждой планеты
+# карты, разложенные по корзинам в BUCKET_DEGREES (CSR: order — номера карт по возрастанию корзины,
+# offsets — начало каждой корзины). Запрос «планета в дуге [a, b]» — срезы order без полного
+# прохода; точная проверка — только по кандидатам из этих корзин.
+#   similar  — похожие Сатурн и Нептун (SIGNATURE) с допуском SIMILAR_TOLERANCE;
+#   partners — кандидаты по контактам CONTACTS (Венера → Марс и Солнце → Луна партнёра в аспекте
+#              с орбисом CONTACT_ORB): первый — по корзинам индекса, остальные — проверкой кандидатов;
+#              затем полная синастрия ядром synastry_scores и лучшие по сумме точности аспектов.
+# Индекс строится из chart_store пачками и пересобирается в фоне раз в CHART_INDEX_MAX_AGE секунд.
+#
+#   python synastry.py 123 --with 456      # аспекты между двумя пользователями
+#   python synastry.py 123 --similar
+#   python synastry.py 123 --partners
+
+BUCKET_DEGREES = 1.0
+BUCKETS = int(360 / BUCKET_DEGREES)
+SIGNATURE = ("Сатурн", "Нептун")
+SIMILAR_TOLERANCE = 2.0
+CONTACTS = (("Венера", "Марс"), ("Солнце", "Луна"))
+CONTACT_ORB = 2.0
+# Пачка карт для ядра: массивы (CHUNK_SIZE, P, Q) float32 помещаются в кэш процессора
+CHUNK_SIZE = 1024
+BUILD_BATCH = 50000
+INDEX_MAX_AGE = float(os.environ.get("CHART_INDEX_MAX_AGE", "600"))
+
+# Ближайший угол аспекта для расстояния в [k, k + 1) градусов. Границы между углами (30°, 75°, ...)
+# целые, поэтому внутри градуса ближайший угол один и тот же
+_NEAREST = ASPECT_ANGLES[
+    np.abs(np.arange(181)[:, None] + 0.5 - ASPECT_ANGLES[None, :]).argmin(axis=1)
+].astype(np.float32)
+
+
+def _distance(a, b):
+    d = np.abs(a - b) % 360
+    return np.minimum(d, 360 - d)
+
+
+def synastry_scores(longitudes, others, orbs=PLANET_ORBS, chunk_size=CHUNK_SIZE):
+    """Карта (P,) против N карт (N, Q): сумма точности аспектов и их число для каждой из N."""
+    mine = np.asarray(longitudes, dtype=np.float32) % 360
+    others = np.asarray(others, dtype=np.float32) % 360
+    orbs = np.asarray(orbs, dtype=np.float32)
+    max_orb = np.maximum(orbs[:, None], orbs[None, :])
+    # 1 / допустимый орбис; через границу знака орбис соединения вдвое уже, остальных — на 30%
+    inverse = 1 / max_orb
+    through_inverse = np.stack([inverse / np.float32(0.7), inverse * 2])
+    mine_sign = (mine // 30).astype(np.int8)[None, :, None]
+
+    scores = np.zeros(len(others), dtype=np.float32)
+    counts = np.zeros(len(others), dtype=np.int32)
+    for start in range(0, len(others), chunk_size):
+        theirs = others[start:start + chunk_size]
+        separation = np.abs(mine[None, :, None] - theirs[:, None, :])
+        np.minimum(separation, 360 - separation, out=separation)
+        nearest = _NEAREST[separation.astype(np.intp)]
+        orb = np.abs(separation - nearest, out=separation)
+        through = mine_sign != (theirs // 30).astype(np.int8)[:, None, :]
+        ratio = orb * np.where(through, np.where(nearest == 0, through_inverse[1], through_inverse[0]), inverse)
+        # Точность 1 - орб / допустимый; аспект — пока она не меньше нуля (допустимый орбис < CANDIDATE_ORB)
+        exactness = np.subtract(1, ratio, out=ratio)
+        hit = exactness >= 0
+        scores[start:start + len(theirs)] = np.maximum(exactness, 0, out=exactness).sum(axis=(1, 2))
+        counts[start:start + len(theirs)] = np.count_nonzero(hit.reshape(len(theirs), -1), axis=1)
+    return scores, counts
+
+
+def synastry(chart, other):
+    """Аспекты между двумя картами строками, от самого точного: «Венера тригон Марс партнёра (...)»."""
+    records = find_cross_aspects(chart.longitudes, other.longitudes)
+    partner = [f"{name} партнёра" for name in PLANET_ORDER]
+    return [format_aspect(record, PLANET_ORDER, partner) for record in records]
+
+
+class ChartIndex:
+    def __init__(self, telegram_ids, longitudes):
+        self.telegram_ids = np.asarray(telegram_ids, dtype=np.int64)
+        self.longitudes = np.ascontiguousarray(np.asarray(longitudes, dtype=np.float32) % 360)
+        buckets = np.minimum((self.longitudes // BUCKET_DEGREES).astype(np.int32), BUCKETS - 1)
+        planets = self.longitudes.shape[1]
+        self.order = np.empty((planets, len(buckets)), dtype=np.int32)
+        self.offsets = np.zeros((planets, BUCKETS + 1), dtype=np.int64)
+        for p in range(planets):
+            self.order[p] = np.argsort(buckets[:, p], kind="stable")
+            np.cumsum(np.bincount(buckets[:, p], minlength=BUCKETS), out=self.offsets[p, 1:])
+        self.built_at = time.time()
+
+    @classmethod
+    def from_store(cls, store=None, batch_size=BUILD_BATCH):
+        """Индекс по всем картам хранилища: читаются сырые записи, без разбора в NatalChart."""
+        telegram_ids, longitudes = [], []
+        for records in (store or get_store()).iter_records(batch_size):
+            telegram_ids.append(records["telegram_id"])
+            longitudes.append(records["longitudes"].astype(np.float32))
+        if not telegram_ids:
+            return cls(np.empty(0, dtype=np.int64), np.empty((0, len(PLANET_ORDER)), dtype=np.float32))
+        return cls(np.concatenate(telegram_ids), np.concatenate(longitudes))
+
+    def __len__(self):
+        return len(self.telegram_ids)
+
+    def _span(self, center, radius):
+        # Номера корзин дуги [center - radius, center + radius]; дуга может переходить через 0°
+        if radius >= 180:
+            return 0, BUCKETS
+        first = int(((center - radius) % 360) // BUCKET_DEGREES) % BUCKETS
+        last = int(((center - radius) % 360 + 2 * radius) // BUCKET_DEGREES)
+        return first, min(last + 1, first + BUCKETS)
+
+    def _candidates(self, planet, center, radius):
+        first, stop = self._span(center, radius)
+        order, offsets = self.order[planet], self.offsets[planet]
+        if stop <= BUCKETS:
+            return order[offsets[first]:offsets[stop]]
+        return np.concatenate([order[offsets[first]:], order[:offsets[stop - BUCKETS]]])
+
+    def _span_size(self, planet, center, radius):
+        first, stop = self._span(center, radius)
+        offsets = self.offsets[planet]
+        if stop <= BUCKETS:
+            return offsets[stop] - offsets[first]
+        return offsets[BUCKETS] - offsets[first] + offsets[stop - BUCKETS]
+
+    def near(self, planet, center, radius):
+        """Номера карт, у которых планета не дальше radius градусов от center, и эти расстояния."""
+        rows = self._candidates(planet, center, radius)
+        distance = _distance(self.longitudes[rows, planet], np.float32(center))
+        keep = distance <= radius
+        return rows[keep], distance[keep]
+
+    def _without(self, rows, exclude, *values):
+        if exclude is None:
+            return (rows,) + values
+        keep = self.telegram_ids[rows] != exclude
+        return (rows[keep],) + tuple(value[keep] for value in values)
+
+    @staticmethod
+    def _smallest(keys, limit):
+        # Позиции limit наименьших ключей по возрастанию: argpartition, затем сортировка только их
+        if len(keys) > limit:
+            best = np.argpartition(keys, limit)[:limit]
+        else:
+            best = np.arange(len(keys))
+        return best[np.argsort(keys[best], kind="stable")]
+
+    def similar(self, longitudes, planets=SIGNATURE, tolerance=SIMILAR_TOLERANCE, limit=20, exclude=None):
+        """Карты, где все planets не дальше tolerance градусов от longitudes.
+
+        Возвращает (всего найдено, [(telegram_id, наибольшее отклонение)] — не больше limit, от самых близких).
+        """
+        indexes = [PLANET_INDEX[name] for name in planets]
+        # Перебираем корзины самой редкой планеты, остальные проверяем по кандидатам
+        indexes.sort(key=lambda p: self._span_size(p, longitudes[p], tolerance))
+        rows, deviation = self.near(indexes[0], longitudes[indexes[0]], tolerance)
+        for p in indexes[1:]:
+            distance = _distance(self.longitudes[rows, p], np.float32(longitudes[p]))
+            keep = distance <= tolerance
+            rows, deviation = rows[keep], np.maximum(deviation[keep], distance[keep])
+        rows, deviation = self._without(rows, exclude, deviation)
+        best = self._smallest(deviation, limit)
+        return len(rows), [(int(self.telegram_ids[rows[i]]), float(deviation[i])) for i in best]
+
+    def _targets(self, longitudes, planet):
+        # Точки, где планета партнёра образует аспект с planet карты: ±угол, без повторов для 0° и 180°
+        return sorted({round(float((longitudes[planet] + sign * angle) % 360), 6)
+                       for angle in ASPECT_ANGLES for sign in (1, -1)})
+
+    def contacts(self, longitudes, contacts=CONTACTS, orb=CONTACT_ORB):
+        """Номера карт, где у каждой пары (планета карты, планета партнёра) из contacts есть аспект с орбисом orb."""
+        pairs = [(PLANET_INDEX[mine], PLANET_INDEX[theirs]) for mine, theirs in contacts]
+        # По корзинам индекса — контакт с наименьшим числом кандидатов, остальные проверяем по ним
+        pairs.sort(key=lambda pair: sum(self._span_size(pair[1], target, orb)
+                                        for target in self._targets(longitudes, pair[0])))
+        mine, theirs = pairs[0]
+        rows = np.concatenate([self.near(theirs, target, orb)[0] for target in self._targets(longitudes, mine)])
+        for mine, theirs in pairs[1:]:
+            distance = _distance(self.longitudes[rows, theirs], np.float32(longitudes[mine]))
+            rows = rows[np.abs(distance - _NEAREST[distance.astype(np.intp)]) <= orb]
+        return rows
+
+    def partners(self, longitudes, contacts=CONTACTS, orb=CONTACT_ORB, limit=20, exclude=None):
+        """Лучшие по синастрии среди карт с контактами contacts: [(telegram_id, сумма точности, аспектов)]."""
+        rows, = self._without(self.contacts(longitudes, contacts, orb), exclude)
+        scores, counts = synastry_scores(longitudes, self.longitudes[rows])
+        best = self._smallest(-scores, limit)
+        return [(int(self.telegram_ids[rows[i]]), float(scores[i]), int(counts[i])) for i in best]
+
+_default_index = None
+_default_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def _rebuild():
+    global _default_index
+    try:
+        with timed("chart_index_build"):
+            index = ChartIndex.from_store()
+        with _default_lock:
+            _default_index = index
+        logger.info("Индекс карт пересобран: %d карт", len(index))
+    except Exception as e:
+        logger.error("Не удалось пересобрать индекс карт: %s", e)
+    finally:
+        _refreshing.clear()
+
+
+def get_index(max_age=INDEX_MAX_AGE):
+    """Индекс по хранилищу карт. Первый вызов строит его сразу, устаревший пересобирается в фоне."""
+    if _default_index is None:
+        with _default_lock:
+            if _default_index is None:
+                with timed("chart_index_build"):
+                    set_index(ChartIndex.from_store())
+        return _default_index
+    if time.time() - _default_index.built_at > max_age and not _refreshing.is_set():
+        _refreshing.set()
+        threading.Thread(target=_rebuild, name="chart-index", daemon=True).start()
+    return _default_index
+
+
+def set_index(index):
+    global _default_index
+    _default_index = index
+
+
+def similar_count(chart):
+    """Сколько пользователей с похожими Сатурном и Нептуном (без самого пользователя)."""
+    total, _ = get_index().similar(chart.longitudes, limit=0, exclude=chart.telegram_id)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Синастрия и похожие карты")
+    parser.add_argument("telegram_id", type=int)
+    parser.add_argument("--with", dest="other", type=int, help="аспекты с картой этого пользователя")
+    parser.add_argument("--similar", action="store_true", help="похожие Сатурн и Нептун")
+    parser.add_argument("--partners", action="store_true", help="лучшие по синастрии")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    store = get_store()
+    chart = store.get(args.telegram_id)
+    if chart is None:
+        parser.error(f"нет карты пользователя {args.telegram_id}")
+    if args.other is not None:
+        other = store.get(args.other)
+        if other is None:
+            parser.error(f"нет карты пользователя {args.other}")
+        print("\n".join(synastry(chart, other)) or "Аспектов нет")
+    if args.similar or args.partners:
+        started = time.perf_counter()
+        index = ChartIndex.from_store(store)
+        print(f"Индекс: {len(index)} карт за {time.perf_counter() - started:.1f} с")
+    if args.similar:
+        started = time.perf_counter()
+        total, found = index.similar(chart.longitudes, limit=args.limit, exclude=chart.telegram_id)
+        print(f"Похожих {' и '.join(SIGNATURE)} (±{SIMILAR_TOLERANCE:g}°): {total}, "
+              f"{(time.perf_counter() - started) * 1000:.1f} мс")
+        for telegram_id, deviation in found:
+            print(f"  {telegram_id}: отклонение {deviation:.2f}°")
+    if args.partners:
+        started = time.perf_counter()
+        found = index.partners(chart.longitudes, limit=args.limit, exclude=chart.telegram_id)
+        print(f"Синастрия (контакты {', '.join(' → '.join(pair) for pair in CONTACTS)}): {(time.perf_counter() - started) * 1000:.1f} мс")
+        for telegram_id, score, count in found:
+            print(f"  {telegram_id}: {score:.2f} ({count} аспектов)")
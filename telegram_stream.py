@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import re
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import timed
+from rate_limit import AsyncTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Потоковый ответ: одно сообщение в Telegram, которое дописывается по мере прихода текста.
+# Правки ограничены по частоте (на чат и глобально на бота), а промежуточный HTML
+# всегда закрывается, чтобы Telegram не отклонил правку.
+
+EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))
+# Общий лимит Bot API ~30 запросов в секунду на бота; оставляем запас под обычные сообщения
+GLOBAL_EDITS_PER_SECOND = float(os.environ.get("STREAM_GLOBAL_EDITS_PER_SECOND", "20"))
+MESSAGE_LIMIT = 4000  # жёсткий предел Telegram — 4096 символов
+CURSOR = " ▌"
+
+_TAG_RE = re.compile(r"<(/?)([a-zA-Z]+)[^<>]*>")
+_global_edits = None
+
+
+def _global_bucket():
+    global _global_edits
+    if _global_edits is None:
+        _global_edits = AsyncTokenBucket(GLOBAL_EDITS_PER_SECOND)
+    return _global_edits
+
+
+def open_tags(text):
+    """Теги, открытые к концу text, в порядке открытия: [("b", "<b>"), ...]."""
+    stack = []
+    for match in _TAG_RE.finditer(text):
+        closing, name = match.group(1), match.group(2).lower()
+        if not closing:
+            stack.append((name, match.group(0)))
+        else:
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] == name:
+                    del stack[i:]
+                    break
+    return stack
+
+
+def balance_html(text):
+    """Обрезать недописанный тег или сущность в конце и закрыть открытые теги."""
+    last_open = text.rfind("<")
+    if last_open > text.rfind(">"):
+        text = text[:last_open]
+    last_amp = text.rfind("&")
+    if last_amp != -1 and ";" not in text[last_amp:] and len(text) - last_amp <= 10:
+        text = text[:last_amp]
+    closing = "".join(f"</{name}>" for name, _ in reversed(open_tags(text)))
+    return text + closing
+
+
+def split_point(text, limit, start=0):
+    """Где разрезать text, чтобы первая часть была не длиннее limit.
+
+    По последнему переводу строки после start, иначе по limit — но не внутри тега или сущности:
+    недописанные «<b» и «&amp» уходят во вторую часть целиком.
+    """
+    cut = text.rfind("\n", start, limit)
+    if cut <= start:
+        cut = limit
+    last_open = text.rfind("<", start, cut)
+    if last_open > text.rfind(">", start, cut):
+        cut = last_open
+    last_amp = text.rfind("&", start, cut)
+    if last_amp != -1 and ";" not in text[last_amp:cut]:
+        cut = last_amp
+    # Тег длиннее limit не разрезать нельзя — лучше так, чем не сдвинуться с места
+    return cut if cut > start else limit
+
+
+class StreamingReply:
+    def __init__(self, bot, chat_id, interval=EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.message_id = None
+        self.prefix = ""      # незакрытые теги, перенесённые из предыдущего сообщения
+        self.text = ""        # текст текущего сообщения
+        self.sent_text = None
+        self.full_text = ""
+        self.next_edit_at = 0.0
+        self.first_visible_at = None
+
+    async def append(self, chunk):
+        self.full_text += chunk
+        self.text += chunk
+        if len(self.prefix) + len(self.text) > MESSAGE_LIMIT:
+            await self._split()
+        if time.monotonic() >= self.next_edit_at:
+            await self._publish(final=False)
+
+    async def finish(self):
+        """Последняя правка с полным текстом. Возвращает весь полученный текст."""
+        if self.text.strip():
+            await self._publish(final=True)
+        return self.full_text
+
+    async def abort(self):
+        """Поток оборвался (таймаут, отмена): показанный текст остаётся, но без курсора."""
+        try:
+            await self.finish()
+        except Exception as e:
+            logger.warning("Не удалось убрать курсор из ответа: %s", e)
+
+    async def _split(self):
+        # Переносим хвост в новое сообщение по последнему переводу строки, не разрывая тег
+        body = self.prefix + self.text
+        cut = split_point(body, MESSAGE_LIMIT, start=len(self.prefix))
+        head, tail = body[:cut], body[cut:]
+        carried = open_tags(head)
+        self.text = head[len(self.prefix):]
+        await self._publish(final=True)
+        self.message_id = None
+        self.sent_text = None
+        self.prefix = "".join(tag for _, tag in carried)
+        self.text = tail.lstrip("\n")
+
+    async def _publish(self, final):
+        body = balance_html(self.prefix + self.text)
+        if not final:
+            body += CURSOR
+            # Промежуточные правки пропускаем, если бот упёрся в общий лимит
+            if not _global_bucket().try_acquire():
+                return
+        else:
+            await _global_bucket().acquire()
+        if body == self.sent_text or not body.strip():
+            return
+
+        try:
+            await self._send(body, parse_mode="HTML")
+        except RetryAfter as e:
+            self.next_edit_at = time.monotonic() + e.retry_after
+            if final:
+                await asyncio.sleep(e.retry_after)
+                await self._send(body, parse_mode="HTML")
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            if not final:
+                logger.warning("Промежуточная правка отклонена: %s", e)
+                return
+            # Модель прислала HTML, который Telegram не принял, — отдаём как обычный текст
+            await self._send(self.prefix + self.text, parse_mode=None)
+
+        if self.first_visible_at is None:
+            self.first_visible_at = time.monotonic()
+        self.sent_text = body
+        self.next_edit_at = time.monotonic() + self.interval
+
+    async def _send(self, text, parse_mode):
+        with timed("telegram_send"):
+            if self.message_id is None:
+                message = await self.bot.send_message(chat_id=self.chat_id, text=text, parse_mode=parse_mode)
+                self.message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(
+                    chat_id=self.chat_id, message_id=self.message_id, text=text, parse_mode=parse_mode
+                )
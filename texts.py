@@ -0,0 +1,29 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# Тексты и кнопки, которые отправляют и бот (bot.py), и воркеры очереди (worker.py).
+# Отдельный модуль, чтобы воркер не импортировал bot.py со всем приложением PTB.
+
+OVERLOADED_TEXT = "⚠️ Сейчас слишком много запросов. Попробуй, пожалуйста, через минуту."
+TIMEOUT_TEXT = "⚠️ Расчёт занял слишком много времени. Попробуй, пожалуйста, ещё раз."
+ENRICHMENT_HEADER = "✨ <b>Подробный разбор от ИИ</b>\n\n"
+FORMAT_HINT_TEXT = "⚠️ Убедись, что данные введены в правильном формате: ДД.ММ.ГГГГ ЧЧ:ММ Город"
+NO_CHART_TEXT = "⚠️ Не нашёл твою натальную карту. Отправь данные рождения в формате: ДД.ММ.ГГГГ ЧЧ:ММ Город"
+CHART_SAVED_TEXT = "✅ Данные сохранены! Натальная карта рассчитана.\nНажми на кнопку ниже, чтобы получить рекомендации:"
+CHART_QUEUED_TEXT = "⏳ Рассчитываю натальную карту — пришлю, как только будет готово."
+CONTINUE_TEXT = "👇 Нажми кнопку ниже, чтобы продолжить:"
+WAIT_TEXT = "⏳ Подожди немного, я готовлю рекомендации на основе твоей натальной карты..."
+QUESTIONS_TEXT = (
+    "❓ <b>Остались вопросы?</b>\n"
+    "🔹 Заполни короткую форму — и я отвечу, как только смогу 👉 <a href='https://forms.gle/YuCsqzEbuYAQ6eba8'>форма</a>\n"
+    "🤖 Или задай вопрос нашему помощнику: <a href='https://t.me/lifeinastro_bot'>@lifeinastro_bot</a>"
+)
+
+SIMILAR_TEXT = (
+    "🪐 <b>Сатурн и Нептун почти как у тебя</b> (±{tolerance:g}°) — у {count} пользователей бота.\n\n"
+    "Это люди твоего поколения с тем же «рисунком» мечты и ответственности."
+)
+SIMILAR_NONE_TEXT = "🪐 Пока ни у кого из пользователей бота нет Сатурна и Нептуна так близко к твоим."
+
+
+def recommendations_keyboard():
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔮 Получить рекомендации", callback_data="get_recommendations")]])
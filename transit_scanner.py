@@ -0,0 +1,192 @@
+import argparse
+import time
+
+import numpy as np
+import swisseph as swe
+
+from astro_utils import PLANET_NAMES
+from aspect_engine import ASPECT_ANGLES, ASPECT_LABELS
+from batch_engine import body_longitudes
+from natal_chart import CHART_DTYPE, PLANET_ORDER
+
+# Когда транзитная планета точно встанет в аспект к натальной точке.
+#
+# 1. Долготы транзитных планет считаются один раз на сетке дат и общие для всех
+#    пользователей.
+# 2. Все натальные цели (точка + угол аспекта) для пачки пользователей сортируются;
+#    за каждый шаг сетки планета проходит маленькую дугу, и цели внутри неё находятся
+#    через searchsorted — без перебора пар «шаг × цель».
+# 3. Точный момент уточняется векторной бисекцией сразу для всех найденных проходов.
+#    Ретроградные петли дают отдельные проходы (до трёх на цель), каждый со своим флагом.
+
+TRANSIT_PLANETS = [swe.SATURN, swe.NEPTUNE, swe.JUPITER]
+STEP_DAYS = 1.0
+BISECTION_STEPS = 24  # 1 день / 2^24 ≈ 5 мс
+
+CUSP_NAMES = ["Asc", "2 дом", "3 дом", "IC", "5 дом", "6 дом", "Dsc", "8 дом", "9 дом", "MC", "11 дом", "12 дом"]
+TARGET_NAMES = PLANET_ORDER + CUSP_NAMES
+
+# Смещения цели от натальной точки: соединение и оппозиция — одна точка, остальные — две
+_OFFSETS = []
+for _aspect, _angle in enumerate(ASPECT_ANGLES.tolist()):
+    _OFFSETS.append((_aspect, _angle))
+    if 0 < _angle < 180:
+        _OFFSETS.append((_aspect, -_angle))
+OFFSET_ASPECTS = np.array([aspect for aspect, _ in _OFFSETS], dtype=np.uint8)
+OFFSET_ANGLES = np.array([angle for _, angle in _OFFSETS], dtype=np.float64)
+
+HIT_DTYPE = np.dtype([
+    ("chart", np.int64),        # строка в natal-массивах
+    ("planet", np.int32),       # номер планеты swisseph
+    ("target", np.uint8),       # индекс в TARGET_NAMES
+    ("aspect", np.uint8),       # индекс в ASPECT_LABELS
+    ("jd", np.float64),         # точный момент, UT
+    ("retrograde", np.bool_),
+])
+
+
+def _wrap180(values):
+    return (values + 180.0) % 360.0 - 180.0
+
+
+def natal_targets(longitudes, cusps):
+    """(U, 10) долгот планет и (U, 12) куспидов → (U, 22) натальных точек."""
+    return np.concatenate([np.asarray(longitudes, dtype=np.float64), np.asarray(cusps, dtype=np.float64)], axis=1)
+
+
+def natal_arrays(charts):
+    """Карты из chart_store (NatalChart) → (U, 10) долгот и (U, 12) куспидов."""
+    if not charts:
+        return np.empty((0, len(PLANET_ORDER))), np.empty((0, 12))
+    records = np.array([chart.record for chart in charts], dtype=CHART_DTYPE)
+    return records["longitudes"], records["cusps"][:, :12]
+
+
+class TransitSamples:
+    """Долготы транзитных планет на сетке дат — считаются один раз на весь прогон."""
+
+    def __init__(self, jd_from, jd_to, planets=TRANSIT_PLANETS, step=STEP_DAYS):
+        self.planets = list(planets)
+        self.jds = np.arange(jd_from, jd_to + step, step, dtype=np.float64)
+        self.longitudes = {planet: body_longitudes(planet, self.jds) for planet in self.planets}
+
+
+def _crossings(samples, planet, sorted_targets):
+    """Пары (шаг сетки, индекс в sorted_targets), где планета проходит через цель."""
+    lon = samples.longitudes[planet]
+    a, b = lon[:-1], lon[1:]
+    direct = _wrap180(b - a) >= 0
+    # Пройденная за шаг дуга (start, end]; при ретроградном движении концы меняются местами
+    start = np.where(direct, a, b)
+    end = np.where(direct, b, a)
+    first = np.searchsorted(sorted_targets, start, side="right")
+    last = np.searchsorted(sorted_targets, end, side="right")
+    wraps = end < start
+    # Дуга через 0° Овна: (start, 360) ∪ [0, end]
+    lengths_main = np.where(wraps, len(sorted_targets) - first, last - first)
+    lengths_wrap = np.where(wraps, last, 0)
+
+    steps = np.concatenate([
+        np.repeat(np.arange(len(a)), lengths_main),
+        np.repeat(np.arange(len(a)), lengths_wrap),
+    ])
+    starts = np.concatenate([np.repeat(first, lengths_main), np.zeros(lengths_wrap.sum(), dtype=np.int64)])
+    counts = np.concatenate([lengths_main, lengths_wrap])
+    # Смещение внутри каждой группы: 0, 1, 2, ...
+    group_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return steps, starts + group_offsets, ~direct[steps]
+
+
+def _refine(planet, lo, hi, targets):
+    """Векторная бисекция: момент, когда долгота планеты равна target, на отрезках [lo, hi]."""
+    f_lo = _wrap180(body_longitudes(planet, lo) - targets)
+    for _ in range(BISECTION_STEPS):
+        mid = (lo + hi) / 2
+        f_mid = _wrap180(body_longitudes(planet, mid) - targets)
+        left = np.signbit(f_mid) == np.signbit(f_lo)
+        lo = np.where(left, mid, lo)
+        f_lo = np.where(left, f_mid, f_lo)
+        hi = np.where(left, hi, mid)
+    return (lo + hi) / 2
+
+
+def scan(samples, natal, chart_offset=0):
+    """Все точные транзиты для (U, K) натальных точек на интервале samples."""
+    natal = np.asarray(natal, dtype=np.float64)
+    users, points = natal.shape
+    # Цели: (U, K, смещения) → плоский отсортированный массив
+    targets = (natal[:, :, None] + OFFSET_ANGLES[None, None, :]) % 360.0
+    flat = targets.ravel()
+    order = np.argsort(flat, kind="stable")
+    sorted_targets = flat[order]
+
+    results = []
+    for planet in samples.planets:
+        steps, positions, retrograde = _crossings(samples, planet, sorted_targets)
+        if len(steps) == 0:
+            continue
+        target_index = order[positions]
+        chart, rest = np.divmod(target_index, points * len(OFFSET_ANGLES))
+        point, offset = np.divmod(rest, len(OFFSET_ANGLES))
+        exact = _refine(planet, samples.jds[steps], samples.jds[steps + 1], flat[target_index])
+
+        hits = np.empty(len(steps), dtype=HIT_DTYPE)
+        hits["chart"] = chart + chart_offset
+        hits["planet"] = planet
+        hits["target"] = point
+        hits["aspect"] = OFFSET_ASPECTS[offset]
+        hits["jd"] = exact
+        hits["retrograde"] = retrograde
+        results.append(hits)
+
+    if not results:
+        return np.empty(0, dtype=HIT_DTYPE)
+    hits = np.concatenate(results)
+    return hits[np.lexsort((hits["jd"], hits["chart"]))]
+
+
+def scan_store(store, jd_from, jd_to, planets=TRANSIT_PLANETS, batch_size=5000):
+    """Один проход по всей базе: выборка эфемерид общая, пользователи идут пачками.
+
+    Возвращает (telegram_ids, hits), где hits["chart"] — индекс в telegram_ids.
+    """
+    samples = TransitSamples(jd_from, jd_to, planets)
+    telegram_ids = []
+    results = []
+    for charts in store.iter_batches(batch_size):
+        longitudes, cusps = natal_arrays(charts)
+        results.append(scan(samples, natal_targets(longitudes, cusps), chart_offset=len(telegram_ids)))
+        telegram_ids.extend(chart.telegram_id for chart in charts)
+    hits = np.concatenate(results) if results else np.empty(0, dtype=HIT_DTYPE)
+    return telegram_ids, hits
+
+
+def format_hit(hit):
+    year, month, day, hours = swe.revjul(float(hit["jd"]))
+    retro = " (R)" if hit["retrograde"] else ""
+    return (
+        f"{int(day):02d}.{int(month):02d}.{int(year)} — {PLANET_NAMES[int(hit['planet'])]}{retro} "
+        f"{ASPECT_LABELS[hit['aspect']]} {TARGET_NAMES[hit['target']]}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Точные транзиты для всех карт хранилища")
+    parser.add_argument("--from-year", type=int, default=2025)
+    parser.add_argument("--to-year", type=int, default=2026)
+    parser.add_argument("--user", type=int, help="показать транзиты одного пользователя")
+    args = parser.parse_args()
+
+    from chart_store import get_store
+
+    swe.set_ephe_path('.')
+    jd_from = swe.julday(args.from_year, 1, 1, 0)
+    jd_to = swe.julday(args.to_year + 1, 1, 1, 0)
+    started = time.perf_counter()
+    telegram_ids, hits = scan_store(get_store(), jd_from, jd_to)
+    print(f"✅ {len(telegram_ids)} карт, {len(hits)} точных транзитов за {time.perf_counter() - started:.1f} с")
+
+    if args.user is not None and args.user in telegram_ids:
+        chart = telegram_ids.index(args.user)
+        for hit in hits[hits["chart"] == chart]:
+            print(format_hit(hit))
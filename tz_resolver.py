@@ -0,0 +1,198 @@
+import argparse
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pytz
+
+from metrics import REGISTRY
+
+# Часовой пояс по координатам.
+# Основной путь — предрассчитанная сетка RESOLUTION×RESOLUTION градусов (memmap, uint16 —
+# номер пояса в ячейке). Ячейка получает пояс, только если он одинаков во всех её углах
+# и у всех соседей; остальные (границы поясов, побережья) помечены нулём, и для них
+# вызывается точная проверка полигонов timezonefinder. Сам timezonefinder загружается
+# лениво — при первом обращении к пограничной ячейке.
+# Исторические смещения и переход на летнее время даёт pytz по имени пояса.
+
+GRID_PATH = os.environ.get("TIMEZONE_GRID_PATH", "data/tz_grid.bin")
+RESOLUTION = 0.25
+DEFAULT_TIMEZONE = "Europe/Moscow"
+CACHE_SIZE = int(os.environ.get("TIMEZONE_CACHE_SIZE", "4096"))
+
+MAGIC = b"ASTZGR01"
+# magic, resolution, rows, cols, zones, names_size
+HEADER = struct.Struct("<8sdiiii")
+UNKNOWN = 0
+
+
+class TimezoneGrid:
+    def __init__(self, path=GRID_PATH):
+        with open(path, "rb") as f:
+            magic, resolution, rows, cols, zones, names_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path}: не файл сетки часовых поясов")
+            names = f.read(names_size).decode("utf-8").split("\n")
+        self.path = path
+        self.resolution = resolution
+        self.rows = rows
+        self.cols = cols
+        self.names = [None] + names  # номер 0 — «неизвестно, нужна точная проверка»
+        self.grid = np.memmap(path, dtype="<u2", mode="r", offset=HEADER.size + names_size, shape=(rows, cols))
+
+    def _cell(self, lat, lon):
+        row = min(self.rows - 1, max(0, int((lat + 90.0) / self.resolution)))
+        col = int(((lon + 180.0) % 360.0) / self.resolution) % self.cols
+        return row, col
+
+    def zone_at(self, lat, lon):
+        """Имя пояса или None, если ячейка пограничная."""
+        return self.names[self.grid[self._cell(lat, lon)]]
+
+
+def build_grid(path, resolution=RESOLUTION):
+    from timezonefinder import TimezoneFinder
+
+    finder = TimezoneFinder()
+    rows, cols = int(round(180 / resolution)), int(round(360 / resolution))
+    ids = {}
+    corners = np.zeros((rows + 1, cols + 1), dtype=np.int32)
+    for i in range(rows + 1):
+        lat = min(90.0, max(-90.0, -90.0 + i * resolution))
+        for j in range(cols + 1):
+            lon = -180.0 + j * resolution
+            name = finder.timezone_at(lng=lon if lon < 180.0 else 179.9999, lat=lat)
+            if name is not None:
+                corners[i, j] = ids.setdefault(name, len(ids) + 1)
+
+    # Ячейка однозначна, если все четыре угла в одном поясе
+    cells = corners[:-1, :-1]
+    same = (cells == corners[1:, :-1]) & (cells == corners[:-1, 1:]) & (cells == corners[1:, 1:]) & (cells != UNKNOWN)
+    # Тонкий клин чужого пояса может пройти между углами — поэтому соседи
+    # неоднозначной ячейки тоже считаются пограничными
+    ambiguous = ~same
+    spread = ambiguous.copy()
+    spread[1:, :] |= ambiguous[:-1, :]
+    spread[:-1, :] |= ambiguous[1:, :]
+    spread |= np.roll(ambiguous, 1, axis=1) | np.roll(ambiguous, -1, axis=1)
+    grid = np.where(spread, UNKNOWN, cells).astype("<u2")
+
+    names = "\n".join(sorted(ids, key=ids.get)).encode("utf-8")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, resolution, rows, cols, len(ids), len(names)))
+        f.write(names)
+        f.write(grid.tobytes())
+    os.replace(tmp_path, path)
+    return float(spread.mean())
+
+
+class TimezoneResolver:
+    def __init__(self, grid=None, cache_size=CACHE_SIZE):
+        self.grid = grid
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self._finder = None
+        self.counters = {"cache_hits": 0, "grid_hits": 0, "exact_lookups": 0, "defaults": 0}
+
+    @property
+    def finder(self):
+        if self._finder is None:
+            from timezonefinder import TimezoneFinder
+            self._finder = TimezoneFinder()
+        return self._finder
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def zone_name(self, lat, lon):
+        # Координаты города из геокодера всегда одни и те же — ключ кэша по ним и есть кэш по городу
+        key = (round(lat, 4), round(lon, 4))
+        with self.lock:
+            name = self.cache.get(key)
+            if name is not None:
+                self.cache.move_to_end(key)
+                self.counters["cache_hits"] += 1
+                return name
+
+        name = self.grid.zone_at(lat, lon) if self.grid is not None else None
+        if name is not None:
+            self._count("grid_hits")
+        else:
+            name = self.finder.timezone_at(lng=lon, lat=lat)
+            self._count("exact_lookups")
+        if name is None:
+            name = DEFAULT_TIMEZONE
+            self._count("defaults")
+
+        with self.lock:
+            self.cache[key] = name
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return name
+
+    def timezone(self, lat, lon):
+        return pytz.timezone(self.zone_name(lat, lon))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, grid=self.grid.path if self.grid is not None else None)
+
+
+_default_resolver = None
+_default_lock = threading.Lock()
+
+
+def get_resolver():
+    global _default_resolver
+    if _default_resolver is None:
+        with _default_lock:
+            if _default_resolver is None:
+                grid = TimezoneGrid(GRID_PATH) if GRID_PATH and os.path.exists(GRID_PATH) else None
+                _default_resolver = TimezoneResolver(grid=grid)
+    return _default_resolver
+
+
+def set_resolver(resolver):
+    global _default_resolver
+    with _default_lock:
+        _default_resolver = resolver
+
+
+def timezone_at(lat, lon):
+    """pytz-пояс для координат; без координат — пояс по умолчанию."""
+    if lat is None or lon is None:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+    return get_resolver().timezone(lat, lon)
+
+
+def _collect_metrics():
+    if _default_resolver is None:
+        return []
+    counters = _default_resolver.stats()
+    return [("astrobot_timezone_lookups_total", "counter", "Определение часового пояса по источникам",
+             [({"source": name}, counters[name]) for name in _default_resolver.counters])]
+
+
+REGISTRY.add_collector(_collect_metrics)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Построить сетку часовых поясов")
+    parser.add_argument("--resolution", type=float, default=RESOLUTION, help="шаг сетки в градусах")
+    parser.add_argument("--output", default=GRID_PATH)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    border_share = build_grid(args.output, args.resolution)
+    size = os.path.getsize(args.output) / 1024 / 1024
+    print(f"✅ {args.output}: шаг {args.resolution}°, {size:.1f} МБ, "
+          f"пограничных ячеек {border_share:.1%}, {time.perf_counter() - started:.1f} с")
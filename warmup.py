@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import time
+
+from metrics import REGISTRY, Gauge, timed
+
+logger = logging.getLogger(__name__)
+
+# Холодный старт. На fly.io машина останавливается без трафика, и первый пользователь ждёт запуска процесса:
+#   - тяжёлое импортируется лениво: openai — при первом запросе к ИИ (ai_interpreter.get_clients),
+#     расчёт карты, хранилище и индекс карт — в обработчиках, которым они нужны;
+#   - webhook.serve открывает порт до инициализации бота: апдейты, пришедшие раньше, ждут в очереди;
+#     /ping отвечает, как только открыт порт, /ready — когда бот обрабатывает апдейты
+#     (вместо фиксированной паузы на старте);
+#   - сразу после открытия порта фоновый поток прогревает то, что понадобится следующим шагам
+#     пользователя (STEPS, по порядку). Ошибка прогрева ни на что не влияет — шаг выполнится
+#     при первом запросе, как без прогрева.
+#   WARMUP=0            — не прогревать (локальная разработка);
+#   WARMUP_STEPS=a,b    — только эти шаги.
+# Время от запуска процесса до этапов — в astrobot_startup_seconds, шаги прогрева — в
+# astrobot_stage_duration_seconds{stage="warmup_<шаг>"}.
+# Профиль импорта и время до первого ответа на /start: python benchmarks/bench_coldstart.py
+
+WARMUP = os.environ.get("WARMUP", "1") != "0"
+WARMUP_STEPS = [s.strip() for s in os.environ.get("WARMUP_STEPS", "").split(",") if s.strip()]
+JOB_QUEUE_MODE = os.environ.get("JOB_QUEUE_MODE", "inline")
+
+STARTUP = REGISTRY.register(Gauge(
+    "astrobot_startup_seconds", "Время от запуска процесса до этапа старта", ["phase"]
+))
+
+
+def _process_age():
+    # Сколько секунд назад запущен процесс (Linux: /proc); иначе отсчёт идёт от импорта модуля
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+PROCESS_STARTED = time.monotonic() - _process_age()
+
+_ready = threading.Event()
+_started = threading.Event()
+
+
+def mark(phase):
+    """Запомнить, сколько прошло от запуска процесса до этапа (listening, ready, warm)."""
+    elapsed = time.monotonic() - PROCESS_STARTED
+    STARTUP.set(round(elapsed, 3), phase=phase)
+    logger.info("Старт: %s через %.2f с после запуска процесса", phase, elapsed)
+    return elapsed
+
+
+def mark_ready():
+    if not _ready.is_set():
+        _ready.set()
+        mark("ready")
+
+
+def is_ready():
+    return _ready.is_set()
+
+
+def warm_chart_worker():
+    """Выполняется в процессе стадии chart: модули расчёта, таблица эфемерид, сетка часовых поясов."""
+    import astro_calc  # noqa: F401
+    from ephemeris_table import get_ephemeris_table
+    from tz_resolver import get_resolver
+    get_ephemeris_table()
+    get_resolver()
+
+
+def _warm_chart():
+    # Геокодинг и сохранение карты идут в потоках основного процесса — им нужен astro_calc и здесь
+    import astro_calc  # noqa: F401
+    if JOB_QUEUE_MODE == "queue":
+        return  # карты считают процессы worker.py
+    from executor import get_stage
+    for future in get_stage("chart").prestart(warm_chart_worker):
+        future.result()
+
+
+def _warm_geocoder():
+    from geocoder import get_geocoder
+    get_geocoder()
+
+
+def _warm_storage():
+    # Открытие хранилища создаёт таблицу и соединение SQLite — лучше до первого пользователя
+    from chart_store import get_store
+    get_store()
+
+
+def _warm_openai():
+    from ai_interpreter import get_clients
+    get_clients()
+
+
+def _warm_chart_index():
+    from synastry import get_index
+    get_index()
+
+
+# Порядок — по шагам пользователя: данные рождения → кнопка рекомендаций → /similar
+STEPS = [
+    ("storage", _warm_storage),
+    ("geocoder", _warm_geocoder),
+    ("chart", _warm_chart),
+    ("openai", _warm_openai),
+    ("chart_index", _warm_chart_index),
+]
+
+
+def warm(steps=None):
+    """Выполнить шаги прогрева по порядку; ошибки — в лог и метрики."""
+    for name, step in STEPS:
+        if steps and name not in steps:
+            continue
+        try:
+            with timed(f"warmup_{name}"):
+                step()
+        except Exception as e:
+            logger.warning("Прогрев %s не удался: %s", name, e)
+    mark("warm")
+
+
+def start_warmup():
+    """Запустить прогрев в фоновом потоке (один раз на процесс)."""
+    if not WARMUP or _started.is_set():
+        return
+    _started.set()
+    threading.Thread(target=warm, args=(WARMUP_STEPS,), name="warmup", daemon=True).start()
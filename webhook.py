@@ -0,0 +1,150 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+from bot import build_application
+from metrics import render, STAGE_ERRORS
+from warmup import is_ready, mark, start_warmup
+
+logger = logging.getLogger(__name__)
+
+# Режим webhook: один aiohttp-сервер в одном event loop принимает апдейты от Telegram,
+# отдаёт /, /ping, /ready и /metrics и передаёт апдейты в Application (concurrent_updates).
+# Ответ Telegram отправляется сразу после постановки апдейта в очередь, обработка идёт в фоне,
+# поэтому медленный расчёт не задерживает доставку следующих апдейтов.
+# Порт открывается до application.initialize() (запрос getMe к Telegram): на холодном старте
+# первый апдейт принимается сразу и ждёт в очереди, /ready отвечает 200, когда бот его обработает.
+# Режим рассчитан на одну машину: карты, кэши и очередь задач — файлы SQLite этой машины,
+# и вторая машина на кнопку по карте, посчитанной первой, ответила бы «карта не найдена».
+#
+#   WEBHOOK_URL     — публичный адрес сервиса, например https://neptunsaturn.fly.dev
+#   WEBHOOK_SECRET  — секрет, который Telegram присылает в X-Telegram-Bot-Api-Secret-Token;
+#                     обязателен, если задан WEBHOOK_URL (без URL — локальный запуск, проверка отключена)
+#   WEBHOOK_PATH    — путь, на который приходят апдейты (/telegram)
+#   PORT            — порт HTTP-сервера (8080)
+
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+PORT = int(os.environ.get("PORT", "8080"))
+ALLOWED_UPDATES = ["message", "callback_query"]
+MAX_UPDATE_SIZE = 1024 * 1024
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def home(request):
+    return web.Response(text="✅ Бот работает!")
+
+
+async def ping(request):
+    return web.Response(text="pong")
+
+
+async def ready(request):
+    # Проверка готовности для балансировщика: /ping — процесс жив, /ready — апдейты обрабатываются
+    if is_ready():
+        return web.Response(text="ready")
+    return web.Response(status=503, text="starting")
+
+
+async def metrics(request):
+    return web.Response(body=render().encode("utf-8"), headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+async def receive_update(request):
+    application = request.app["application"]
+    secret = request.app["secret"]
+    if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+        update = Update.de_json(data, application.bot)
+    except Exception as e:
+        # На кривой апдейт отвечаем 200: иначе Telegram будет присылать его снова и снова
+        logger.warning("Не удалось разобрать апдейт: %s", e)
+        STAGE_ERRORS.inc(stage="webhook", error=type(e).__name__)
+        return web.Response()
+
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+def build_web_app(application, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH):
+    web_app = web.Application(client_max_size=MAX_UPDATE_SIZE)
+    web_app["application"] = application
+    web_app["secret"] = secret
+    web_app.router.add_get("/", home)
+    web_app.router.add_get("/ping", ping)
+    web_app.router.add_get("/ready", ready)
+    web_app.router.add_get("/metrics", metrics)
+    web_app.router.add_post(path, receive_update)
+    return web_app
+
+
+async def serve(application=None, host="0.0.0.0", port=PORT, url=WEBHOOK_URL, secret=WEBHOOK_SECRET,
+                stop_event=None):
+    """Запустить бота в режиме webhook и работать до SIGTERM/SIGINT (или stop_event)."""
+    if url and not secret:
+        # Без секрета /telegram принимает апдейты от кого угодно: поддельный callback_query
+        # от имени любого пользователя тратит токены OpenAI
+        raise ValueError("❌ WEBHOOK_SECRET не задан: публичный webhook без секрета не запускается")
+    application = application or build_application()
+    stop_event = stop_event or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    runner = web.AppRunner(build_web_app(application, secret=secret), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("🌐 Webhook-сервер слушает %s:%s", host, port)
+    mark("listening")
+    start_warmup()
+
+    try:
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+
+        if url:
+            # Вызов идемпотентный: перезапуск выставляет тот же адрес
+            await application.bot.set_webhook(
+                url=url.rstrip("/") + WEBHOOK_PATH,
+                secret_token=secret,
+                allowed_updates=ALLOWED_UPDATES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+            logger.info("🔗 Webhook зарегистрирован: %s%s", url.rstrip("/"), WEBHOOK_PATH)
+        else:
+            logger.warning("WEBHOOK_URL не задан — webhook в Telegram не регистрируется")
+        await stop_event.wait()
+    finally:
+        logger.info("Останавливаем webhook-сервер...")
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def main():
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+from telegram.error import Forbidden, RetryAfter
+
+from job_queue import get_queue
+
+logger = logging.getLogger(__name__)
+
+# Воркеры очереди задач (job_queue.py): расчёт карты и запрос к ИИ вне процесса бота.
+#   python worker.py                       # WORKER_PROCESSES процессов, все очереди
+#   python worker.py --processes 2 --queues recommendations
+#   python worker.py --stats               # состояние очередей
+# Бот ставит задачи при JOB_QUEUE_MODE=queue; ответ пользователю воркер отправляет сам.
+# Каждый процесс выполняет до WORKER_CONCURRENCY задач одновременно: расчёт — в потоках,
+# запросы к ИИ — через llm_scheduler (бюджет токенов и запросов, single-flight, повторы).
+# Бюджет OPENAI_TOKENS_PER_MINUTE / OPENAI_REQUESTS_PER_MINUTE делится поровну между процессами пула.
+# Временные сбои (OpenAI недоступен, геокодер, занятая база) — исключение: задача вернётся в очередь
+# с задержкой (nack), а после последней попытки пользователь получит понятное сообщение (GIVE_UP).
+
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", str(os.cpu_count() or 2)))
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+POLL_INTERVAL = 0.2
+MAX_POLL_INTERVAL = 2.0
+PURGE_EVERY = 3600.0
+
+# visibility — сколько задача невидима для других воркеров после claim; продлевается, пока идёт обработка
+QUEUES = {
+    "chart": {"visibility": 60.0},
+    "recommendations": {"visibility": 180.0},
+}
+
+
+async def handle_chart(bot, payload):
+    from astro_calc import build_chart, get_coordinates, save_user_data
+    from texts import CHART_SAVED_TEXT, CONTINUE_TEXT, FORMAT_HINT_TEXT, recommendations_keyboard
+
+    chat_id = payload["chat_id"]
+    telegram_id = payload["telegram_id"]
+    try:
+        lat, lon = await asyncio.to_thread(get_coordinates, payload["city"])
+        user_data = await asyncio.to_thread(
+            build_chart, telegram_id, payload["username"], payload["date"], payload["time"], payload["city"], lat, lon,
+        )
+    except ValueError as e:
+        # Ошибка в данных пользователя (дата, неизвестный город) — повтор не поможет.
+        # Остальное (Nominatim недоступен, база занята) — исключение, задачу повторит очередь
+        logger.info("Карта %s: неверные данные: %s", telegram_id, e)
+        await bot.send_message(chat_id=chat_id, text=FORMAT_HINT_TEXT)
+        return
+    await asyncio.to_thread(save_user_data, user_data, telegram_id)
+    await bot.send_message(chat_id=chat_id, text=CHART_SAVED_TEXT)
+    await bot.send_message(chat_id=chat_id, text=CONTINUE_TEXT, reply_markup=recommendations_keyboard())
+
+
+async def handle_recommendations(bot, payload):
+    from ai_interpreter import stream_transit_message
+    from texts import ENRICHMENT_HEADER, NO_CHART_TEXT, QUESTIONS_TEXT
+    from chart_store import load_chart
+    from llm_scheduler import DuplicateRequest, LLMUnavailable, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+
+    chat_id = payload["chat_id"]
+    chart = await asyncio.to_thread(load_chart, payload["telegram_id"])
+    if chart is None:
+        await bot.send_message(chat_id=chat_id, text=NO_CHART_TEXT)
+        return
+    planets = chart["planets"]
+    parts = []
+    try:
+        # LLMUnavailable после всех повторов планировщика уходит в process_job → nack
+        async for chunk in stream_transit_message(
+            planets["Нептун"], planets["Сатурн"], planets["Марс"], planets["Юпитер"], chart.aspect_records(),
+            user_id=payload["telegram_id"],
+            priority=PRIORITY_BACKGROUND if payload.get("enrichment") else PRIORITY_INTERACTIVE,
+        ):
+            parts.append(chunk)
+    except DuplicateRequest:
+        # Запрос этого пользователя уже идёт в этом процессе — ответит он
+        return
+    text = "".join(parts).strip()
+    if not text:
+        raise LLMUnavailable("пустой ответ модели")
+    if payload.get("enrichment"):
+        await bot.send_message(chat_id=chat_id, text=ENRICHMENT_HEADER + text, parse_mode="HTML")
+        return
+    await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+    await bot.send_message(chat_id=chat_id, text=QUESTIONS_TEXT, parse_mode="HTML", disable_web_page_preview=True)
+
+
+async def give_up_chart(bot, payload):
+    from texts import OVERLOADED_TEXT
+    await bot.send_message(chat_id=payload["chat_id"], text=OVERLOADED_TEXT)
+
+
+async def give_up_recommendations(bot, payload):
+    from llm_scheduler import UNAVAILABLE_TEXT
+    # Дополнение к уже отправленному ответу по правилам: без ИИ просто молчим
+    if not payload.get("enrichment"):
+        await bot.send_message(chat_id=payload["chat_id"], text=UNAVAILABLE_TEXT)
+
+
+HANDLERS = {
+    "chart": handle_chart,
+    "recommendations": handle_recommendations,
+}
+# Что сказать пользователю, когда попытки задачи кончились
+GIVE_UP = {
+    "chart": give_up_chart,
+    "recommendations": give_up_recommendations,
+}
+
+
+async def _heartbeat(queue, job, visibility):
+    # Долгий ответ ИИ не должен отдать задачу второму воркеру
+    while True:
+        await asyncio.sleep(visibility / 3)
+        if not await asyncio.to_thread(queue.extend, job, visibility):
+            logger.warning("%s: lease потерян", job)
+            return
+
+
+async def _give_up(bot, job):
+    try:
+        await GIVE_UP[job.queue](bot, job.payload)
+    except Exception as e:
+        logger.warning("%s: не удалось сообщить пользователю: %s", job, e)
+
+
+async def process_job(queue, bot, job):
+    if job.dead:
+        # Lease истёк на последней попытке (воркер упал или завис) — задача уже в dead
+        logger.warning("%s: попытки кончились по истечении lease", job)
+        await _give_up(bot, job)
+        return
+    visibility = QUEUES[job.queue]["visibility"]
+    heartbeat = asyncio.create_task(_heartbeat(queue, job, visibility))
+    try:
+        await HANDLERS[job.queue](bot, job.payload)
+    except RetryAfter as e:
+        await asyncio.to_thread(queue.nack, job, f"RetryAfter {e.retry_after}", float(e.retry_after))
+        if job.attempts >= job.max_attempts:
+            await _give_up(bot, job)
+    except Forbidden:
+        # Пользователь заблокировал бота — отвечать некому
+        await asyncio.to_thread(queue.ack, job)
+    except Exception as e:
+        logger.error("%s: ошибка: %s", job, e)
+        await asyncio.to_thread(queue.nack, job, f"{type(e).__name__}: {e}", 2.0 ** job.attempts)
+        if job.attempts >= job.max_attempts:
+            await _give_up(bot, job)
+    else:
+        if not await asyncio.to_thread(queue.ack, job):
+            logger.warning("%s: выполнена после истечения lease (возможен повтор)", job)
+    finally:
+        heartbeat.cancel()
+
+
+async def _consume(queue, bot, queues, stop):
+    idle = POLL_INTERVAL
+    while not stop.is_set():
+        job = None
+        for name in queues:
+            job = await asyncio.to_thread(queue.claim, name, QUEUES[name]["visibility"])
+            if job is not None:
+                break
+        if job is None:
+            await asyncio.sleep(idle)
+            idle = min(MAX_POLL_INTERVAL, idle * 2)
+            continue
+        idle = POLL_INTERVAL
+        await process_job(queue, bot, job)
+        # Следующую задачу начинаем с другой очереди, чтобы одна не вытесняла остальные
+        queues = queues[1:] + queues[:1]
+
+
+async def _purge(queue, stop):
+    while not stop.is_set():
+        removed = await asyncio.to_thread(queue.purge)
+        if removed:
+            logger.info("Удалено выполненных задач: %d", removed)
+        await asyncio.sleep(PURGE_EVERY)
+
+
+async def run_worker(queues, concurrency=WORKER_CONCURRENCY, stop=None, bot=None, purge=False, budget_share=1.0):
+    """Один процесс-воркер: concurrency одновременных задач из очередей queues.
+
+    budget_share — доля бюджета OpenAI этого процесса (1 / число процессов пула).
+    """
+    from broadcast import build_bot
+    from llm_scheduler import LLMScheduler, REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE, set_scheduler
+
+    set_scheduler(LLMScheduler(TOKENS_PER_MINUTE * budget_share, REQUESTS_PER_MINUTE * budget_share))
+    stop = stop or asyncio.Event()
+    queue = get_queue()
+    async with (bot or build_bot(concurrency)) as bot:
+        tasks = [asyncio.create_task(_consume(queue, bot, list(queues), stop)) for _ in range(concurrency)]
+        if purge:
+            purger = asyncio.create_task(_purge(queue, stop))
+        await asyncio.gather(*tasks)
+        if purge:
+            purger.cancel()
+
+
+def _process_main(queues, concurrency, stop, purge, budget_share):
+    logging.basicConfig(format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s", level=logging.INFO)
+    # Останавливает родитель через stop; Ctrl+C в терминале не должен обрывать задачи на середине
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.info("Воркер запущен: очереди %s, одновременно %d", ", ".join(queues), concurrency)
+    asyncio.run(run_worker(queues, concurrency, stop=stop, purge=purge, budget_share=budget_share))
+
+
+def start_pool(processes=WORKER_PROCESSES, queues=tuple(QUEUES), concurrency=WORKER_CONCURRENCY):
+    """Запустить процессы-воркеры. Возвращает (процессы, stop): stop.set() — завершить после текущих задач."""
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    pool = []
+    for i in range(processes):
+        process = context.Process(
+            target=_process_main, args=(list(queues), concurrency, stop, i == 0, 1.0 / processes),
+            name=f"worker-{i}", daemon=True,
+        )
+        process.start()
+        pool.append(process)
+    return pool, stop
+
+
+def print_stats():
+    for name, s in sorted(get_queue().stats().items()):
+        print(f"{name}: ждут {s['ready']}, в работе {s['in_flight']}, повтор {s['delayed']}, "
+              f"выполнено {s['done']}, dead {s['dead']}, {s['per_second']:.2f}/с, ожидание {s['avg_wait']:.2f} с")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Воркеры очереди задач")
+    parser.add_argument("--processes", type=int, default=WORKER_PROCESSES)
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="задач одновременно в процессе")
+    parser.add_argument("--queues", default=",".join(QUEUES))
+    parser.add_argument("--stats", action="store_true", help="показать состояние очередей и выйти")
+    args = parser.parse_args()
+
+    if args.stats:
+        print_stats()
+    else:
+        logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+        pool, stop = start_pool(args.processes, args.queues.split(","), args.concurrency)
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            while any(process.is_alive() for process in pool):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info("Останавливаем воркеры после текущих задач...")
+            stop.set()
+        for process in pool:
+            process.join()